@@ -1,8 +1,36 @@
 import streamlit as st
 import streamlit.components.v1 as components
-from gtts import gTTS
-import base64
+import json
+import logging
 import os
+import time
+import uuid
+
+import metrics
+from audio_sprite import ensure_sprite, publish_cues
+from ffmpeg_util import find_ffmpeg
+from music_ingest import IngestJob, voice_loudness
+from music_library import SHARED_OWNER, MusicLibrary, write_chunked
+from narration import MAX_SCRIPT_CHARS, NARRATION_SCRIPTS, split_sentences
+from session_history import SessionHistory, coerce_count
+from session_render import RenderJob, cached_render, render_key
+from timeline import compile_timeline, timeline_cues
+from tts_backends import create_backend
+from tts_cache import TTSCache
+from voice_assets import (
+    AUDIO_DIR,
+    CUE_DIR,
+    DEFAULT_LANG,
+    LANGUAGES,
+    LOCK_DIR,
+    SPRITE_DIR,
+    STATIC_DIR,
+    cue_engine,
+    prune_stale_sprites,
+    read_ready_marker,
+    voice_pack,
+)
+from voice_jobs import VoiceJobQueue
 
 # ==================== CẤU HÌNH TRANG ====================
 st.set_page_config(
@@ -12,6 +40,26 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
+# ==================== SỐ LIỆU ====================
+@st.cache_resource
+def get_metrics_server():
+    """Endpoint /metrics (Prometheus) khi đặt METRICS_PORT; cổng đã bị chiếm thì chỉ ghi log (một lần)"""
+    if not metrics.METRICS_PORT:
+        return None
+    try:
+        return metrics.start_http_server(metrics.METRICS_PORT)
+    except OSError as e:
+        # Thường là process khác trên cùng máy đã mở cổng này: mỗi process cần METRICS_PORT riêng
+        logging.getLogger(__name__).warning("Không mở được /metrics trên cổng %s: %s", metrics.METRICS_PORT, e)
+        return None
+
+@st.cache_resource
+def get_rerun_profiler():
+    """Profiler giữ N lần rerun chậm nhất khi đặt PROFILE_SLOWEST"""
+    return metrics.RerunProfiler(metrics.PROFILE_SLOWEST) if metrics.PROFILE_SLOWEST else None
+
+get_metrics_server()
+
 # ==================== CSS ====================
 st.markdown("""
 <style>
@@ -20,863 +68,1019 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+# ==================== ĐƯỜNG DẪN ====================
+# Kho nhạc nền theo hash nội dung (file không bao giờ bị ghi đè)
+MUSIC_DIR = os.path.join(STATIC_DIR, "music")
+# Nhạc nền một file duy nhất của các phiên bản cũ -> chuyển vào thư viện dùng chung
+LEGACY_MUSIC_FILES = [os.path.join(STATIC_DIR, "meditation_music.mp3"), "meditation_music.mp3"]
+# File upload chờ xử lý, database thư viện và file gốc - không phục vụ qua static
+MUSIC_WORK_DIR = "music"
+MUSIC_DB = os.path.join(MUSIC_WORK_DIR, "library.db")
+ORIGINAL_MUSIC_DIR = os.path.join(MUSIC_WORK_DIR, "originals")
+HISTORY_DB = os.path.join("history", "sessions.db")
+PLAYER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "player")
+RENDER_DIR = os.path.join(STATIC_DIR, "renders")
+RENDER_WORK_DIR = os.path.join(MUSIC_WORK_DIR, "pcm")  # nhạc nền đã giải mã cho render, không phục vụ công khai
+# Số luồng tạo giọng nói song song
+TTS_WORKERS = int(os.environ.get("TTS_WORKERS", "6"))
+
+# ==================== CÀI ĐẶT MẶC ĐỊNH ====================
+DEFAULT_SETTINGS = {
+    "prepare_time": 10,
+    "total_cycles": 10,  # 0 = infinite
+    "two_phase_mode": False,
+    "phase1_cycles": 0,
+    "inhale_time": 4,
+    "hold_time": 4,
+    "exhale_time": 6,
+    "inhale_time2": 2,
+    "hold_time2": 0,
+    "exhale_time2": 4,
+    "prepare_countdown_voice": True,
+    "voice_lang": DEFAULT_LANG,
+    "voice_volume": 0.8,
+    "music_volume": 0.3,
+}
+
 # ==================== SESSION STATE ====================
-if 'audio_generated' not in st.session_state:
-    st.session_state.audio_generated = False
+if 'meditation_settings' not in st.session_state:
+    st.session_state.meditation_settings = dict(DEFAULT_SETTINGS)
+if 'last_session' not in st.session_state:
+    st.session_state.last_session = None
+    st.session_state.player_event_id = None
+if 'music_track' not in st.session_state:
+    st.session_state.music_track = None  # None = bài dùng gần nhất, "" = không nhạc
 
 # ==================== FUNCTIONS ====================
-def generate_audio_file(text, filename):
-    """Tạo file audio từ text bằng gTTS"""
-    audio_dir = "audio"
-    if not os.path.exists(audio_dir):
-        os.makedirs(audio_dir)
-    
-    filepath = os.path.join(audio_dir, filename)
-    
-    if not os.path.exists(filepath):
-        try:
-            tts = gTTS(text=text, lang='vi', slow=False)
-            tts.save(filepath)
-            return True
-        except Exception as e:
-            st.error(f"Lỗi tạo audio: {e}")
-            return False
-    return True
-
-def get_audio_base64(file_path):
-    """Chuyển audio thành base64"""
+@st.cache_resource
+def get_tts_cache():
+    """Cache giọng nói dùng chung cho cả process"""
+    return TTSCache(AUDIO_DIR)
+
+@st.cache_resource
+def get_tts_backend():
+    """Engine TTS dùng chung, chọn bằng TTS_BACKEND (gtts / espeak / stub)"""
+    return create_backend(pool_size=TTS_WORKERS)
+
+@st.cache_resource
+def get_voice_jobs():
+    """Hàng đợi tạo giọng nói chạy nền, dùng chung cho mọi session của process"""
+    return VoiceJobQueue(get_tts_cache(), get_tts_backend(), TTS_WORKERS)
+
+def voice_lang():
+    """Ngôn ngữ giọng đọc đang chọn"""
+    return st.session_state.meditation_settings.get("voice_lang", DEFAULT_LANG)
+
+def voice_ready_info():
+    """Nội dung marker giọng nói của ngôn ngữ đang chọn (thời điểm, nguồn: app / warmup, gói) hoặc None"""
+    return read_ready_marker(cue_engine(get_tts_backend()), voice_lang())
+
+def is_voice_ready():
+    """Giọng nói đã được tạo (bởi session, process bất kỳ hay lệnh warmup) chưa"""
+    return voice_ready_info() is not None
+
+def static_url(filename, version=None):
+    """URL tuyệt đối của file trong static/ (dùng được cả trong iframe component)"""
+    base = (st.get_option("server.baseUrlPath") or "").strip("/")
+    url = f"/{base}/app/static/{filename}" if base else f"/app/static/{filename}"
+    if version is not None:
+        url += f"?v={version}"
+    return url
+
+@st.cache_resource
+def get_music_library():
+    """Thư viện nhạc dùng chung cho cả process"""
+    library = MusicLibrary(MUSIC_DB, MUSIC_DIR)
+    for path in LEGACY_MUSIC_FILES:
+        if os.path.exists(path):
+            library.import_file(path, SHARED_OWNER, "Nhạc nền")
+    return library
+
+def get_user_id():
+    """Người dùng hiện tại: email khi app bật đăng nhập, ngược lại id ẩn danh giữ trên URL (?uid=)"""
+    user = getattr(st, "user", None)
+    if user is not None and user.get("is_logged_in") and user.get("email"):
+        return user.get("email")
+    uid = st.query_params.get("uid")
+    if not uid:
+        uid = uuid.uuid4().hex[:16]
+        st.query_params["uid"] = uid
+    return uid
+
+def get_music_track():
+    """Bài nhạc nền session đang chọn (dict của thư viện) hoặc None"""
+    selected = st.session_state.music_track
+    if selected == "":
+        return None  # đã chọn "không có nhạc"
+    tracks = get_music_library().tracks(st.session_state.user_id)
+    for track in tracks:
+        if track["sha256"] == selected:
+            return track
+    return tracks[0] if tracks else None
+
+def get_music_file():
+    track = get_music_track()
+    return get_music_library().track_path(track["sha256"]) if track else None
+
+def get_music_url():
+    """URL nhạc nền (phát dạng stream, hỗ trợ Range) hoặc None nếu chưa có nhạc"""
+    track = get_music_track()
+    if not track:
+        return None
+    # Tên file là hash nội dung nên URL tự đổi khi đổi bài, không cần ?v=
+    return static_url(f"music/{MusicLibrary.track_filename(track['sha256'])}")
+
+def get_cue_files(lang=None):
+    """{cue: (memoryview trong voice pack, sha256)} của tất cả cue giọng nói (gói map một lần cho cả process)"""
+    return voice_pack(get_tts_cache(), get_tts_backend(), lang or voice_lang()).sources()
+
+@st.cache_resource(show_spinner=False)
+def build_voice_sprite(engine, lang, cues):
+    """Gộp các cue cần phát thành một sprite, một lần cho cả process (theo engine + ngôn ngữ + bộ cue)"""
+    pack = voice_pack(get_tts_cache(), get_tts_backend(), lang)
+    sources = pack.sources()
+    with metrics.span("sprite_build"):
+        sprite_map = ensure_sprite({cue: sources[cue] for cue in cues}, SPRITE_DIR, LOCK_DIR, os.path.basename(pack.path))
+        published = publish_cues(sources, CUE_DIR, LOCK_DIR)
+    prune_stale_sprites()  # sprite mới: dọn sprite / cue của gói cũ và sprite tạm
+    return {"file": sprite_map["file"], "cues": sprite_map["cues"], **published}
+
+@metrics.timed("voice_sprite")
+def get_voice_sprite(cues):
+    """Sprite của các cue ``cues``: {"url", "cues": {cue: {offset, duration}}, "base", "ext"} hoặc None.
+
+    Cue ngoài sprite (khi cài đặt đổi giữa phiên) player tải riêng tại ``base + cue + ext``.
+    """
+    engine = cue_engine(get_tts_backend())
+    cues = tuple(cues)
     try:
-        with open(file_path, "rb") as f:
-            data = f.read()
-            return base64.b64encode(data).decode()
-    except:
+        sprite = build_voice_sprite(engine, voice_lang(), cues)
+        if not os.path.exists(os.path.join(SPRITE_DIR, sprite["file"])) or not os.path.isdir(
+            os.path.join(CUE_DIR, sprite["dir"])
+        ):
+            build_voice_sprite.clear()
+            sprite = build_voice_sprite(engine, voice_lang(), cues)
+    except Exception as e:
+        st.error(f"Lỗi chuẩn bị giọng nói: {e}")
         return None
+    return sprite_args(sprite)
 
-def pregenerate_audio_files():
-    """Tạo sẵn tất cả file audio cần thiết"""
-    audio_texts = {
-        "prepare.mp3": "Hãy ngồi thoải mái và chuẩn bị tinh thần",
-        "ready.mp3": "Chuẩn bị bắt đầu",
-        "inhale.mp3": "Hít vào",
-        "hold.mp3": "Giữ hơi",
-        "exhale.mp3": "Thở ra",
-        "complete.mp3": "Hoàn thành. Chúc mừng bạn",
-        "phase2.mp3": "Chuyển sang giai đoạn 2",
-        # Countdown numbers
-        "countdown_10.mp3": "10",
-        "countdown_9.mp3": "9",
-        "countdown_8.mp3": "8",
-        "countdown_7.mp3": "7",
-        "countdown_6.mp3": "6",
-        "countdown_5.mp3": "5",
-        "countdown_4.mp3": "4",
-        "countdown_3.mp3": "3",
-        "countdown_2.mp3": "2",
-        "countdown_1.mp3": "1"
+def get_partial_voice_sprite(job, cues):
+    """Sprite tạm từ các cue đã tạo xong khi giọng nói đang được chuẩn bị (player bỏ qua cue còn thiếu)"""
+    sources = job.sources()
+    try:
+        with metrics.span("sprite_build"):
+            sprite_map = ensure_sprite({cue: sources[cue] for cue in cues if cue in sources}, SPRITE_DIR, LOCK_DIR)
+            published = publish_cues(sources, CUE_DIR, LOCK_DIR)
+    except Exception as e:
+        st.error(f"Lỗi chuẩn bị giọng nói: {e}")
+        return None
+    return sprite_args({"file": sprite_map["file"], "cues": sprite_map["cues"], **published})
+
+def sprite_args(sprite):
+    """Tham số sprite gửi cho player"""
+    return {
+        "url": static_url(f"sprites/{sprite['file']}"),
+        "cues": sprite["cues"],
+        "base": static_url(f"cues/{sprite['dir']}/"),
+        "ext": sprite["ext"],
     }
+
+@st.cache_data(show_spinner=False, max_entries=256)
+def get_session_timeline(prepare_time, phase1, phase2, total_cycles, phase1_cycles, countdown_voice):
+    """Timeline đã biên dịch, dùng chung giữa các session có cùng cài đặt"""
+    return compile_timeline(
+        prepare_time,
+        phase1,
+        phase2,
+        total_cycles=total_cycles,
+        phase1_cycles=phase1_cycles,
+        countdown_voice=countdown_voice,
+    )
+
+@st.cache_resource(show_spinner=False)
+def get_voice_loudness(engine, lang):
+    """Độ to của giọng đọc (dBFS), làm mốc chuẩn hóa nhạc nền"""
+    return voice_loudness([source for source, _ in get_cue_files(lang).values()])
+
+@st.cache_resource
+def get_music_jobs():
+    """Các job xử lý nhạc nền đang chạy: job id -> IngestJob"""
+    return {}
+
+def start_music_ingest(uploaded_music, keep_original, shared):
+    """Lưu file upload vào thư viện; trả về (job xử lý nền hoặc None, sha256 của bài)"""
+    library = get_music_library()
+    owner = SHARED_OWNER if shared else st.session_state.user_id
+    name = uploaded_music.name
     
-    with st.spinner("🎵 Đang chuẩn bị giọng nói..."):
-        for filename, text in audio_texts.items():
-            generate_audio_file(text, filename)
+    # Ghi từng khối ra file tạm, vừa ghi vừa tính hash
+    uploaded_music.seek(0)
+    src, sha256, _ = write_chunked(uploaded_music, MUSIC_WORK_DIR)
+    if library.has_track(sha256) and library.add_to_library(owner, sha256, name):
+        # Bài đã có trong kho (ai đó đã upload) -> không xử lý lại
+        os.remove(src)
+        return None, sha256
     
-    st.session_state.audio_generated = True
+    try:
+        find_ffmpeg()
+    except RuntimeError as e:
+        # Không có ffmpeg -> lưu nguyên file như trước
+        st.warning(f"⚠️ {e}. Nhạc được lưu nguyên bản, không nén.")
+        library.add_track(sha256, src, owner=owner, name=name)
+        return None, sha256
+    
+    target_db = None
+    if is_voice_ready():
+        try:
+            target_db = get_voice_loudness(cue_engine(get_tts_backend()), voice_lang())
+        except Exception:
+            pass  # không đo được giọng -> dùng mức mặc định
+    
+    def on_done(result):
+        metrics.observe("music_ingest", result["elapsed"])
+        library.add_track(sha256, dest, result["duration"], owner=owner, name=name)
+    
+    dest = library.track_path(sha256)
+    job = IngestJob(
+        src,
+        dest,
+        target_db=target_db,
+        keep_original=os.path.join(ORIGINAL_MUSIC_DIR, MusicLibrary.track_filename(sha256)) if keep_original else None,
+        on_done=on_done,
+    )
+    get_music_jobs()[job.id] = job
+    return job.start(), sha256
 
-# ==================== GIAO DIỆN CHÍNH ====================
-st.title("🧘 Thiền Hơi Thở Cho Người Mới")
-st.markdown("### _Hướng dẫn hơi thở có giọng nói tiếng Việt_")
+@st.cache_resource
+def get_render_jobs():
+    """Các job render file audio cả phiên: khóa render -> RenderJob (cùng cài đặt dùng chung một job)"""
+    return {}
 
-# ==================== CÀI ĐẶT ====================
-st.markdown("---")
-st.subheader("⚙️ Cài Đặt")
-
-col1, col2 = st.columns(2)
-
-with col1:
-    prepare_time = st.number_input(
-        "⏱️ Chuẩn bị (giây)",
-        min_value=3,
-        max_value=30,
-        value=10,
-        step=1,
-        help="Thời gian chuẩn bị tinh thần trước khi bắt đầu thiền"
+def start_render(key, session_timeline, cue_files, music_file, voice_volume, music_volume):
+    """Render cả phiên trong luồng nền; đã có job đang chạy cho cùng khóa thì dùng lại"""
+    jobs = get_render_jobs()
+    job = jobs.get(key)
+    if job is not None and job.status != "error":
+        return job
+    
+    def on_done(job):
+        metrics.observe("session_render", job.elapsed)
+        metrics.inc("session_render_bytes", os.path.getsize(os.path.join(RENDER_DIR, job.filename)))
+    
+    job = jobs[key] = RenderJob(
+        key, session_timeline, cue_files, music_file, RENDER_DIR, LOCK_DIR, RENDER_WORK_DIR,
+        voice_volume=voice_volume, music_volume=music_volume, on_done=on_done,
     )
+    return job.start()
 
-with col2:
-    infinite_mode = st.checkbox(
-        "♾️ Chế độ vô hạn",
-        value=False,
-        help="Thiền không giới hạn số chu kỳ - dừng khi muốn"
+def current_timeline():
+    """Timeline theo cài đặt hiện tại của session"""
+    settings = st.session_state.meditation_settings
+    return get_session_timeline(
+        settings["prepare_time"],
+        (settings["inhale_time"], settings["hold_time"], settings["exhale_time"]),
+        (settings["inhale_time2"], settings["hold_time2"], settings["exhale_time2"]) if settings["two_phase_mode"] else None,
+        settings["total_cycles"],
+        settings["phase1_cycles"],
+        settings["prepare_countdown_voice"],
     )
 
-if not infinite_mode:
-    total_cycles = st.number_input(
-        "🔄 Số chu kỳ",
-        min_value=1,
-        max_value=999,
-        value=10,
-        step=1,
-        help="Số chu kỳ hít vào - giữ hơi - thở ra"
-    )
-else:
-    total_cycles = 0  # 0 = infinite
-    st.info("♾️ Chế độ vô hạn: Thiền sẽ tiếp tục cho đến khi bạn nhấn Dừng")
-
-# ==================== CHẾ ĐỘ 2 GIAI ĐOẠN ====================
-st.markdown("---")
-st.subheader("🔀 Chế Độ 2 Giai Đoạn Hít Thở")
-
-two_phase_mode = st.checkbox(
-    "🌊 Bật chế độ 2 giai đoạn",
-    value=False,
-    help="Chia thành 2 giai đoạn với cách thở khác nhau (ví dụ: Wim Hof Method)"
-)
+meditation_player = components.declare_component("meditation_player", path=PLAYER_DIR)
 
-if two_phase_mode and not infinite_mode:
-    phase1_cycles = st.number_input(
-        "🌬️ Số chu kỳ Giai đoạn 1",
-        min_value=1,
-        max_value=total_cycles,
-        value=min(5, total_cycles),
-        step=1,
-        help="Số chu kỳ thở theo setup đầu tiên (ví dụ: thở nhanh, sâu)"
-    )
-    st.info(f"ℹ️ Giai đoạn 2 sẽ có {total_cycles - phase1_cycles} chu kỳ còn lại")
-elif two_phase_mode and infinite_mode:
-    phase1_cycles = st.number_input(
-        "🌬️ Số chu kỳ Giai đoạn 1",
-        min_value=1,
-        max_value=100,
-        value=10,
-        step=1,
-        help="Số chu kỳ thở theo setup đầu tiên, sau đó chuyển sang giai đoạn 2 vô hạn"
-    )
-else:
-    phase1_cycles = 0
-
-# ==================== GIAI ĐOẠN 1 ====================
-st.markdown("---")
-if two_phase_mode:
-    st.markdown("#### 🌬️ Giai Đoạn 1 - Thời gian hơi thở")
-else:
-    st.markdown("#### 🌬️ Thời gian hơi thở")
-
-col3, col4, col5 = st.columns(3)
-
-with col3:
-    inhale_time = st.number_input(
-        "🌬️ Hít vào (giây)" + (" - Phase 1" if two_phase_mode else ""),
-        min_value=2,
-        max_value=10,
-        value=4,
-        step=1,
-        key="inhale1"
-    )
+def update_settings(**values):
+    """Ghi vào object cài đặt dùng chung"""
+    st.session_state.meditation_settings.update(values)
 
-with col4:
-    hold_time = st.number_input(
-        "⏸️ Giữ hơi (giây)" + (" - Phase 1" if two_phase_mode else ""),
-        min_value=0,
-        max_value=10,
-        value=4,
-        step=1,
-        help="Thời gian giữ hơi sau khi hít vào (có thể để 0 để bỏ qua)",
-        key="hold1"
-    )
+@st.cache_resource
+def get_session_history():
+    """Kho lịch sử phiên thiền (một luồng ghi nền) dùng chung cho cả process"""
+    return SessionHistory(HISTORY_DB)
 
-with col5:
-    exhale_time = st.number_input(
-        "💨 Thở ra (giây)" + (" - Phase 1" if two_phase_mode else ""),
-        min_value=2,
-        max_value=10,
-        value=6,
-        step=1,
-        key="exhale1"
-    )
+def handle_player_event(event):
+    """Xử lý sự kiện player gửi về (mỗi sự kiện chỉ xử lý một lần)"""
+    if not event or event.get("id") == st.session_state.player_event_id:
+        return
+    st.session_state.player_event_id = event["id"]
+    if event.get("session") and event["type"] in ("start", "phase", "complete", "stop"):
+        # Ghi vào hàng đợi, luồng nền ghi xuống đĩa -> không chặn lần rerun này
+        metrics.inc("history_events", type=event["type"])
+        get_session_history().record(
+            st.session_state.user_id,
+            event["session"],
+            event["type"],
+            f"{event['session']}:{event['id']}",
+            day=event.get("day"),
+            cycles=event.get("cycles"),
+            duration=event.get("duration"),
+            phase=event.get("phase"),
+            settings=st.session_state.meditation_settings if event["type"] == "start" else None,
+        )
+    if event["type"] in ("complete", "stop"):
+        st.session_state.last_session = {
+            "type": event["type"],
+            "cycles": coerce_count(event.get("cycles")) or 0,
+            "duration": coerce_count(event.get("duration")) or 0,
+        }
 
-cycle_duration = inhale_time + hold_time + exhale_time
-st.info(f"⏱️ Tổng thời gian 1 chu kỳ (Giai đoạn 1): **{cycle_duration} giây** (Hít: {inhale_time}s + Giữ: {hold_time}s + Thở: {exhale_time}s)")
+if 'user_id' not in st.session_state:
+    st.session_state.user_id = get_user_id()
 
-# ==================== GIAI ĐOẠN 2 ====================
-if two_phase_mode:
-    st.markdown("#### 💨 Giai Đoạn 2 - Thời gian hơi thở")
+# ==================== CÀI ĐẶT ====================
+# Panel ghi giá trị vào st.session_state.meditation_settings (dùng chung).
+# Thời gian, 2 giai đoạn và giọng đọc đổi timeline / sprite của player nên vẫn
+# chạy cùng cả app (không phải fragment: fragment chạy lại rồi còn phải chạy lại
+# cả app). Chỉ âm lượng (player đọc trực tiếp) nằm trong fragment player_panel.
+@metrics.timed("panel_timing")
+def timing_settings():
+    st.markdown("---")
+    st.subheader("⚙️ Cài Đặt")
+    
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        prepare_time = st.number_input(
+            "⏱️ Chuẩn bị (giây)",
+            min_value=3,
+            max_value=30,
+            value=DEFAULT_SETTINGS["prepare_time"],
+            step=1,
+            help="Thời gian chuẩn bị tinh thần trước khi bắt đầu thiền",
+            key="prepare_time"
+        )
+    
+    with col2:
+        infinite_mode = st.checkbox(
+            "♾️ Chế độ vô hạn",
+            value=False,
+            help="Thiền không giới hạn số chu kỳ - dừng khi muốn",
+            key="infinite_mode"
+        )
+    
+    if not infinite_mode:
+        total_cycles = st.number_input(
+            "🔄 Số chu kỳ",
+            min_value=1,
+            max_value=999,
+            value=DEFAULT_SETTINGS["total_cycles"],
+            step=1,
+            help="Số chu kỳ hít vào - giữ hơi - thở ra",
+            key="total_cycles"
+        )
+    else:
+        total_cycles = 0  # 0 = infinite
+        st.info("♾️ Chế độ vô hạn: Thiền sẽ tiếp tục cho đến khi bạn nhấn Dừng")
     
-    col6, col7, col8 = st.columns(3)
+    update_settings(prepare_time=prepare_time, total_cycles=total_cycles)
+
+@metrics.timed("panel_two_phase")
+def two_phase_settings():
+    st.markdown("---")
+    st.subheader("🔀 Chế Độ 2 Giai Đoạn Hít Thở")
+    
+    total_cycles = st.session_state.meditation_settings["total_cycles"]
+    infinite_mode = total_cycles == 0
+    
+    two_phase_mode = st.checkbox(
+        "🌊 Bật chế độ 2 giai đoạn",
+        value=False,
+        help="Chia thành 2 giai đoạn với cách thở khác nhau (ví dụ: Wim Hof Method)",
+        key="two_phase_mode"
+    )
+    
+    if two_phase_mode and not infinite_mode:
+        phase1_cycles = st.number_input(
+            "🌬️ Số chu kỳ Giai đoạn 1",
+            min_value=1,
+            max_value=total_cycles,
+            value=min(5, total_cycles),
+            step=1,
+            help="Số chu kỳ thở theo setup đầu tiên (ví dụ: thở nhanh, sâu)",
+            key="phase1_cycles"
+        )
+        st.info(f"ℹ️ Giai đoạn 2 sẽ có {total_cycles - phase1_cycles} chu kỳ còn lại")
+    elif two_phase_mode and infinite_mode:
+        phase1_cycles = st.number_input(
+            "🌬️ Số chu kỳ Giai đoạn 1",
+            min_value=1,
+            max_value=100,
+            value=10,
+            step=1,
+            help="Số chu kỳ thở theo setup đầu tiên, sau đó chuyển sang giai đoạn 2 vô hạn",
+            key="phase1_cycles_infinite"
+        )
+    else:
+        phase1_cycles = 0
+    
+    update_settings(two_phase_mode=two_phase_mode, phase1_cycles=phase1_cycles)
+
+@metrics.timed("panel_breathing")
+def breathing_settings():
+    two_phase_mode = st.session_state.meditation_settings["two_phase_mode"]
     
-    with col6:
-        inhale_time2 = st.number_input(
-            "🌬️ Hít vào (giây) - Phase 2",
+    # ==================== GIAI ĐOẠN 1 ====================
+    st.markdown("---")
+    if two_phase_mode:
+        st.markdown("#### 🌬️ Giai Đoạn 1 - Thời gian hơi thở")
+    else:
+        st.markdown("#### 🌬️ Thời gian hơi thở")
+    
+    col3, col4, col5 = st.columns(3)
+    
+    with col3:
+        inhale_time = st.number_input(
+            "🌬️ Hít vào (giây)" + (" - Phase 1" if two_phase_mode else ""),
             min_value=2,
             max_value=10,
-            value=2,
+            value=DEFAULT_SETTINGS["inhale_time"],
             step=1,
-            key="inhale2"
+            key="inhale1"
         )
     
-    with col7:
-        hold_time2 = st.number_input(
-            "⏸️ Giữ hơi (giây) - Phase 2",
+    with col4:
+        hold_time = st.number_input(
+            "⏸️ Giữ hơi (giây)" + (" - Phase 1" if two_phase_mode else ""),
             min_value=0,
             max_value=10,
-            value=0,
+            value=DEFAULT_SETTINGS["hold_time"],
             step=1,
-            key="hold2"
+            help="Thời gian giữ hơi sau khi hít vào (có thể để 0 để bỏ qua)",
+            key="hold1"
         )
     
-    with col8:
-        exhale_time2 = st.number_input(
-            "💨 Thở ra (giây) - Phase 2",
+    with col5:
+        exhale_time = st.number_input(
+            "💨 Thở ra (giây)" + (" - Phase 1" if two_phase_mode else ""),
             min_value=2,
             max_value=10,
-            value=4,
+            value=DEFAULT_SETTINGS["exhale_time"],
             step=1,
-            key="exhale2"
+            key="exhale1"
         )
     
-    cycle_duration2 = inhale_time2 + hold_time2 + exhale_time2
-    st.info(f"⏱️ Tổng thời gian 1 chu kỳ (Giai đoạn 2): **{cycle_duration2} giây** (Hít: {inhale_time2}s + Giữ: {hold_time2}s + Thở: {exhale_time2}s)")
-else:
-    inhale_time2 = inhale_time
-    hold_time2 = hold_time
-    exhale_time2 = exhale_time
-
-# ==================== TÙY CHỌN GIỌNG ĐỌC ====================
-st.markdown("---")
-st.subheader("🗣️ Tùy Chọn Giọng Đọc")
-
-prepare_countdown_voice = st.checkbox(
-    "⏱️ Đọc số đếm ngược chuẩn bị",
-    value=True,
-    help="Giọng đọc sẽ đọc số khi đếm ngược giai đoạn chuẩn bị (10, 9, 8...)"
-)
+    cycle_duration = inhale_time + hold_time + exhale_time
+    st.info(f"⏱️ Tổng thời gian 1 chu kỳ (Giai đoạn 1): **{cycle_duration} giây** (Hít: {inhale_time}s + Giữ: {hold_time}s + Thở: {exhale_time}s)")
+    
+    # ==================== GIAI ĐOẠN 2 ====================
+    if two_phase_mode:
+        st.markdown("#### 💨 Giai Đoạn 2 - Thời gian hơi thở")
+        
+        col6, col7, col8 = st.columns(3)
+        
+        with col6:
+            inhale_time2 = st.number_input(
+                "🌬️ Hít vào (giây) - Phase 2",
+                min_value=2,
+                max_value=10,
+                value=DEFAULT_SETTINGS["inhale_time2"],
+                step=1,
+                key="inhale2"
+            )
+        
+        with col7:
+            hold_time2 = st.number_input(
+                "⏸️ Giữ hơi (giây) - Phase 2",
+                min_value=0,
+                max_value=10,
+                value=DEFAULT_SETTINGS["hold_time2"],
+                step=1,
+                key="hold2"
+            )
+        
+        with col8:
+            exhale_time2 = st.number_input(
+                "💨 Thở ra (giây) - Phase 2",
+                min_value=2,
+                max_value=10,
+                value=DEFAULT_SETTINGS["exhale_time2"],
+                step=1,
+                key="exhale2"
+            )
+        
+        cycle_duration2 = inhale_time2 + hold_time2 + exhale_time2
+        st.info(f"⏱️ Tổng thời gian 1 chu kỳ (Giai đoạn 2): **{cycle_duration2} giây** (Hít: {inhale_time2}s + Giữ: {hold_time2}s + Thở: {exhale_time2}s)")
+    else:
+        inhale_time2 = inhale_time
+        hold_time2 = hold_time
+        exhale_time2 = exhale_time
+    
+    update_settings(
+        inhale_time=inhale_time, hold_time=hold_time, exhale_time=exhale_time,
+        inhale_time2=inhale_time2, hold_time2=hold_time2, exhale_time2=exhale_time2,
+    )
 
-st.info("ℹ️ **Trong lúc thiền**: Chỉ đọc 'Hít vào', 'Giữ hơi' và 'Thở ra' - KHÔNG đọc số đếm giây")
-
-# ==================== ÂM LƯỢNG ====================
-st.markdown("---")
-st.subheader("🔊 Âm Lượng")
-
-col_v1, col_v2 = st.columns(2)
-
-with col_v1:
-    voice_volume = st.slider(
-        "🗣️ Giọng đọc",
-        min_value=0,
-        max_value=100,
-        value=80,
-        step=5
-    ) / 100
-
-with col_v2:
-    music_volume = st.slider(
-        "🎵 Nhạc nền",
-        min_value=0,
-        max_value=100,
-        value=30,
-        step=5
-    ) / 100
-
-# ==================== NHẠC NỀN ====================
-st.markdown("---")
-
-music_b64 = None
-if os.path.exists("meditation_music.mp3"):
-    st.success("✅ Nhạc nền đã sẵn sàng - sẽ tự động phát khi bắt đầu thiền")
-    music_b64 = get_audio_base64("meditation_music.mp3")
-    if not music_b64:
-        st.warning("⚠️ File nhạc quá lớn, không thể tự động phát. Dùng audio player thủ công bên dưới:")
-        st.audio("meditation_music.mp3", format="audio/mp3")
-else:
-    st.warning("⚠️ Chưa có file nhạc nền. Upload file MP3 bên dưới.")
-
-# ==================== CHUẨN BỊ AUDIO ====================
-if not st.session_state.audio_generated:
-    if st.button("🎙️ Chuẩn Bị Giọng Nói", type="primary", use_container_width=True):
-        pregenerate_audio_files()
-        st.success("✅ Đã tạo xong file giọng nói!")
-        st.rerun()
-else:
-    # Load audio base64
-    prepare_b64 = get_audio_base64("audio/prepare.mp3")
-    ready_b64 = get_audio_base64("audio/ready.mp3")
-    inhale_b64 = get_audio_base64("audio/inhale.mp3")
-    hold_b64 = get_audio_base64("audio/hold.mp3")
-    exhale_b64 = get_audio_base64("audio/exhale.mp3")
-    complete_b64 = get_audio_base64("audio/complete.mp3")
-    phase2_b64 = get_audio_base64("audio/phase2.mp3")
-    
-    # Load countdown audio
-    countdown_audios = {}
-    for i in range(1, 11):
-        audio_b64 = get_audio_base64(f"audio/countdown_{i}.mp3")
-        if audio_b64:
-            countdown_audios[i] = audio_b64
-    
-    # ==================== APP THIỀN (HTML COMPONENT) ====================
+@metrics.timed("panel_voice")
+def voice_settings():
     st.markdown("---")
+    st.subheader("🗣️ Tùy Chọn Giọng Đọc")
     
-    countdown_js = "{\n"
-    for num, b64 in countdown_audios.items():
-        countdown_js += f'        {num}: "data:audio/mp3;base64,{b64}",\n'
-    countdown_js += "    }"
-    
-    meditation_html = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <style>
-            body {{
-                margin: 0;
-                padding: 20px;
-                font-family: Arial, sans-serif;
-            }}
-            
-            .big-status {{
-                font-size: 48px;
-                font-weight: bold;
-                text-align: center;
-                padding: 40px;
-                border-radius: 20px;
-                margin: 20px 0;
-                animation: pulse 2s ease-in-out infinite;
-            }}
-            
-            .prepare {{
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                color: white;
-            }}
-            
-            .inhale {{ 
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                color: white;
-            }}
-            
-            .hold {{
-                background: linear-gradient(135deg, #f093fb 0%, #f5576c 100%);
-                color: white;
-            }}
-            
-            .exhale {{ 
-                background: linear-gradient(135deg, #43e97b 0%, #38f9d7 100%);
-                color: white;
-            }}
-            
-            .complete {{
-                background: linear-gradient(135deg, #fad961 0%, #f76b1c 100%);
-                color: white;
-            }}
-            
-            .phase2-transition {{
-                background: linear-gradient(135deg, #fa709a 0%, #fee140 100%);
-                color: white;
-                font-size: 36px;
-            }}
-            
-            @keyframes pulse {{
-                0%, 100% {{ transform: scale(1); }}
-                50% {{ transform: scale(1.05); }}
-            }}
-            
-            .countdown-timer {{
-                font-size: 72px;
-                font-weight: bold;
-                margin-top: 20px;
-                animation: countdown-pulse 1s ease-in-out infinite;
-            }}
-            
-            @keyframes countdown-pulse {{
-                0%, 100% {{ transform: scale(1); opacity: 1; }}
-                50% {{ transform: scale(1.1); opacity: 0.8; }}
-            }}
-            
-            .cycle-info {{
-                font-size: 20px;
-                font-weight: bold;
-                text-align: center;
-                padding: 15px;
-                background: #f0f2f6;
-                border-radius: 10px;
-                margin: 10px 0;
-            }}
-            
-            .phase-badge {{
-                display: inline-block;
-                background: #3498db;
-                color: white;
-                padding: 5px 15px;
-                border-radius: 20px;
-                font-size: 16px;
-                margin-left: 10px;
-            }}
-            
-            button {{
-                width: 48%;
-                padding: 15px;
-                font-size: 18px;
-                font-weight: bold;
-                border: none;
-                border-radius: 10px;
-                cursor: pointer;
-                margin: 5px;
-            }}
-            
-            .start-btn {{
-                background: #27ae60;
-                color: white;
-            }}
-            
-            .stop-btn {{
-                background: #e74c3c;
-                color: white;
-            }}
-            
-            button:hover {{
-                opacity: 0.9;
-            }}
-            
-            button:disabled {{
-                opacity: 0.5;
-                cursor: not-allowed;
-            }}
-            
-            progress {{
-                width: 100%;
-                height: 30px;
-                border-radius: 10px;
-            }}
-        </style>
-    </head>
-    <body>
-        <div id="status-display"></div>
-        <div id="cycle-display"></div>
-        <div id="progress-display"></div>
+    prepare_countdown_voice = st.checkbox(
+        "⏱️ Đọc số đếm ngược chuẩn bị",
+        value=DEFAULT_SETTINGS["prepare_countdown_voice"],
+        help="Giọng đọc sẽ đọc số khi đếm ngược giai đoạn chuẩn bị (10, 9, 8...)",
+        key="prepare_countdown_voice"
+    )
+    
+    st.info("ℹ️ **Trong lúc thiền**: Chỉ đọc 'Hít vào', 'Giữ hơi' và 'Thở ra' - KHÔNG đọc số đếm giây")
+    
+    lang = st.selectbox(
+        "🌐 Ngôn ngữ giọng đọc",
+        options=list(LANGUAGES),
+        format_func=LANGUAGES.get,
+        index=list(LANGUAGES).index(DEFAULT_SETTINGS["voice_lang"]),
+        help="Mỗi ngôn ngữ là một gói giọng nói riêng, cần chuẩn bị một lần",
+        key="voice_lang"
+    )
+    
+    update_settings(prepare_countdown_voice=prepare_countdown_voice, voice_lang=lang)
+
+@st.fragment
+@metrics.timed("panel_player")
+def player_panel():
+    """Âm lượng + nhạc nền + player: kéo thanh âm lượng hay sự kiện từ player chỉ chạy lại panel này"""
+    # ==================== ÂM LƯỢNG ====================
+    st.markdown("---")
+    st.subheader("🔊 Âm Lượng")
+    
+    col_v1, col_v2 = st.columns(2)
+    
+    with col_v1:
+        voice_volume = st.slider(
+            "🗣️ Giọng đọc",
+            min_value=0,
+            max_value=100,
+            value=80,
+            step=5,
+            key="voice_volume"
+        ) / 100
+    
+    with col_v2:
+        music_volume = st.slider(
+            "🎵 Nhạc nền",
+            min_value=0,
+            max_value=100,
+            value=30,
+            step=5,
+            key="music_volume"
+        ) / 100
+    
+    # Âm lượng chỉ player dùng -> không cần chạy lại cả app
+    update_settings(voice_volume=voice_volume, music_volume=music_volume)
+    settings = st.session_state.meditation_settings
+    
+    # ==================== NHẠC NỀN ====================
+    st.markdown("---")
+    
+    music_url = get_music_url()
+    if music_url:
+        st.success("✅ Nhạc nền đã sẵn sàng - sẽ tự động phát khi bắt đầu thiền")
+    else:
+        st.warning("⚠️ Chưa có file nhạc nền. Upload file MP3 bên dưới.")
+    
+    # ==================== CHUẨN BỊ AUDIO ====================
+    # Tạo giọng nói chạy nền (voice_jobs): đủ cue thở là bắt đầu thiền được
+    voice_job = None
+    if not is_voice_ready():
+        voice_job = get_voice_jobs().language_job(voice_lang())
+        if voice_job is None or voice_job.finished:
+            for error in voice_job.errors if voice_job else []:
+                st.error(f"Lỗi tạo audio: {error}")
+            if st.button("🎙️ Chuẩn Bị Giọng Nói", type="primary", use_container_width=True):
+                get_voice_jobs().submit_language(voice_lang())
+                st.rerun()  # cả app: panel theo dõi tiến độ cần hiện ra
+            return
+        if not voice_job.essential_ready:
+            st.info("⏳ Đang chuẩn bị giọng nói, có thể bắt đầu thiền ngay khi có giọng hít vào / giữ hơi / thở ra")
+            return
+    
+    session_timeline = current_timeline()
+    
+    # Sprite chỉ gồm các cue cài đặt này có thể phát, player phát từng đoạn theo offset
+    cues = timeline_cues(session_timeline)
+    voice_sprite = get_voice_sprite(cues) if voice_job is None else get_partial_voice_sprite(voice_job, cues)
+    
+    # ==================== APP THIỀN (PLAYER COMPONENT) ====================
+    st.markdown("---")
+    
+    # Iframe player giữ nguyên giữa các lần rerun (key cố định), chỉ nhận JSON nhỏ
+    player_args = {
+        "timeline": session_timeline,
+        "sprite": voice_sprite,
+        "music_url": music_url,
+        "settings": {
+            "totalCycles": settings["total_cycles"],
+            "twoPhaseMode": settings["two_phase_mode"],
+            "voiceVolume": voice_volume,
+            "musicVolume": music_volume,
+        },
+    }
+    metrics.inc("player_renders")
+    metrics.inc("player_payload_bytes", len(json.dumps(player_args)))
+    with metrics.span("player_render"):
+        player_event = meditation_player(**player_args, key="meditation_player", default=None)
+    handle_player_event(player_event)
+    
+    last_session = st.session_state.last_session
+    if last_session:
+        verb = "hoàn thành" if last_session["type"] == "complete" else "dừng sau"
+        st.caption(f"🧘 Lần thiền gần nhất: {verb} {last_session['cycles']} chu kỳ ({last_session['duration'] // 60} phút {last_session['duration'] % 60} giây)")
+
+@st.fragment
+@metrics.timed("panel_render")
+def render_panel():
+    """Xuất cả phiên thành một file MP3 để nghe khi tắt màn hình"""
+    if not is_voice_ready():
+        return
+    settings = st.session_state.meditation_settings
+    
+    st.markdown("---")
+    with st.expander("📥 Tải Audio Cả Phiên (nghe khi tắt màn hình)"):
+        st.info("💡 Trên điện thoại, khi khóa màn hình trình duyệt có thể làm lệch giọng đọc. File audio cả phiên (giọng nói + nhạc nền) phát ổn định như một bài nhạc.")
         
-        <div style="text-align: center; margin-top: 20px;">
-            <button class="start-btn" id="startBtn" onclick="startMeditation()">▶️ Bắt Đầu</button>
-            <button class="stop-btn" id="stopBtn" onclick="stopMeditation()">⏹️ Dừng</button>
-        </div>
+        if settings["total_cycles"] == 0:
+            st.warning("⚠️ Chế độ vô hạn không thể xuất file. Hãy chọn số chu kỳ cụ thể.")
+            return
         
-        <script>
-            const audios = {{
-                prepare: "data:audio/mp3;base64,{prepare_b64}",
-                ready: "data:audio/mp3;base64,{ready_b64}",
-                inhale: "data:audio/mp3;base64,{inhale_b64}",
-                hold: "data:audio/mp3;base64,{hold_b64}",
-                exhale: "data:audio/mp3;base64,{exhale_b64}",
-                complete: "data:audio/mp3;base64,{complete_b64}",
-                phase2: "data:audio/mp3;base64,{phase2_b64}"
-            }};
-            
-            const countdownAudios = {countdown_js};
-            
-            const bgMusicData = {"'data:audio/mp3;base64," + music_b64 + "'" if music_b64 else "null"};
-            let bgMusic = null;
-            
-            const settings = {{
-                prepareTime: {prepare_time},
-                // Phase 1 settings
-                inhaleTime: {inhale_time},
-                holdTime: {hold_time},
-                exhaleTime: {exhale_time},
-                // Phase 2 settings
-                inhaleTime2: {inhale_time2},
-                holdTime2: {hold_time2},
-                exhaleTime2: {exhale_time2},
-                totalCycles: {total_cycles},
-                twoPhaseMode: {"true" if two_phase_mode else "false"},
-                phase1Cycles: {phase1_cycles},
-                voiceVolume: {voice_volume},
-                musicVolume: {music_volume},
-                prepareCountdownVoice: {"true" if prepare_countdown_voice else "false"}
-            }};
-            
-            const isInfiniteMode = settings.totalCycles === 0;
-            let currentPhase = 'idle';
-            let currentCycle = 0;
-            let currentBreathingPhase = 1; // 1 hoặc 2
-            let countdown = 0;
-            let intervalId = null;
-            
-            if (bgMusicData) {{
-                bgMusic = new Audio(bgMusicData);
-                bgMusic.loop = true;
-                bgMusic.volume = settings.musicVolume;
-            }}
-            
-            function playAudio(type) {{
-                const audio = new Audio(audios[type]);
-                audio.volume = settings.voiceVolume;
-                audio.play().catch(e => console.log('Audio play prevented:', e));
-            }}
-            
-            function playCountdownNumber(number) {{
-                if (countdownAudios[number]) {{
-                    const audio = new Audio(countdownAudios[number]);
-                    audio.volume = settings.voiceVolume;
-                    audio.play().catch(e => console.log('Countdown audio play prevented:', e));
-                }}
-            }}
-            
-            function playBgMusic() {{
-                if (bgMusic) {{
-                    bgMusic.currentTime = 0;
-                    bgMusic.play().catch(e => console.log('BG music play prevented:', e));
-                }}
-            }}
-            
-            function stopBgMusic() {{
-                if (bgMusic) {{
-                    bgMusic.pause();
-                    bgMusic.currentTime = 0;
-                }}
-            }}
-            
-            function updateDisplay(status, cycle, progress) {{
-                document.getElementById('status-display').innerHTML = status;
-                document.getElementById('cycle-display').innerHTML = cycle || '';
-                document.getElementById('progress-display').innerHTML = progress || '';
-            }}
-            
-            function runCountdown(seconds, callback, enableVoice = false) {{
-                countdown = seconds;
-                
-                if (intervalId) clearInterval(intervalId);
-                
-                intervalId = setInterval(() => {{
-                    if (currentPhase === 'idle') {{
-                        clearInterval(intervalId);
-                        return;
-                    }}
-                    
-                    countdown--;
-                    
-                    if (enableVoice && countdown >= 1 && countdown <= 10) {{
-                        playCountdownNumber(countdown);
-                    }}
-                    
-                    const statusDiv = document.getElementById('status-display');
-                    if (statusDiv) {{
-                        const timerSpan = statusDiv.querySelector('.countdown-timer');
-                        if (timerSpan) timerSpan.textContent = countdown;
-                    }}
-                    
-                    if (countdown <= 0) {{
-                        clearInterval(intervalId);
-                        callback();
-                    }}
-                }}, 1000);
-            }}
-            
-            function startMeditation() {{
-                console.log('Starting meditation preparation...');
-                document.getElementById('startBtn').disabled = true;
-                
-                currentPhase = 'prepare';
-                currentCycle = 0;
-                currentBreathingPhase = 1;
-                
-                updateDisplay(
-                    '<div class="big-status prepare">Chuẩn Bị Tinh Thần 🧘<div class="countdown-timer">' + settings.prepareTime + '</div></div>',
-                    '<div class="cycle-info">Hãy ngồi thoải mái và thư giãn...</div>',
-                    ''
-                );
-                
-                playAudio('prepare');
-                
-                runCountdown(settings.prepareTime, () => {{
-                    playAudio('ready');
-                    
-                    updateDisplay(
-                        '<div class="big-status prepare">Chuẩn Bị Bắt Đầu... 🌟</div>',
-                        '<div class="cycle-info">Đang khởi động nhạc nền...</div>',
-                        ''
-                    );
-                    
-                    playBgMusic();
-                    
-                    setTimeout(() => {{
-                        breathingCycle();
-                    }}, 2000);
-                }}, settings.prepareCountdownVoice);
-            }}
-            
-            function checkPhaseTransition() {{
-                // Kiểm tra xem có cần chuyển sang phase 2 không
-                if (settings.twoPhaseMode && currentBreathingPhase === 1 && currentCycle >= settings.phase1Cycles) {{
-                    currentBreathingPhase = 2;
-                    
-                    // Hiển thị thông báo chuyển phase
-                    updateDisplay(
-                        '<div class="big-status phase2-transition">🌊 Chuyển Sang Giai Đoạn 2 🌊</div>',
-                        '<div class="cycle-info">Thay đổi nhịp thở...</div>',
-                        ''
-                    );
-                    
-                    playAudio('phase2');
-                    
-                    // Đợi 3 giây rồi tiếp tục
-                    setTimeout(() => {{
-                        breathingCycle();
-                    }}, 3000);
-                    
-                    return true; // Đã chuyển phase
-                }}
-                return false; // Không chuyển phase
-            }}
-            
-            function breathingCycle() {{
-                if (currentPhase === 'idle') return;
-                
-                currentCycle++;
-                
-                // Kiểm tra xem có cần chuyển phase không
-                if (checkPhaseTransition()) return;
-                
-                if (!isInfiniteMode && currentCycle > settings.totalCycles) {{
-                    completeMeditation();
-                    return;
-                }}
-                
-                // Chọn timing dựa trên phase hiện tại
-                const inhaleTime = currentBreathingPhase === 1 ? settings.inhaleTime : settings.inhaleTime2;
-                const holdTime = currentBreathingPhase === 1 ? settings.holdTime : settings.holdTime2;
-                const exhaleTime = currentBreathingPhase === 1 ? settings.exhaleTime : settings.exhaleTime2;
-                
-                // Hiển thị phase badge
-                const phaseBadge = settings.twoPhaseMode ? '<span class="phase-badge">Giai đoạn ' + currentBreathingPhase + '</span>' : '';
-                
-                let cycleText = '';
-                if (isInfiniteMode) {{
-                    cycleText = '<div class="cycle-info">Chu kỳ: ' + currentCycle + ' ♾️ ' + phaseBadge + '</div>';
-                }} else {{
-                    cycleText = '<div class="cycle-info">Chu kỳ: ' + currentCycle + '/' + settings.totalCycles + ' ' + phaseBadge + '</div>';
-                }}
-                
-                let progressBar = '';
-                if (isInfiniteMode) {{
-                    progressBar = '<div style="text-align:center; font-size:40px;">♾️</div>';
-                }} else {{
-                    progressBar = '<progress value="' + currentCycle + '" max="' + settings.totalCycles + '"></progress>';
-                }}
-                
-                // Inhale phase
-                currentPhase = 'inhale';
-                
-                updateDisplay(
-                    '<div class="big-status inhale">HÍT VÀO 🌬️<div class="countdown-timer">' + inhaleTime + '</div></div>',
-                    cycleText,
-                    progressBar
-                );
-                
-                playAudio('inhale');
-                
-                runCountdown(inhaleTime, () => {{
-                    if (holdTime > 0) {{
-                        currentPhase = 'hold';
-                        
-                        updateDisplay(
-                            '<div class="big-status hold">GIỮ HƠI ⏸️<div class="countdown-timer">' + holdTime + '</div></div>',
-                            cycleText,
-                            progressBar
-                        );
-                        
-                        playAudio('hold');
-                        
-                        runCountdown(holdTime, () => {{
-                            exhalePhase(cycleText, progressBar, exhaleTime);
-                        }}, false);
-                    }} else {{
-                        exhalePhase(cycleText, progressBar, exhaleTime);
-                    }}
-                }}, false);
-            }}
-            
-            function exhalePhase(cycleText, progressBar, exhaleTime) {{
-                currentPhase = 'exhale';
-                
-                updateDisplay(
-                    '<div class="big-status exhale">THỞ RA 💨<div class="countdown-timer">' + exhaleTime + '</div></div>',
-                    cycleText,
-                    progressBar
-                );
-                
-                playAudio('exhale');
-                
-                runCountdown(exhaleTime, () => {{
-                    breathingCycle();
-                }}, false);
-            }}
-            
-            function completeMeditation() {{
-                currentPhase = 'complete';
-                
-                updateDisplay(
-                    '<div class="big-status complete">Hoàn Thành! 🙏</div>',
-                    '<div class="cycle-info">Bạn đã hoàn thành ' + currentCycle + ' chu kỳ thiền</div>',
-                    '<progress value="100" max="100"></progress>'
-                );
-                
-                playAudio('complete');
-                
-                if (bgMusic) {{
-                    let fadeOutInterval = setInterval(() => {{
-                        if (bgMusic.volume > 0.05) {{
-                            bgMusic.volume -= 0.05;
-                        }} else {{
-                            stopBgMusic();
-                            clearInterval(fadeOutInterval);
-                        }}
-                    }}, 200);
-                }}
-                
-                setTimeout(() => {{
-                    currentPhase = 'idle';
-                    updateDisplay('', '', '');
-                    
-                    if (bgMusic) {{
-                        bgMusic.volume = settings.musicVolume;
-                    }}
-                    document.getElementById('startBtn').disabled = false;
-                }}, 3000);
-            }}
+        session_timeline = current_timeline()
+        cue_files = get_cue_files()
+        voice_volume = settings["voice_volume"]
+        music_volume = settings["music_volume"]
+        music_file = get_music_file()
+        key = render_key(session_timeline, cue_files, music_file, voice_volume, music_volume)
+        filename = cached_render(RENDER_DIR, key)
+        
+        if not filename:
+            job = get_render_jobs().get(key)
+            if job is not None and not job.finished:
+                # Tiến độ hiện ở render_job_panel (tự cập nhật), panel này không phải chạy lại
+                st.session_state.render_job_key = key
+                st.info("🎧 Đang tạo file audio trong nền, có thể tiếp tục dùng app...")
+            else:
+                if job is not None and job.error:
+                    st.error(f"Lỗi tạo file audio: {job.error}")
+                if st.button("🎧 Tạo File Audio", use_container_width=True):
+                    start_render(key, session_timeline, cue_files, music_file, voice_volume, music_volume)
+                    st.session_state.render_job_key = key
+                    st.rerun()  # cả app: panel theo dõi tiến độ cần hiện ra
+        
+        if filename:
+            url = static_url(f"renders/{filename}")
+            st.audio(url, format="audio/mpeg")
+            st.markdown(f'<a href="{url}" download="thien-ho-tho.mp3">⬇️ Tải file MP3</a>', unsafe_allow_html=True)
+
+@st.fragment
+@metrics.timed("panel_narration")
+def narration_panel():
+    """Bài dẫn thiền dài: tạo giọng từng câu trong nền, player phát dần từ câu đầu tiên"""
+    settings = st.session_state.meditation_settings
+    lang = voice_lang()
+    
+    st.markdown("---")
+    with st.expander("📜 Bài Dẫn Thiền"):
+        st.info("💡 Dán kịch bản dẫn thiền của bạn hoặc chọn bài mẫu. Mỗi câu được đọc riêng, có thể nghe ngay khi câu đầu tiên sẵn sàng")
+        
+        samples = NARRATION_SCRIPTS.get(lang, {})
+        sample = st.selectbox(
+            "Bài mẫu",
+            ["", *samples],
+            format_func=lambda name: name or "✍️ Tự viết",
+            key=f"narration_sample_{lang}"
+        )
+        script = st.text_area(
+            "Kịch bản",
+            value=samples.get(sample, ""),
+            height=220,
+            max_chars=MAX_SCRIPT_CHARS,
+            help="Dòng trống giữa hai đoạn là một quãng nghỉ dài hơn",
+            key=f"narration_script_{lang}_{sample}"
+        )
+        sentences = split_sentences(script)
+        
+        if st.button(f"🎙️ Tạo Giọng Đọc ({len(sentences)} câu)", disabled=not sentences, use_container_width=True):
+            try:
+                job = get_voice_jobs().submit_narration(sentences, lang)
+            except (OSError, ValueError) as e:
+                st.error(f"Lỗi tạo giọng đọc bài dẫn: {e}")
+            else:
+                st.session_state.narration = {
+                    "manifest": static_url(f"narration_jobs/{job.manifest_file}"),
+                    "base": static_url("narration/"),
+                    "total": len(job.sentences),
+                }
+        
+        narration = st.session_state.get("narration")
+        if narration:
+            # Player đọc manifest trực tiếp nên câu mới tới không cần chạy lại fragment này
+            meditation_player(
+                narration=narration,
+                music_url=get_music_url(),
+                settings={
+                    "totalCycles": 0,
+                    "twoPhaseMode": False,
+                    "voiceVolume": settings["voice_volume"],
+                    "musicVolume": settings["music_volume"],
+                },
+                key="narration_player",
+                default=None,
+            )
+
+@st.fragment
+@metrics.timed("panel_history")
+def history_panel():
+    """Chuỗi ngày thiền, tổng số và các phiên gần đây (đọc bảng tính sẵn, không quét lịch sử)"""
+    history = get_session_history()
+    user = st.session_state.user_id
+    stats = history.stats(user)
+    
+    st.markdown("---")
+    with st.expander("📊 Lịch Sử Thiền"):
+        if not stats:
+            st.info("Chưa có phiên thiền nào được ghi lại. Hoàn thành hoặc dừng một phiên để bắt đầu theo dõi.")
+            return
+        
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("🔥 Chuỗi ngày", stats["streak"], help=f"Dài nhất: {stats['longest_streak']} ngày")
+        col2.metric("🧘 Số phiên", stats["sessions"], help=f"Hoàn thành trọn vẹn: {stats['completed']}")
+        col3.metric("🔄 Chu kỳ", stats["cycles"])
+        col4.metric("⏱️ Tổng thời gian", f"{stats['seconds'] // 60} phút")
+        
+        daily = history.daily(user, days=30)
+        if daily:
+            st.caption("Số phút thiền mỗi ngày (30 ngày gần nhất)")
+            st.bar_chart({row["day"]: round(row["seconds"] / 60, 1) for row in daily})
+        
+        recent = history.recent(user, limit=10)
+        if recent:
+            st.caption("Các phiên gần đây")
+            st.dataframe(
+                [
+                    {
+                        "ngày": row["day"],
+                        "kết quả": "✅ Hoàn thành" if row["status"] == "complete" else "⏸️ Dừng",
+                        "chu kỳ": row["cycles"],
+                        "thời gian": f"{row['duration'] // 60}:{row['duration'] % 60:02d}",
+                        "2 giai đoạn": "✔" if row["settings"] and row["settings"].get("two_phase_mode") else "",
+                    }
+                    for row in recent
+                ],
+                hide_index=True,
+                use_container_width=True,
+            )
+
+@st.fragment
+@metrics.timed("panel_upload")
+def upload_panel():
+    # ==================== THƯ VIỆN NHẠC NỀN ====================
+    st.markdown("---")
+    with st.expander("🎵 Nhạc Nền"):
+        library = get_music_library()
+        user_id = st.session_state.user_id
+        tracks = library.tracks(user_id)
+        current = get_music_track()
+        
+        labels = {"": "🔇 Không có nhạc"}
+        for track in tracks:
+            icon = "🌐" if track["owner"] == SHARED_OWNER else "👤"
+            labels[track["sha256"]] = f"{icon} {track['name']} ({track['size'] / (1024 * 1024):.1f} MB)"
+        options = list(labels)
+        choice = st.selectbox(
+            "Nhạc nền khi thiền",
+            options,
+            index=options.index(current["sha256"] if current else ""),
+            format_func=labels.get,
+            help="👤 nhạc của bạn, 🌐 nhạc dùng chung"
+        )
+        if choice != (current["sha256"] if current else ""):
+            st.session_state.music_track = choice
+            if choice:
+                library.touch(user_id, choice)
+            # Player nằm ngoài fragment này -> chạy lại cả app để nhận nhạc mới
+            st.rerun()
+        
+        if current and current["owner"] == user_id:
+            if st.button("🗑️ Xóa bài này khỏi thư viện của tôi"):
+                library.remove(user_id, current["sha256"])
+                st.session_state.music_track = None
+                st.rerun()
+        st.caption(f"💾 Đã dùng {library.owner_bytes(user_id) / (1024 * 1024):.1f} / {library.user_quota / (1024 * 1024):.0f} MB - vượt hạn mức sẽ tự bỏ bài lâu không nghe nhất")
+        
+        st.markdown("##### 📤 Upload nhạc mới")
+        st.info("💡 Upload file nhạc thiền MP3 (tối đa 50 MB). Nhạc được chuyển sang mono, nén nhỏ và cân bằng âm lượng với giọng đọc")
+        
+        job_result = st.session_state.get("music_job_result")
+        if job_result:
+            result, error = job_result
+            if error:
+                st.error(f"❌ Lỗi xử lý nhạc nền: {error}")
+            else:
+                st.success(
+                    f"✅ Đã xử lý nhạc nền: {result['original_size'] / (1024 * 1024):.1f} MB → "
+                    f"{result['size'] / (1024 * 1024):.1f} MB, âm lượng {result['gain_db']:+.1f} dB"
+                )
+        
+        keep_original = st.checkbox(
+            "💾 Giữ lại file gốc",
+            value=False,
+            help="Lưu thêm bản gốc trên server (không dùng để phát)",
+            key="keep_original_music"
+        )
+        share_music = st.checkbox(
+            "🌐 Chia sẻ cho mọi người",
+            value=False,
+            help="Bài hát xuất hiện trong thư viện của tất cả người dùng",
+            key="share_music"
+        )
+        
+        uploaded_music = st.file_uploader(
+            "Chọn file MP3",
+            type=['mp3'],
+            key='music_uploader'
+        )
+        
+        if uploaded_music:
+            file_size = uploaded_music.size / (1024 * 1024)
             
-            function stopMeditation() {{
-                if (intervalId) clearInterval(intervalId);
-                
-                stopBgMusic();
-                
-                const cyclesCompleted = currentCycle;
-                
-                currentPhase = 'idle';
-                currentCycle = 0;
-                currentBreathingPhase = 1;
-                countdown = 0;
-                
-                let stopMessage = '⏸️ Đã dừng';
-                if (cyclesCompleted > 0) {{
-                    stopMessage += '<br><small style="font-size:16px;">Bạn đã hoàn thành ' + cyclesCompleted + ' chu kỳ</small>';
-                }}
-                
-                updateDisplay(
-                    '<div style="text-align:center; padding:20px; color:#e74c3c; font-size:24px;">' + stopMessage + '</div>',
-                    '',
-                    ''
-                );
-                
-                setTimeout(() => {{
-                    updateDisplay('', '', '');
-                    
-                    if (bgMusic) {{
-                        bgMusic.volume = settings.musicVolume;
-                    }}
-                    document.getElementById('startBtn').disabled = false;
-                }}, 3000);
-            }}
-        </script>
-    </body>
-    </html>
-    """
+            if file_size > 50:
+                st.error(f"❌ File quá lớn ({file_size:.1f} MB). Vui lòng nén xuống < 50 MB")
+            elif uploaded_music.file_id != st.session_state.get("saved_music_id"):
+                job, sha256 = start_music_ingest(uploaded_music, keep_original, share_music)
+                st.session_state.saved_music_id = uploaded_music.file_id
+                st.session_state.music_track = sha256
+                st.session_state.music_job_id = job.id if job else None
+                st.session_state.music_job_result = None
+                # Player nằm ngoài fragment này -> chạy lại cả app để nhận nhạc mới
+                st.rerun()
+            elif not st.session_state.get("music_job_id") and not job_result:
+                st.success(f"✅ Đã lưu nhạc nền ({file_size:.1f} MB)!")
+
+@st.fragment(run_every=1)
+def music_job_panel():
+    """Tiến độ xử lý nhạc nền, tự cập nhật mỗi giây cho đến khi xong"""
+    job = get_music_jobs().get(st.session_state.music_job_id)
+    if job is None or job.finished:
+        get_music_jobs().pop(st.session_state.music_job_id, None)
+        st.session_state.music_job_id = None
+        st.session_state.music_job_result = (job.result, job.error) if job else None
+        # Chạy lại cả app: player nhận URL nhạc mới, panel này không còn được gọi
+        st.rerun()
+    st.progress(job.progress, text=f"🎛️ Đang xử lý nhạc nền... {job.progress:.0%}")
+
+@st.fragment(run_every=1)
+def render_job_panel():
+    """Tiến độ tạo file audio cả phiên, tự cập nhật mỗi giây cho đến khi xong"""
+    job = get_render_jobs().get(st.session_state.render_job_key)
+    if job is None or job.finished:
+        if job is not None and job.status == "done":
+            get_render_jobs().pop(job.key, None)  # file đã nằm trong cache render
+        st.session_state.render_job_key = None
+        # Chạy lại cả app: panel render hiện file vừa tạo (hoặc lỗi)
+        st.rerun()
+    st.progress(job.progress, text=f"🎧 Đang tạo file audio... {job.progress:.0%}")
+
+@st.fragment(run_every=1)
+def voice_job_panel():
+    """Tiến độ tạo giọng nói, tự cập nhật mỗi giây; chạy lại cả app khi bắt đầu thiền được và khi xong"""
+    job = get_voice_jobs().language_job(voice_lang())
+    if job is None or job.finished or job.essential_ready != st.session_state.voice_job_essential:
+        st.rerun()
+    done = sum(cue_job.finished for cue_job in job.cue_jobs.values())
+    st.progress(job.progress, text=f"🎵 Đang chuẩn bị giọng nói... {done}/{len(job.cue_jobs)}")
+
+# ==================== GIAO DIỆN CHÍNH ====================
+def main_page():
+    """Tiêu đề, các panel và phần hướng dẫn: phần được đo của mỗi lần chạy cả script"""
+    st.title("🧘 Thiền Hơi Thở Cho Người Mới")
+    st.markdown("### _Hướng dẫn hơi thở có giọng nói tiếng Việt_")
     
-    components.html(meditation_html, height=600, scrolling=False)
+    timing_settings()
+    two_phase_settings()
+    breathing_settings()
+    voice_settings()
+    player_panel()
+    if not is_voice_ready():
+        pending_voice_job = get_voice_jobs().language_job(voice_lang())
+        if pending_voice_job is not None and not pending_voice_job.finished:
+            st.session_state.voice_job_essential = pending_voice_job.essential_ready
+            voice_job_panel()
+    render_panel()
+    if st.session_state.get("render_job_key"):
+        render_job_panel()
+    narration_panel()
+    history_panel()
+    upload_panel()
+    if st.session_state.get("music_job_id"):
+        music_job_panel()
 
-# ==================== UPLOAD NHẠC NỀN ====================
-st.markdown("---")
-with st.expander("🎵 Upload Nhạc Nền"):
-    st.info("💡 Upload file nhạc thiền MP3 (khuyến nghị < 20 MB để tự động phát)")
+    # ==================== KỸ THUẬT THỞ 2 GIAI ĐOẠN ====================
+    with st.expander("🌊 Kỹ Thuật Thở 2 Giai Đoạn - Ví Dụ"):
+        st.markdown("""
+        ### Wim Hof Method (Phổ biến nhất):
     
-    if os.path.exists("meditation_music.mp3"):
-        size_mb = os.path.getsize("meditation_music.mp3") / (1024 * 1024)
-        if size_mb < 5:
-            st.success(f"✅ File hiện tại: {size_mb:.1f} MB - Sẽ tự động phát khi thiền")
-        else:
-            st.warning(f"⚠️ File hiện tại: {size_mb:.1f} MB - Hơi lớn, khuyến nghị nén xuống < 5 MB")
+        **Giai đoạn 1 - Hyperventilation (30-40 chu kỳ):**
+        - Hít vào: 2 giây (sâu, đầy)
+        - Giữ hơi: 0 giây
+        - Thở ra: 2 giây (thả lỏng)
+        - Mục đích: Tăng oxygen, giảm CO2
     
-    uploaded_music = st.file_uploader(
-        "Chọn file MP3",
-        type=['mp3'],
-        key='music_uploader'
-    )
+        **Giai đoạn 2 - Retention (1-3 chu kỳ):**
+        - Hít vào: 4 giây (đầy phổi)
+        - Giữ hơi: 15-60 giây (càng lâu càng tốt)
+        - Thở ra: 6 giây (từ từ)
+        - Mục đích: Giữ oxygen, tăng CO2
     
-    if uploaded_music:
-        file_size = uploaded_music.size / (1024 * 1024)
-        
-        if file_size > 50:
-            st.error(f"❌ File quá lớn ({file_size:.1f} MB). Vui lòng nén xuống < 50 MB")
+        ---
+    
+        ### Pranayama 2 Phases:
+    
+        **Giai đoạn 1 - Kapalabhati (20-30 chu kỳ):**
+        - Hít vào: 1 giây (nhanh)
+        - Giữ hơi: 0 giây
+        - Thở ra: 1 giây (mạnh, bụng co)
+        - Mục đích: Làm sạch hệ hô hấp
+    
+        **Giai đoạn 2 - Nadi Shodhana (10-15 chu kỳ):**
+        - Hít vào: 4 giây (chậm)
+        - Giữ hơi: 4 giây
+        - Thở ra: 6 giây (chậm)
+        - Mục đích: Cân bằng năng lượng
+    
+        ---
+    
+        ### Box + Extended (Cho người mới):
+    
+        **Giai đoạn 1 - Warm-up (5-10 chu kỳ):**
+        - Hít vào: 4 giây
+        - Giữ hơi: 2 giây
+        - Thở ra: 4 giây
+    
+        **Giai đoạn 2 - Deep practice (10-20 chu kỳ):**
+        - Hít vào: 4 giây
+        - Giữ hơi: 4 giây
+        - Thở ra: 6 giây
+        """)
+
+    # ==================== KỸ THUẬT THỞ PHỔ BIẾN ====================
+    with st.expander("🧘 Kỹ Thuật Thở Phổ Biến (1 Giai Đoạn)"):
+        st.markdown("""
+        ### Các tỷ lệ hơi thở phổ biến:
+    
+        **Box Breathing (4-4-4-4):**
+        - Hít vào: 4 giây
+        - Giữ hơi: 4 giây
+        - Thở ra: 6 giây
+        - Phù hợp cho: Giảm stress, tập trung
+    
+        **Pranayama (4-7-8):**
+        - Hít vào: 4 giây
+        - Giữ hơi: 7 giây
+        - Thở ra: 8 giây
+        - Phù hợp cho: Thư giãn sâu, ngủ ngon
+    
+        **Relaxation (4-0-6):**
+        - Hít vào: 4 giây
+        - Giữ hơi: 0 giây
+        - Thở ra: 6 giây
+        - Phù hợp cho: Người mới, thư giãn nhẹ
+        """)
+
+    st.markdown("---")
+    st.caption("✨ Ứng dụng Thiền Hơi Thở v6.0 - Chế độ 2 giai đoạn | Hít vào - Giữ hơi - Thở ra 🧘")
+
+# Đo trong try/finally: lần chạy kết thúc bằng st.rerun() / st.stop() / lỗi vẫn được ghi
+with metrics.rerun_scope(get_rerun_profiler()) as rerun:
+    main_page()
+
+# ==================== SỐ LIỆU HIỆU NĂNG (SIDEBAR) ====================
+with st.sidebar:
+    if st.toggle("🔧 Số liệu hiệu năng", value=False, key="debug_metrics"):
+        st.caption(f"Lần chạy này: {rerun['seconds'] * 1000:.0f} ms")
+        voice_info = voice_ready_info()
+        if voice_info is None:
+            st.caption(f"🎙️ Giọng nói ({get_tts_backend().name}, {voice_lang()}): chưa sẵn sàng")
         else:
-            with open("meditation_music.mp3", "wb") as f:
-                f.write(uploaded_music.getbuffer())
-            st.success(f"✅ Đã lưu nhạc nền ({file_size:.1f} MB)! Refresh trang để áp dụng.")
-
-# ==================== KỸ THUẬT THỞ 2 GIAI ĐOẠN ====================
-with st.expander("🌊 Kỹ Thuật Thở 2 Giai Đoạn - Ví Dụ"):
-    st.markdown("""
-    ### Wim Hof Method (Phổ biến nhất):
-    
-    **Giai đoạn 1 - Hyperventilation (30-40 chu kỳ):**
-    - Hít vào: 2 giây (sâu, đầy)
-    - Giữ hơi: 0 giây
-    - Thở ra: 2 giây (thả lỏng)
-    - Mục đích: Tăng oxygen, giảm CO2
-    
-    **Giai đoạn 2 - Retention (1-3 chu kỳ):**
-    - Hít vào: 4 giây (đầy phổi)
-    - Giữ hơi: 15-60 giây (càng lâu càng tốt)
-    - Thở ra: 6 giây (từ từ)
-    - Mục đích: Giữ oxygen, tăng CO2
-    
-    ---
-    
-    ### Pranayama 2 Phases:
-    
-    **Giai đoạn 1 - Kapalabhati (20-30 chu kỳ):**
-    - Hít vào: 1 giây (nhanh)
-    - Giữ hơi: 0 giây
-    - Thở ra: 1 giây (mạnh, bụng co)
-    - Mục đích: Làm sạch hệ hô hấp
-    
-    **Giai đoạn 2 - Nadi Shodhana (10-15 chu kỳ):**
-    - Hít vào: 4 giây (chậm)
-    - Giữ hơi: 4 giây
-    - Thở ra: 6 giây (chậm)
-    - Mục đích: Cân bằng năng lượng
-    
-    ---
-    
-    ### Box + Extended (Cho người mới):
-    
-    **Giai đoạn 1 - Warm-up (5-10 chu kỳ):**
-    - Hít vào: 4 giây
-    - Giữ hơi: 2 giây
-    - Thở ra: 4 giây
-    
-    **Giai đoạn 2 - Deep practice (10-20 chu kỳ):**
-    - Hít vào: 4 giây
-    - Giữ hơi: 4 giây
-    - Thở ra: 6 giây
-    """)
-
-# ==================== KỸ THUẬT THỞ PHỔ BIẾN ====================
-with st.expander("🧘 Kỹ Thuật Thở Phổ Biến (1 Giai Đoạn)"):
-    st.markdown("""
-    ### Các tỷ lệ hơi thở phổ biến:
-    
-    **Box Breathing (4-4-4-4):**
-    - Hít vào: 4 giây
-    - Giữ hơi: 4 giây
-    - Thở ra: 6 giây
-    - Phù hợp cho: Giảm stress, tập trung
-    
-    **Pranayama (4-7-8):**
-    - Hít vào: 4 giây
-    - Giữ hơi: 7 giây
-    - Thở ra: 8 giây
-    - Phù hợp cho: Thư giãn sâu, ngủ ngon
-    
-    **Relaxation (4-0-6):**
-    - Hít vào: 4 giây
-    - Giữ hơi: 0 giây
-    - Thở ra: 6 giây
-    - Phù hợp cho: Người mới, thư giãn nhẹ
-    """)
-
-st.markdown("---")
-st.caption("✨ Ứng dụng Thiền Hơi Thở v6.0 - Chế độ 2 giai đoạn | Hít vào - Giữ hơi - Thở ra 🧘")
+            created = time.strftime("%Y-%m-%d %H:%M", time.localtime(voice_info["created"])) if "created" in voice_info else "?"
+            st.caption(f"🎙️ Giọng nói ({get_tts_backend().name}, {voice_lang()}): sẵn sàng từ {created}, "
+                       f"tạo bởi {voice_info.get('source', 'app')}, gói {voice_info.get('pack', '?')}, "
+                       f"{len(voice_info.get('sprites', []))} sprite dựng sẵn")
+        st.dataframe(
+            [{"bước": name, "ms": round(seconds * 1000, 2)} for name, seconds in rerun["trace"]],
+            hide_index=True,
+            use_container_width=True,
+        )
+        snapshot = metrics.snapshot()
+        st.markdown("**Bộ đếm**")
+        st.dataframe(
+            [{"tên": name, "nhãn": ", ".join(f"{k}={v}" for k, v in labels.items()), "giá trị": value}
+             for name, labels, value in snapshot["counters"]],
+            hide_index=True,
+            use_container_width=True,
+        )
+        st.markdown("**Thời gian (cả process)**")
+        st.dataframe(
+            [{"bước": name, "lần": count, "TB ms": round(total / count * 1000, 2), "max ms": round(longest * 1000, 2)}
+             for name, labels, count, total, longest in snapshot["spans"]],
+            hide_index=True,
+            use_container_width=True,
+        )
+        with st.expander("Prometheus"):
+            st.code(metrics.render_prometheus(), language="text")
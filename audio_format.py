@@ -0,0 +1,130 @@
+"""Đọc cấu trúc file audio (MP3 Layer III, WAV) không cần thư viện ngoài."""
+import io
+import mmap
+import os
+import wave
+
+_MP3_BITRATES = {
+    1: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_MP3_SAMPLE_RATES = {
+    1: [44100, 48000, 32000],
+    2: [22050, 24000, 16000],
+    25: [11025, 12000, 8000],
+}
+
+
+class Mp3Frame:
+    __slots__ = ("offset", "length", "samples", "sample_rate", "channels", "header")
+
+    def __init__(self, offset, length, samples, sample_rate, channels, header):
+        self.offset = offset
+        self.length = length
+        self.samples = samples
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.header = header
+
+
+def _skip_id3(data, pos):
+    if data[pos:pos + 3] == b"ID3" and len(data) >= pos + 10:
+        size = 0
+        for b in data[pos + 6:pos + 10]:
+            size = (size << 7) | (b & 0x7F)
+        return pos + 10 + size
+    return pos
+
+
+def iter_mp3_frames(data):
+    """Duyệt các frame MP3 Layer III hợp lệ (bỏ qua tag ID3 và byte rác)"""
+    pos = _skip_id3(data, 0)
+    end = len(data)
+    while pos + 4 <= end:
+        pos = _skip_id3(data, pos)
+        if pos + 4 > end:
+            break
+        b1, b2, b3 = data[pos + 1], data[pos + 2], data[pos + 3]
+        if data[pos] != 0xFF or (b1 & 0xE0) != 0xE0:
+            pos += 1
+            continue
+        version_bits = (b1 >> 3) & 0x03
+        layer_bits = (b1 >> 1) & 0x03
+        bitrate_index = b2 >> 4
+        rate_index = (b2 >> 2) & 0x03
+        if version_bits == 1 or layer_bits != 1 or bitrate_index in (0, 15) or rate_index == 3:
+            pos += 1
+            continue
+        version = {3: 1, 2: 2, 0: 25}[version_bits]
+        bitrate = _MP3_BITRATES[1 if version == 1 else 2][bitrate_index] * 1000
+        sample_rate = _MP3_SAMPLE_RATES[version][rate_index]
+        padding = (b2 >> 1) & 0x01
+        if version == 1:
+            frame_len = 144 * bitrate // sample_rate + padding
+            samples = 1152
+        else:
+            frame_len = 72 * bitrate // sample_rate + padding
+            samples = 576
+        if pos + frame_len > end:
+            break
+        channels = 1 if (b3 >> 6) == 3 else 2
+        yield Mp3Frame(pos, frame_len, samples, sample_rate, channels, data[pos:pos + 4])
+        pos += frame_len
+
+
+def mp3_duration(data):
+    """Thời lượng (giây) của MP3 Layer III, hoặc None nếu không có frame hợp lệ"""
+    total = 0.0
+    frames = 0
+    for frame in iter_mp3_frames(data):
+        total += frame.samples / frame.sample_rate
+        frames += 1
+    return total if frames else None
+
+
+def mp3_file_duration(path):
+    """``mp3_duration`` của file trên đĩa, đọc qua mmap (không nạp cả file vào bộ nhớ)"""
+    with open(path, "rb") as f:
+        if not os.fstat(f.fileno()).st_size:
+            return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return mp3_duration(data)
+
+
+def is_wav(data):
+    return data[:4] == b"RIFF" and data[8:12] == b"WAVE"
+
+
+def read_wav(data):
+    """(params, pcm bytes) của file WAV"""
+    with wave.open(io.BytesIO(data)) as w:
+        return w.getparams(), w.readframes(w.getnframes())
+
+
+def wav_duration(data):
+    """Thời lượng (giây) của file WAV, hoặc None nếu không đọc được"""
+    try:
+        with wave.open(io.BytesIO(data)) as w:
+            rate = w.getframerate()
+            return w.getnframes() / rate if rate else None
+    except (wave.Error, EOFError):
+        return None
+
+
+def probe_duration(data):
+    """Thời lượng (giây) của audio (WAV hoặc MP3); None nghĩa là dữ liệu không hợp lệ"""
+    if is_wav(data):
+        return wav_duration(data)
+    return mp3_duration(data)
+
+
+def audio_extension(data):
+    return ".wav" if is_wav(data) else ".mp3"
+
+
+def read_source(source):
+    """Bytes audio của một cue: đường dẫn file, hoặc bytes / memoryview (cue trong voice pack) dùng luôn không chép"""
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            return f.read()
+    return source
@@ -0,0 +1,246 @@
+"""Gộp các cue giọng nói thành một file sprite duy nhất kèm bảng offset/thời lượng.
+
+Player chỉ cần tải và giải mã một file, rồi phát từng đoạn theo bảng offset
+thay vì tạo một phần tử Audio cho mỗi cue. MP3 được nối theo frame (không
+giải mã lại); WAV được nối theo PCM. Giữa các cue chèn một khoảng lặng ngắn
+để sai lệch nhỏ của bộ giải mã không làm lẫn tiếng cue bên cạnh.
+
+Sprite chỉ gồm các cue mà cài đặt hiện tại có thể phát; ``publish_cues`` đặt
+từng cue thành một file riêng để player tải khi cài đặt đổi giữa phiên.
+
+Map của sprite ghi tên voice pack chứa các cue (nếu có); ``prune_sprites`` xóa
+sprite và thư mục cue không còn thuộc gói nào đang dùng. File khóa nằm trong
+``lock_dir`` (ngoài thư mục static được phục vụ công khai).
+"""
+import hashlib
+import io
+import json
+import os
+import shutil
+import threading
+import time
+import wave
+
+from audio_format import audio_extension, is_wav, iter_mp3_frames, read_source, read_wav
+from file_lock import FileLock
+
+SPRITE_GAP = 0.15  # giây lặng giữa các cue
+PRUNE_MIN_AGE = 3600  # giây: sprite / cue vừa tạo còn có thể đang được phát, chưa xóa
+
+_lock = threading.Lock()
+_maps = {}  # đường dẫn file map -> dict (đọc một lần cho cả process)
+
+
+def sprite_key(sources):
+    """Khóa của sprite từ (cue_id, sha256) của các cue"""
+    raw = json.dumps(sorted((cue_id, sha) for cue_id, (_, sha) in sources.items()))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def _silent_mp3_frame(frame):
+    """Frame MP3 cùng định dạng nhưng toàn số 0 (bộ giải mã cho ra im lặng)"""
+    header = bytearray(frame.header)
+    header[1] |= 0x01   # không có CRC
+    header[2] &= ~0x02  # bỏ bit padding
+    length = frame.length - ((frame.header[2] >> 1) & 0x01)
+    return bytes(header) + bytes(length - 4)
+
+
+def build_mp3_sprite(cues):
+    """cues: list (cue_id, bytes MP3) -> (bytes sprite, map cue_id -> offset/duration)"""
+    out = io.BytesIO()
+    offsets = {}
+    position = 0  # tính theo sample
+    fmt = None
+    for cue_id, data in cues:
+        frames = list(iter_mp3_frames(data))
+        if not frames:
+            raise ValueError(f"Cue {cue_id!r} không có frame MP3 hợp lệ")
+        cue_fmt = (frames[0].sample_rate, frames[0].channels, frames[0].samples)
+        if fmt is None:
+            fmt = cue_fmt
+        elif cue_fmt != fmt:
+            raise ValueError(f"Cue {cue_id!r} khác định dạng với các cue còn lại")
+        sample_rate, _, frame_samples = fmt
+
+        start = position
+        for frame in frames:
+            out.write(data[frame.offset:frame.offset + frame.length])
+            position += frame.samples
+        offsets[cue_id] = {
+            "offset": round(start / sample_rate, 4),
+            "duration": round((position - start) / sample_rate, 4),
+        }
+
+        silence = _silent_mp3_frame(frames[0])
+        for _ in range(max(1, round(SPRITE_GAP * sample_rate / frame_samples))):
+            out.write(silence)
+            position += frame_samples
+    return out.getvalue(), offsets
+
+
+def build_wav_sprite(cues):
+    """cues: list (cue_id, bytes WAV) -> (bytes sprite, map cue_id -> offset/duration)"""
+    pcm = io.BytesIO()
+    offsets = {}
+    params = None
+    position = 0  # tính theo frame PCM
+    for cue_id, data in cues:
+        cue_params, frames = read_wav(data)
+        cue_fmt = (cue_params.nchannels, cue_params.sampwidth, cue_params.framerate)
+        if params is None:
+            params = cue_params
+        elif cue_fmt != (params.nchannels, params.sampwidth, params.framerate):
+            raise ValueError(f"Cue {cue_id!r} khác định dạng với các cue còn lại")
+        frame_size = params.nchannels * params.sampwidth
+        count = len(frames) // frame_size
+        offsets[cue_id] = {
+            "offset": round(position / params.framerate, 4),
+            "duration": round(count / params.framerate, 4),
+        }
+        pcm.write(frames)
+        gap = int(SPRITE_GAP * params.framerate)
+        pcm.write(bytes(gap * frame_size))
+        position += count + gap
+
+    out = io.BytesIO()
+    with wave.open(out, "wb") as w:
+        w.setnchannels(params.nchannels)
+        w.setsampwidth(params.sampwidth)
+        w.setframerate(params.framerate)
+        w.writeframes(pcm.getvalue())
+    return out.getvalue(), offsets
+
+
+def build_sprite(cues):
+    """Chọn cách gộp theo định dạng cue đầu tiên; trả về (bytes, offsets, đuôi file)"""
+    if not cues:
+        raise ValueError("Không có cue nào để gộp")
+    if is_wav(cues[0][1]):
+        data, offsets = build_wav_sprite(cues)
+        return data, offsets, ".wav"
+    data, offsets = build_mp3_sprite(cues)
+    return data, offsets, ".mp3"
+
+
+def _cached_map(map_path, out_dir, pack):
+    sprite_map = _maps.get(map_path)
+    if sprite_map is None or (pack and sprite_map.get("pack") != pack):
+        return None
+    if not os.path.exists(os.path.join(out_dir, sprite_map["file"])):
+        return None  # đã bị prune_sprites (có thể ở process khác) xóa
+    return sprite_map
+
+
+def ensure_sprite(sources, out_dir, lock_dir, pack=None):
+    """Tạo sprite nếu chưa có và trả về map {"file", "cues": {cue_id: {offset, duration}}, "pack"}
+
+    sources: dict cue_id -> (đường dẫn file hoặc bytes / memoryview, sha256). Sprite
+    đặt tên theo nội dung nên cùng bộ cue luôn ra cùng một file; đã tồn tại thì
+    chỉ đọc lại map. pack: tên voice pack chứa các cue, ghi vào map để
+    ``prune_sprites`` giữ lại (None: sprite tạm, ví dụ khi chưa tạo đủ cue).
+    """
+    key = sprite_key(sources)
+    map_path = os.path.join(out_dir, f"sprite-{key}.json")
+    sprite_map = _cached_map(map_path, out_dir, pack)
+    if sprite_map is not None:
+        return sprite_map
+
+    # Khóa file: nhiều process dùng chung out_dir chỉ dựng sprite một lần
+    with _lock, FileLock(os.path.join(lock_dir, f"sprite-{key}.lock")):
+        sprite_map = _cached_map(map_path, out_dir, pack)
+        if sprite_map is not None:
+            return sprite_map
+        try:
+            with open(map_path, "r", encoding="utf-8") as f:
+                sprite_map = json.load(f)
+        except (OSError, ValueError):
+            sprite_map = None
+        if sprite_map is None or not os.path.exists(os.path.join(out_dir, sprite_map["file"])):
+            cues = [(cue_id, read_source(source)) for cue_id, (source, _) in sources.items()]
+            data, offsets, ext = build_sprite(cues)
+            os.makedirs(out_dir, exist_ok=True)
+            sprite_map = {"file": f"sprite-{key}{ext}", "cues": offsets, "pack": pack}
+            _write_atomic(os.path.join(out_dir, sprite_map["file"]), data)
+            _write_atomic(map_path, json.dumps(sprite_map, indent=1).encode("utf-8"))
+        elif pack and sprite_map.get("pack") != pack:
+            # Sprite tạm (hoặc của gói cũ) có đúng các cue này: nay thuộc gói đang dùng
+            sprite_map = {**sprite_map, "pack": pack}
+            _write_atomic(map_path, json.dumps(sprite_map, indent=1).encode("utf-8"))
+        _maps[map_path] = sprite_map
+        return sprite_map
+
+
+def publish_cues(sources, out_dir, lock_dir):
+    """Chép từng cue ra ``<out_dir>/<khóa>/<cue_id><đuôi>`` để player tải riêng cue nằm ngoài sprite.
+
+    Thư mục đặt tên theo nội dung của cả bộ cue (như sprite) nên URL không bao
+    giờ đổi nội dung. Trả về {"dir": tên thư mục, "ext": đuôi file}.
+    """
+    key = sprite_key(sources)
+    cue_dir = os.path.join(out_dir, key)
+    exts = {
+        os.path.splitext(source)[1] if isinstance(source, str) else audio_extension(source)
+        for source, _ in sources.values()
+    }
+    if len(exts) != 1:
+        raise ValueError("Các cue khác định dạng nhau")
+    ext = exts.pop()
+    with _lock, FileLock(os.path.join(lock_dir, f"cues-{key}.lock")):
+        for cue_id, (source, _) in sources.items():
+            dest = os.path.join(cue_dir, cue_id + ext)
+            if not os.path.exists(dest):
+                os.makedirs(cue_dir, exist_ok=True)
+                _write_atomic(dest, read_source(source))
+    return {"dir": key, "ext": ext}
+
+
+def prune_sprites(sprite_dir, cue_dir, lock_dir, packs, cue_dirs, min_age=PRUNE_MIN_AGE):
+    """Xóa sprite không thuộc voice pack nào trong ``packs`` và thư mục cue không nằm trong ``cue_dirs``.
+
+    File tạo chưa quá ``min_age`` giây được giữ lại (có thể đang được phát);
+    trả về số sprite / thư mục cue đã xóa. File khóa không bao giờ bị xóa: bên
+    khác có thể đang chờ trên file cũ trong khi bên thứ ba tạo file mới cùng tên.
+    """
+    cutoff = time.time() - min_age
+    removed = 0
+    for name in os.listdir(sprite_dir) if os.path.isdir(sprite_dir) else []:
+        if not (name.startswith("sprite-") and name.endswith(".json")):
+            continue
+        map_path = os.path.join(sprite_dir, name)
+        try:
+            if os.stat(map_path).st_mtime > cutoff:
+                continue
+            with open(map_path, "r", encoding="utf-8") as f:
+                sprite_map = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if sprite_map.get("pack") in packs:
+            continue
+        key = name[len("sprite-"):-len(".json")]
+        with _lock, FileLock(os.path.join(lock_dir, f"sprite-{key}.lock")):
+            _maps.pop(map_path, None)
+            for path in (map_path, os.path.join(sprite_dir, sprite_map["file"])):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        removed += 1
+    for key in os.listdir(cue_dir) if os.path.isdir(cue_dir) else []:
+        path = os.path.join(cue_dir, key)
+        try:
+            if key in cue_dirs or not os.path.isdir(path) or os.stat(path).st_mtime > cutoff:
+                continue
+        except OSError:
+            continue
+        with _lock, FileLock(os.path.join(lock_dir, f"cues-{key}.lock")):
+            shutil.rmtree(path, ignore_errors=True)
+        removed += 1
+    return removed
+
+
+def _write_atomic(path, data):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
@@ -0,0 +1,380 @@
+"""Tải thử nhiều phiên cùng lúc vào một server Streamlit chạy cục bộ.
+
+Mỗi phiên giả lập là một kết nối websocket như trình duyệt: tải trang rồi liên
+tục đổi cài đặt (số chu kỳ, thời gian thở, 2 giai đoạn, âm lượng...) như người
+dùng thật, mỗi thay đổi gửi lại đúng fragment chứa widget đó. Số phiên được
+tăng dần theo ``--sessions``; ở mỗi mức đo throughput, độ trễ rerun và RSS của
+process server để biết bộ nhớ tăng thêm bao nhiêu cho mỗi người dùng:
+
+    python benchmarks/load_test.py --sessions 1 5 10 25 --duration 20
+    python benchmarks/load_test.py --music 5 --output load.json
+    python benchmarks/load_test.py --url ws://127.0.0.1:8501 --pid 1234
+
+Không có ``--url`` thì tự chạy server (engine ``stub``) trên một bản sao của
+app trong thư mục tạm. Mỗi mức gồm:
+- ``throughput_rps``: số rerun hoàn tất mỗi giây (mọi phiên cộng lại)
+- ``latency_ms``: p50 / p95 / p99 / max từ lúc gửi thay đổi tới khi script chạy xong
+- ``received_bytes_per_rerun``: dữ liệu server gửi về cho mỗi rerun
+- ``rss_kb`` và ``rss_delta_per_session_kb``: RSS của server (chỉ đo được trên
+  Linux, hoặc khi biết pid) và phần tăng so với lúc chưa có phiên nào, chia cho số phiên
+
+Cần thêm ``websockets>=12`` (chỉ dùng cho benchmark, không có trong requirements.txt
+của app): ``pip install "websockets>=12"``.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+try:
+    from websockets.sync.client import connect
+except ImportError:
+    sys.exit('load_test.py cần websockets>=12: pip install "websockets>=12"')
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+from rerun_benchmark import git_revision, make_music, make_workspace
+
+SESSION_LEVELS = [1, 5, 10, 25]
+# Widget cài đặt mà phiên giả lập sẽ đổi (theo key trong app)
+SETTING_KEYS = [
+    "prepare_time", "total_cycles", "two_phase_mode", "inhale1", "hold1", "exhale1",
+    "prepare_countdown_voice", "voice_volume", "music_volume",
+]
+DONE_STATUSES = {
+    ForwardMsg.FINISHED_SUCCESSFULLY,
+    ForwardMsg.FINISHED_WITH_COMPILE_ERROR,
+    ForwardMsg.FINISHED_FRAGMENT_RUN_SUCCESSFULLY,
+}
+
+
+def rss_kb(pid):
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def percentiles(values):
+    if len(values) < 2:
+        value = round(values[0], 2) if values else None
+        return {"p50": value, "p95": value, "p99": value, "max": value}
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return {
+        "p50": round(cuts[49], 2),
+        "p95": round(cuts[94], 2),
+        "p99": round(cuts[98], 2),
+        "max": round(max(values), 2),
+    }
+
+
+# ==================== PHIÊN GIẢ LẬP ====================
+class SimulatedSession:
+    """Một người dùng: một websocket tới server, gửi rerun như trình duyệt"""
+
+    def __init__(self, url, uid, seed=None):
+        self.url = url.rstrip("/") + "/_stcore/stream"
+        self.uid = uid
+        self.rng = random.Random(seed)
+        self.widgets = {}  # key -> (loại, proto của widget, fragment_id)
+        self.values = {}   # key -> giá trị hiện tại
+        self.changed = set()
+        self.errors = 0
+        self.voice_pending = False  # app đang tạo giọng nói chạy nền
+        self._ws = None
+        self._stack = contextlib.ExitStack()
+
+    def open(self):
+        self._ws = self._stack.enter_context(
+            connect(self.url, subprotocols=["streamlit"], max_size=None, open_timeout=30)
+        )
+        return self.rerun()
+
+    def close(self):
+        self._stack.close()
+        self._ws = None
+
+    def _widget_states(self):
+        states = []
+        for key in self.changed:
+            if key not in self.widgets:
+                continue
+            kind, proto, _ = self.widgets[key]
+            state = WidgetState(id=proto.id)
+            value = self.values[key]
+            if kind == "checkbox":
+                state.bool_value = value
+            elif kind == "slider":
+                state.double_array_value.data.append(value)
+            elif proto.data_type == proto.INT:
+                state.int_value = int(value)
+            else:
+                state.double_value = value
+            states.append(state)
+        return states
+
+    def rerun(self, fragment_id=None, trigger_id=None):
+        """Gửi một lần rerun, chờ script chạy xong; trả về (ms, số byte nhận)"""
+        msg = BackMsg()
+        msg.rerun_script.query_string = f"uid={self.uid}"
+        msg.rerun_script.widget_states.widgets.extend(self._widget_states())
+        if trigger_id:
+            msg.rerun_script.widget_states.widgets.append(WidgetState(id=trigger_id, trigger_value=True))
+        if fragment_id:
+            msg.rerun_script.fragment_id = fragment_id
+        started = time.perf_counter()
+        self._ws.send(msg.SerializeToString())
+        received = 0
+        while True:
+            raw = self._ws.recv(timeout=300)
+            received += len(raw)
+            forward = ForwardMsg()
+            forward.ParseFromString(raw)
+            kind = forward.WhichOneof("type")
+            if kind == "delta":
+                self._read_delta(forward.delta)
+            elif kind == "script_finished" and forward.script_finished in DONE_STATUSES:
+                return (time.perf_counter() - started) * 1000, received
+
+    def _read_delta(self, delta):
+        if delta.WhichOneof("type") != "new_element":
+            return
+        element = delta.new_element
+        kind = element.WhichOneof("type")
+        if kind == "exception":
+            self.errors += 1
+            return
+        proto = getattr(element, kind)
+        if kind in ("progress", "alert") and "Đang chuẩn bị giọng nói" in (proto.text if kind == "progress" else proto.body):
+            self.voice_pending = True
+        widget_id = getattr(proto, "id", "") if kind in ("checkbox", "number_input", "slider", "button") else ""
+        if not widget_id.startswith("$$ID-"):
+            return
+        key = widget_id.split("-", 2)[2]
+        self.widgets[key] = (kind, proto, delta.fragment_id)
+        if key not in self.values and kind != "button":
+            self.values[key] = proto.default[0] if kind == "slider" else proto.default
+
+    def button_id(self, label):
+        for kind, proto, _ in self.widgets.values():
+            if kind == "button" and label in proto.label:
+                return proto.id
+        return None
+
+    def step(self):
+        """Đổi ngẫu nhiên một cài đặt như người dùng kéo / bấm"""
+        keys = [key for key in SETTING_KEYS if key in self.widgets]
+        key = self.rng.choice(keys)
+        kind, proto, fragment_id = self.widgets[key]
+        if kind == "checkbox":
+            self.values[key] = not self.values[key]
+        else:
+            step = proto.step or 1
+            value = self.values[key] + self.rng.choice((-1, 1)) * step * self.rng.randint(1, 3)
+            self.values[key] = min(max(value, proto.min), proto.max)
+        self.changed.add(key)
+        return self.rerun(fragment_id=fragment_id or None)
+
+
+# ==================== SERVER ====================
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(workdir, port):
+    env = dict(os.environ, TTS_BACKEND=os.environ.get("TTS_BACKEND", "stub"))
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", "app.py", "--server.headless", "true",
+         "--server.port", str(port), "--browser.gatherUsageStats", "false"],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("Server Streamlit dừng khi khởi động")
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=2):
+                return proc
+        except OSError:
+            time.sleep(0.5)
+    proc.terminate()
+    raise RuntimeError("Server Streamlit không sẵn sàng sau 60 giây")
+
+
+def prepare(url, timeout=300):
+    """Tạo sẵn giọng nói một lần (server tạo trong nền) và chờ xong để các mức đo chỉ còn chi phí rerun"""
+    deadline = time.monotonic() + timeout
+    while True:
+        session = SimulatedSession(url, "load-prepare")
+        try:
+            session.open()
+            button = session.button_id("Chuẩn Bị Giọng Nói")
+            if button:
+                session.rerun(trigger_id=button)
+            elif not session.voice_pending:
+                return
+        finally:
+            session.close()
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Giọng nói chưa sẵn sàng sau {timeout} giây")
+        time.sleep(0.5)
+
+
+def import_music(workdir, size_mb):
+    """Một bài nhạc dùng chung cho mọi phiên (mặc định của người dùng mới)"""
+    from music_library import SHARED_OWNER, MusicLibrary
+
+    path = os.path.join(workdir, f"load-{size_mb}.mp3")
+    make_music(path, size_mb)
+    library = MusicLibrary(os.path.join(workdir, "music", "library.db"), os.path.join(workdir, "static", "music"))
+    library.import_file(path, SHARED_OWNER, f"{size_mb} MB")
+
+
+# ==================== ĐO ====================
+def run_level(sessions, duration, think):
+    """Cho mọi phiên cùng đổi cài đặt trong ``duration`` giây"""
+    latencies, received, errors = [], [], []
+    lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+
+    def worker(session):
+        local_times, local_bytes = [], []
+        try:
+            while time.monotonic() < stop_at:
+                elapsed, size = session.step()
+                local_times.append(elapsed)
+                local_bytes.append(size)
+                if think:
+                    time.sleep(session.rng.uniform(0, 2 * think))
+        except Exception as e:  # một phiên lỗi không làm hỏng cả lượt đo
+            with lock:
+                errors.append(f"{session.uid}: {e}")
+        with lock:
+            latencies.extend(local_times)
+            received.extend(local_bytes)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(session,), daemon=True) for session in sessions]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    return {
+        "reruns": len(latencies),
+        "throughput_rps": round(len(latencies) / wall, 2),
+        "latency_ms": percentiles(latencies),
+        "received_bytes_per_rerun": round(statistics.mean(received)) if received else None,
+        "errors": errors + [f"{s.uid}: lỗi trong app" for s in sessions if s.errors],
+    }
+
+
+def rss_slope(levels):
+    """KB tăng thêm cho mỗi phiên (hồi quy tuyến tính RSS theo số phiên)"""
+    points = [(level["sessions"], level["rss_kb"]) for level in levels if level["rss_kb"] is not None]
+    if len(points) < 2:
+        return None
+    mean_x = statistics.mean(x for x, _ in points)
+    mean_y = statistics.mean(y for _, y in points)
+    spread = sum((x - mean_x) ** 2 for x, _ in points)
+    if not spread:
+        return None
+    return round(sum((x - mean_x) * (y - mean_y) for x, y in points) / spread, 1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, nargs="+", default=SESSION_LEVELS, help="các mức số phiên đồng thời")
+    parser.add_argument("--duration", type=float, default=15, help="số giây đo ở mỗi mức")
+    parser.add_argument("--think", type=float, default=0.5, help="thời gian nghỉ trung bình giữa hai thao tác (giây)")
+    parser.add_argument("--music", type=float, default=0, help="cỡ bài nhạc nền dùng chung (MB), 0 = không nhạc")
+    parser.add_argument("--url", help="server có sẵn, ví dụ ws://127.0.0.1:8501 (mặc định tự chạy server)")
+    parser.add_argument("--pid", type=int, help="pid của server có sẵn để đo RSS")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="ghi kết quả JSON vào file (mặc định in ra stdout)")
+    parser.add_argument("--keep", action="store_true", help="giữ lại thư mục tạm để xem")
+    args = parser.parse_args(argv)
+
+    workdir = proc = None
+    url, pid = args.url, args.pid
+    if url is None:
+        workdir = make_workspace()
+        sys.path.insert(0, workdir)
+        if args.music:
+            import_music(workdir, args.music)
+        port = free_port()
+        proc = start_server(workdir, port)
+        url, pid = f"ws://127.0.0.1:{port}", proc.pid
+
+    sessions, levels = [], []
+    try:
+        prepare(url)
+        baseline = rss_kb(pid) if pid else None
+        for count in sorted(set(args.sessions)):
+            while len(sessions) < count:
+                session = SimulatedSession(url, f"load-{len(sessions)}", seed=args.seed + len(sessions))
+                session.open()
+                sessions.append(session)
+            level = {"sessions": count, **run_level(sessions, args.duration, args.think)}
+            level["rss_kb"] = rss_kb(pid) if pid else None
+            level["rss_delta_per_session_kb"] = (
+                round((level["rss_kb"] - baseline) / count, 1) if baseline and level["rss_kb"] else None
+            )
+            levels.append(level)
+            print(
+                f"sessions={count:>4} rps={level['throughput_rps']:7.2f} "
+                f"p50={level['latency_ms']['p50']} p95={level['latency_ms']['p95']} "
+                f"p99={level['latency_ms']['p99']} ms rss={level['rss_kb']} KB errors={len(level['errors'])}",
+                file=sys.stderr,
+            )
+    finally:
+        for session in sessions:
+            session.close()
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=30)
+        if workdir and not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    result = {
+        "benchmark": "load",
+        "version": 1,
+        "revision": git_revision(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "tts_backend": os.environ.get("TTS_BACKEND", "stub") if args.url is None else None,
+        "duration": args.duration,
+        "think": args.think,
+        "music_mb": args.music,
+        "baseline_rss_kb": baseline,
+        "rss_per_session_kb": rss_slope(levels),
+        "levels": levels,
+    }
+    text = json.dumps(result, indent=1, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+"""Đo chi phí một lần rerun của app bằng AppTest (chạy headless, không cần trình duyệt).
+
+Mỗi trường hợp trong ma trận (cỡ nhạc nền x 2 giai đoạn x đọc đếm ngược) được
+chạy ``--reruns`` lần trên một bản sao của app trong thư mục tạm (không đụng
+tới cache / nhạc thật). Kết quả ghi dạng JSON để so sánh giữa các phiên bản:
+
+    python benchmarks/rerun_benchmark.py --output bench.json
+    python benchmarks/rerun_benchmark.py --music 0 5 --reruns 3
+
+Mỗi trường hợp gồm:
+- ``cold_ms``: lần chạy đầu (cache của process đã ấm từ bước chuẩn bị)
+- ``rerun_ms``: min / median / max của các lần rerun sau
+- ``stages_ms``: ms và số lần mỗi rerun của từng span app ghi (``metrics``: span
+  ``rerun`` của cả script do ``rerun_scope`` ghi, các panel, dựng sprite, player...),
+  lấy từ ``metrics.snapshot()`` trước / sau các lần rerun đo nên là đúng các
+  bước của rerun thật; span lồng nhau nên không cộng dồn được
+- ``outside_script_ms``: phần thời gian rerun nằm ngoài script (AppTest, Streamlit)
+- ``payload_bytes``: kích thước JSON gửi cho player component và của cả trang
+- ``py_alloc_peak_kb``: đỉnh bộ nhớ Python cấp phát trong một rerun (tracemalloc)
+- ``rss_peak_kb``: đỉnh RSS của process tính tới lúc đó
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_FILES = [
+    "app.py", "audio_format.py", "audio_sprite.py", "cue_processing.py", "ffmpeg_util.py", "file_lock.py", "gtts_client.py",
+    "metrics.py", "music_ingest.py", "music_library.py", "narration.py", "session_history.py", "session_render.py", "timeline.py",
+    "tts_backends.py", "tts_cache.py", "voice_assets.py", "voice_jobs.py", "voice_pack.py", "warmup.py",
+]
+APP_DIRS = ["player", ".streamlit"]
+BENCH_USER = "benchmark"
+MUSIC_SIZES_MB = [0, 5, 20, 50]
+
+# Frame MP3 hợp lệ (MPEG-2 Layer III, 24 kHz, 32 kbps) dùng để tạo file nhạc đúng cỡ
+_MP3_FRAME = bytes([0xFF, 0xF3, 0x44, 0xC4]) + bytes(92)
+
+
+def rss_peak_kb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def make_workspace():
+    """Bản sao tối thiểu của app trong thư mục tạm"""
+    workdir = tempfile.mkdtemp(prefix="meditation-bench-")
+    for name in APP_FILES:
+        shutil.copy2(os.path.join(REPO_DIR, name), workdir)
+    for name in APP_DIRS:
+        shutil.copytree(os.path.join(REPO_DIR, name), os.path.join(workdir, name))
+    os.makedirs(os.path.join(workdir, "static"))
+    return workdir
+
+
+def make_music(path, size_mb):
+    remaining = int(size_mb * 1024 * 1024) // len(_MP3_FRAME)
+    with open(path, "wb") as f:
+        while remaining:
+            count = min(4096, remaining)
+            f.write(_MP3_FRAME * count)
+            remaining -= count
+
+
+def tree_bytes(node):
+    """Tổng kích thước protobuf của mọi phần tử trên trang"""
+    size = node.proto.ByteSize() if getattr(node, "proto", None) is not None else 0
+    for child in getattr(node, "children", {}).values():
+        size += tree_bytes(child)
+    return size
+
+
+def component_payload(at):
+    for element in iter_elements(at._tree):
+        if getattr(element.proto, "component_name", "").endswith("meditation_player"):
+            return len(element.proto.json_args.encode("utf-8"))
+    return 0
+
+
+def iter_elements(node):
+    if getattr(node, "proto", None) is not None:
+        yield node
+    for child in getattr(node, "children", {}).values():
+        yield from iter_elements(child)
+
+
+def timed_run(at):
+    tracemalloc.start()
+    started = time.perf_counter()
+    at.run()
+    elapsed = (time.perf_counter() - started) * 1000
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    if at.exception:
+        raise RuntimeError(f"App lỗi: {at.exception[0].message}")
+    return elapsed, peak // 1024
+
+
+def music_library(workdir):
+    """Thư viện nhạc của bản sao app (import sau khi ``workdir`` đã vào sys.path)"""
+    from music_library import MusicLibrary
+
+    return MusicLibrary(os.path.join(workdir, "music", "library.db"), os.path.join(workdir, "static", "music"))
+
+
+def span_totals():
+    """{tên span (kèm nhãn): (số lần, tổng giây)} của ``metrics`` trong bản sao app"""
+    import metrics
+
+    totals = {}
+    for name, labels, count, total, _ in metrics.snapshot()["spans"]:
+        if labels:
+            name += "{" + ",".join(f"{key}={value}" for key, value in labels.items()) + "}"
+        totals[name] = (count, total)
+    return totals
+
+
+def stage_breakdown(before, after, reruns):
+    """Thời gian (ms) và số lần mỗi rerun của từng span app ghi giữa hai lần ``span_totals``"""
+    stages = {}
+    for name, (count, total) in sorted(after.items()):
+        prev_count, prev_total = before.get(name, (0, 0.0))
+        if count > prev_count:
+            stages[name] = {
+                "ms": round((total - prev_total) * 1000 / reruns, 3),
+                "calls": round((count - prev_count) / reruns, 2),
+            }
+    return stages
+
+
+def run_case(workdir, music_mb, two_phase, countdown, reruns):
+    from streamlit.testing.v1 import AppTest
+
+    library = music_library(workdir)
+    for track in library.tracks(BENCH_USER):
+        library.remove(track["owner"], track["sha256"])
+    sha256 = None
+    if music_mb:
+        path = os.path.join(workdir, f"bench-{music_mb}.mp3")
+        make_music(path, music_mb)
+        sha256 = library.import_file(path, BENCH_USER, f"{music_mb} MB")
+
+    at = AppTest.from_file(os.path.join(workdir, "app.py"), default_timeout=120)
+    at.session_state.user_id = BENCH_USER
+    at.session_state.music_track = sha256 or ""
+    cold_ms, _ = timed_run(at)
+    if two_phase:
+        at.checkbox(key="two_phase_mode").check()
+    if not countdown:
+        at.checkbox(key="prepare_countdown_voice").uncheck()
+    timed_run(at)
+
+    times, allocs = [], []
+    spans_before = span_totals()
+    for _ in range(reruns):
+        elapsed, peak = timed_run(at)
+        times.append(elapsed)
+        allocs.append(peak)
+    stages = stage_breakdown(spans_before, span_totals(), reruns)
+
+    return {
+        "music_mb": music_mb,
+        "two_phase": two_phase,
+        "countdown_voice": countdown,
+        "cold_ms": round(cold_ms, 2),
+        "rerun_ms": {
+            "min": round(min(times), 2),
+            "median": round(statistics.median(times), 2),
+            "max": round(max(times), 2),
+        },
+        "stages_ms": stages,
+        "outside_script_ms": round(statistics.mean(times) - stages.get("rerun", {}).get("ms", 0), 2),
+        "payload_bytes": {"player": component_payload(at), "page": tree_bytes(at._tree)},
+        "py_alloc_peak_kb": max(allocs),
+        "rss_peak_kb": rss_peak_kb(),
+    }
+
+
+def prepare(workdir):
+    """Tạo sẵn giọng nói (engine stub) bằng warmup.py để các trường hợp đo chỉ còn chi phí rerun.
+
+    Không dựng sẵn sprite: lần chạy đầu của mỗi trường hợp vẫn gồm bước dựng sprite như trước.
+    """
+    subprocess.run(
+        [sys.executable, "warmup.py", "--lang", "vi", "--skip-sprites"],
+        cwd=workdir, check=True, stdout=subprocess.DEVNULL,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--music", type=float, nargs="+", default=MUSIC_SIZES_MB, help="cỡ nhạc nền (MB), 0 = không nhạc")
+    parser.add_argument("--reruns", type=int, default=5, help="số lần rerun đo cho mỗi trường hợp")
+    parser.add_argument("--output", help="ghi kết quả JSON vào file (mặc định in ra stdout)")
+    parser.add_argument("--keep", action="store_true", help="giữ lại thư mục tạm để xem")
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault("TTS_BACKEND", "stub")
+    workdir = make_workspace()
+    cwd = os.getcwd()
+    sys.path.insert(0, workdir)
+    os.chdir(workdir)
+    try:
+        prepare(workdir)
+        cases = []
+        for music_mb in args.music:
+            for two_phase in (False, True):
+                for countdown in (True, False):
+                    case = run_case(workdir, music_mb, two_phase, countdown, args.reruns)
+                    cases.append(case)
+                    print(
+                        f"music={music_mb:>4} MB two_phase={two_phase!s:<5} countdown={countdown!s:<5} "
+                        f"rerun={case['rerun_ms']['median']:7.1f} ms player={case['payload_bytes']['player']} B",
+                        file=sys.stderr,
+                    )
+    finally:
+        os.chdir(cwd)
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    result = {
+        "benchmark": "rerun",
+        "version": 2,
+        "revision": git_revision(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "tts_backend": os.environ["TTS_BACKEND"],
+        "reruns": args.reruns,
+        "cases": cases,
+    }
+    text = json.dumps(result, indent=1, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
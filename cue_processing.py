@@ -0,0 +1,138 @@
+"""Xử lý cue giọng nói ngay sau khi tạo: cắt khoảng lặng hai đầu, chuẩn hóa đỉnh, nén mono.
+
+gTTS chèn khoảng lặng ở cả hai đầu nên "Hít vào" nghe trễ hơn lúc vòng tròn đổi
+màu và các số đếm ngược (mỗi giây một số) đè lên nhau. Ở đây cue được giải mã,
+tìm đoạn có tiếng bằng năng lượng từng khung 10 ms (numpy, không lặp từng
+mẫu), chỉ giữ đoạn đó cộng một chút đệm, đưa đỉnh về ``PEAK_DB`` rồi nén lại:
+
+- có ffmpeg: MP3 mono ``CUE_RATE`` Hz, ``CUE_BITRATE`` (cùng kiểu frame với gTTS)
+- không có ffmpeg: WAV mono 16-bit; cue MP3 thì không giải mã được nên giữ nguyên
+
+``pipeline()`` đổi theo cách xử lý nên được đưa vào khóa cache: cue xử lý
+khác nhau không bao giờ lẫn vào cùng một sprite.
+"""
+import io
+import subprocess
+import wave
+
+import numpy as np
+
+from audio_format import is_wav, read_wav
+from ffmpeg_util import find_ffmpeg, which_ffmpeg
+
+PROCESS_VERSION = 1
+CUE_RATE = 24000
+CUE_BITRATE = "24k"
+FRAME_SECONDS = 0.01
+SILENCE_DB = -40.0      # khung nhỏ hơn khung to nhất quá mức này coi là lặng
+NOISE_FLOOR_DB = -60.0  # và luôn coi là lặng nếu dưới mức tuyệt đối này
+PAD_BEFORE = 0.02       # giây giữ lại trước / sau đoạn có tiếng
+PAD_AFTER = 0.05
+FADE_SECONDS = 0.005    # vuốt hai đầu để không có tiếng "tách" chỗ cắt
+PEAK_DB = -1.0
+MAX_GAIN_DB = 20.0
+
+
+def pipeline():
+    """Tên cách xử lý cue của môi trường này (đưa vào khóa cache)"""
+    return f"p{PROCESS_VERSION}-{'ffmpeg' if which_ffmpeg() else 'numpy'}"
+
+
+# ==================== GIẢI MÃ / NÉN ====================
+def decode_cue(data):
+    """(mẫu float32 mono, tần số mẫu); MP3 cần ffmpeg"""
+    if is_wav(data):
+        params, pcm = read_wav(data)
+        if params.sampwidth != 2:
+            raise ValueError("Chỉ hỗ trợ WAV 16-bit")
+        samples = np.frombuffer(pcm, dtype="<i2").astype(np.float32) / 32768
+        if params.nchannels > 1:
+            samples = samples.reshape(-1, params.nchannels).mean(axis=1)
+        return samples, params.framerate
+    result = subprocess.run(
+        [find_ffmpeg(), "-v", "error", "-i", "pipe:0", "-f", "s16le", "-ac", "1", "-ar", str(CUE_RATE), "pipe:1"],
+        input=data,
+        capture_output=True,
+        check=True,
+    )
+    return np.frombuffer(result.stdout, dtype="<i2").astype(np.float32) / 32768, CUE_RATE
+
+
+def _pcm16(samples):
+    return (np.clip(samples, -1, 1) * 32767).astype("<i2").tobytes()
+
+
+def encode_wav(samples, rate):
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(_pcm16(samples))
+    return buf.getvalue()
+
+
+def encode_mp3(samples, rate):
+    """MP3 mono CUE_RATE; không ghi frame Xing để các cue nối thành sprite không có frame thừa"""
+    result = subprocess.run(
+        [find_ffmpeg(), "-v", "error", "-f", "s16le", "-ar", str(rate), "-ac", "1", "-i", "pipe:0",
+         "-ar", str(CUE_RATE), "-c:a", "libmp3lame", "-b:a", CUE_BITRATE, "-write_xing", "0", "-f", "mp3", "pipe:1"],
+        input=_pcm16(samples),
+        capture_output=True,
+        check=True,
+    )
+    return result.stdout
+
+
+# ==================== XỬ LÝ ====================
+def speech_bounds(samples, rate):
+    """(mẫu đầu, mẫu cuối) của đoạn có tiếng, hoặc None nếu toàn lặng"""
+    frame = max(1, int(rate * FRAME_SECONDS))
+    count = len(samples) // frame
+    if not count:
+        return None
+    frames = samples[:count * frame].reshape(count, frame)
+    power = np.mean(frames * frames, axis=1)
+    threshold = max(float(power.max()) * 10 ** (SILENCE_DB / 10), 10 ** (NOISE_FLOOR_DB / 10))
+    voiced = np.flatnonzero(power > threshold)
+    if not len(voiced):
+        return None
+    return int(voiced[0]) * frame, min(len(samples), (int(voiced[-1]) + 1) * frame)
+
+
+def trim_and_normalize(samples, rate):
+    """Cắt khoảng lặng hai đầu (giữ đệm), vuốt hai đầu và đưa đỉnh về PEAK_DB; trả về (mẫu, giây có tiếng)"""
+    bounds = speech_bounds(samples, rate)
+    if bounds is None:
+        raise ValueError("Cue không có tiếng")
+    start, end = bounds
+    speech = (end - start) / rate
+    samples = samples[max(0, start - int(PAD_BEFORE * rate)):end + int(PAD_AFTER * rate)].copy()
+
+    fade = min(int(FADE_SECONDS * rate), len(samples) // 2)
+    if fade:
+        ramp = np.linspace(0, 1, fade, dtype=np.float32)
+        samples[:fade] *= ramp
+        samples[-fade:] *= ramp[::-1]
+
+    peak = float(np.max(np.abs(samples)))
+    gain = min(10 ** (PEAK_DB / 20) / peak, 10 ** (MAX_GAIN_DB / 20))
+    return samples * np.float32(gain), speech
+
+
+def process_cue(data):
+    """Bytes audio từ TTS -> (bytes đã xử lý, thông tin ghi vào manifest)"""
+    ffmpeg = which_ffmpeg()
+    if not ffmpeg and not is_wav(data):
+        return data, {"pipeline": pipeline()}  # không giải mã được MP3: giữ nguyên
+    samples, rate = decode_cue(data)
+    original = len(samples) / rate
+    samples, speech = trim_and_normalize(samples, rate)
+    out = encode_mp3(samples, rate) if ffmpeg else encode_wav(samples, rate)
+    return out, {
+        "pipeline": pipeline(),
+        "speech_duration": round(speech, 3),
+        "trimmed": round(original - len(samples) / rate, 3),
+        "source_bytes": len(data),
+    }
+
@@ -0,0 +1,21 @@
+"""Tìm ffmpeg một lần cho cả process.
+
+``shutil.which`` duyệt từng thư mục trong PATH, mà cache giọng nói, render và
+nhạc nền hỏi ffmpeg nhiều lần mỗi rerun, nên kết quả được nhớ lại. Cài / gỡ
+ffmpeg trong lúc app đang chạy cần khởi động lại process.
+"""
+import functools
+import shutil
+
+
+@functools.lru_cache(maxsize=None)
+def which_ffmpeg():
+    """Đường dẫn ffmpeg hoặc None nếu không có"""
+    return shutil.which("ffmpeg")
+
+
+def find_ffmpeg():
+    executable = which_ffmpeg()
+    if not executable:
+        raise RuntimeError("Không tìm thấy ffmpeg. Cài đặt: apt install ffmpeg")
+    return executable
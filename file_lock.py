@@ -0,0 +1,60 @@
+"""Khóa file dùng được giữa nhiều process (và nhiều luồng) trên cùng một ổ đĩa chung.
+
+Dùng khi nhiều process Streamlit cùng ghi vào một thư mục cache: chỉ một bên
+được tạo / sửa một mục tại một thời điểm, các bên còn lại chờ rồi đọc kết quả.
+"""
+import os
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class FileLock:
+    """Khóa độc quyền trên ``path`` (file được tạo nếu chưa có), dùng với ``with``"""
+
+    def __init__(self, path, timeout=None, poll=0.05):
+        self.path = path
+        self.timeout = timeout
+        self.poll = poll
+        self._fd = None
+
+    def acquire(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while True:
+            try:
+                if fcntl:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                else:
+                    msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                break
+            except OSError:
+                if deadline is not None and time.monotonic() > deadline:
+                    os.close(fd)
+                    raise TimeoutError(f"Không lấy được khóa {self.path}")
+                time.sleep(self.poll)
+        self._fd = fd
+        return self
+
+    def release(self):
+        fd, self._fd = self._fd, None
+        if fd is None:
+            return
+        try:
+            if fcntl:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(fd)
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc):
+        self.release()
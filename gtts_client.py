@@ -0,0 +1,106 @@
+"""Client gTTS dùng chung một HTTP session (giữ kết nối) và tự thử lại khi bị giới hạn.
+
+gTTS tự mở một ``requests.Session`` mới cho mỗi request. Ở đây ta chỉ dùng gTTS
+để dựng request, còn việc gửi đi qua một session có connection pool dùng chung
+cho mọi luồng. Đặt ``GTTS_ENDPOINT`` để trỏ sang một endpoint giả lập cục bộ
+(ví dụ ``tests/fake_gtts.py`` khi chạy thử không có mạng).
+
+Việc dựng request dùng ``gTTS._prepare_requests()`` (API nội bộ, đã kiểm tra với
+gTTS 2.5). Nếu bản gTTS khác không còn hàm này, client quay về ``write_to_fp``
+công khai của gTTS (không dùng được session chung, backoff và ``GTTS_ENDPOINT``).
+"""
+import base64
+import io
+import os
+import random
+import re
+import time
+import urllib.request
+
+import requests
+from requests.adapters import HTTPAdapter
+from gtts import gTTS, gTTSError
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+_AUDIO_RE = re.compile(r'jQ1olc","\[\\"(.*)\\"]')
+
+
+class GTTSClient:
+    """Gửi request gTTS qua session dùng chung, backoff lũy thừa khi lỗi tạm thời"""
+
+    def __init__(self, pool_size=8, max_retries=5, backoff=0.5, max_backoff=8.0,
+                 timeout=10, endpoint=None):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.endpoint = endpoint if endpoint is not None else os.environ.get("GTTS_ENDPOINT")
+        self._adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self._session = requests.Session()
+        self._session.mount("https://", self._adapter)
+        self._session.mount("http://", self._adapter)
+        self._proxies = urllib.request.getproxies()
+
+    def close(self):
+        self._session.close()
+
+    def _send(self, prepared):
+        """Gửi một request, thử lại với 429/5xx và lỗi kết nối"""
+        delay = self.backoff
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self._session.send(
+                    prepared,
+                    proxies=self._proxies,
+                    timeout=self.timeout,
+                )
+            except requests.exceptions.RequestException:
+                if attempt == self.max_retries:
+                    raise
+                response = None
+
+            if response is not None and response.status_code not in RETRY_STATUS:
+                return response
+            if attempt == self.max_retries:
+                return response
+
+            retry_after = response.headers.get("Retry-After") if response is not None else None
+            wait = float(retry_after) if retry_after and retry_after.isdigit() else delay
+            time.sleep(min(wait, self.max_backoff) * random.uniform(0.8, 1.2))
+            delay = min(delay * 2, self.max_backoff)
+
+    def synthesize(self, text, lang="vi", slow=False):
+        """Trả về bytes MP3 của ``text``"""
+        tts = gTTS(text=text, lang=lang, slow=slow, timeout=self.timeout)
+        prepare_requests = getattr(tts, "_prepare_requests", None)
+        if not callable(prepare_requests):
+            return self._synthesize_public(tts)
+        chunks = []
+        for prepared in prepare_requests():
+            if self.endpoint:
+                prepared.url = self.endpoint
+            try:
+                response = self._send(prepared)
+                response.raise_for_status()
+            except requests.exceptions.HTTPError:
+                raise gTTSError(tts=tts, response=response)
+            except requests.exceptions.RequestException:
+                raise gTTSError(tts=tts)
+
+            found = False
+            for line in response.iter_lines(chunk_size=1024):
+                match = _AUDIO_RE.search(line.decode("utf-8"))
+                if match:
+                    chunks.append(base64.b64decode(match.group(1).encode("ascii")))
+                    found = True
+            if not found:
+                raise gTTSError(tts=tts, response=response)
+        return b"".join(chunks)
+
+    def _synthesize_public(self, tts):
+        """Đường dự phòng qua API công khai của gTTS (mỗi request một session, không thử lại)"""
+        if self.endpoint:
+            raise gTTSError("GTTS_ENDPOINT cần gTTS có _prepare_requests (gTTS 2.x)")
+        fp = io.BytesIO()
+        tts.write_to_fp(fp)
+        return fp.getvalue()
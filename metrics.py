@@ -0,0 +1,218 @@
+"""Số liệu hiệu năng trong process: bộ đếm, thời gian từng bước (span) và profiler rerun.
+
+- ``inc("tts_calls", engine="gtts")``: tăng bộ đếm (có nhãn)
+- ``with span("sprite_build"):`` hoặc ``@timed("...")``: đo thời gian một bước
+- ``render_prometheus()``: xuất dạng text của Prometheus; đặt ``METRICS_PORT``
+  để mở endpoint ``/metrics`` (``start_http_server``)
+- ``RerunProfiler``: đặt ``PROFILE_SLOWEST=N`` để giữ profile cProfile của N
+  lần rerun chậm nhất trong ``PROFILE_DIR``
+- ``with rerun_scope(profiler):``: đo cả một lần chạy script (span, trace, profile)
+
+Số liệu là của từng process; chạy nhiều process thì scrape từng process.
+"""
+import contextlib
+import cProfile
+import functools
+import heapq
+import io
+import os
+import pstats
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PREFIX = "meditation"
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0") or 0)
+PROFILE_SLOWEST = int(os.environ.get("PROFILE_SLOWEST", "0") or 0)
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+
+_lock = threading.Lock()
+_counters = {}  # (tên, nhãn) -> giá trị
+_spans = {}     # (tên, nhãn) -> [số lần, tổng giây, lâu nhất]
+_local = threading.local()
+_started = time.time()
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+# ==================== GHI ====================
+def inc(name, value=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, seconds, **labels):
+    key = _key(name, labels)
+    with _lock:
+        stat = _spans.setdefault(key, [0, 0.0, 0.0])
+        stat[0] += 1
+        stat[1] += seconds
+        stat[2] = max(stat[2], seconds)
+    trace = getattr(_local, "trace", None)
+    if trace is not None:
+        trace.append((name, seconds))
+
+
+@contextlib.contextmanager
+def span(name, **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+
+def timed(name):
+    """Decorator đo thời gian mỗi lần gọi hàm"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def begin_trace():
+    """Bắt đầu ghi các span của luồng hiện tại (một lần rerun)"""
+    _local.trace = []
+
+
+def end_trace():
+    """Kết thúc và trả về [(span, giây)] theo thứ tự hoàn thành"""
+    trace, _local.trace = getattr(_local, "trace", None) or [], None
+    return trace
+
+
+@contextlib.contextmanager
+def rerun_scope(profiler=None, name="rerun"):
+    """Đo một lần chạy cả script: span ``name``, trace các bước và profile (nếu có profiler).
+
+    Trả về dict, sau khi ra khỏi khối có ``trace`` và ``seconds``. Kết thúc trong
+    finally nên lần chạy dừng giữa chừng (``st.rerun()``, ``st.stop()``, lỗi) vẫn
+    được ghi và profiler luôn được tắt; ngoại lệ (kể cả ngoại lệ điều khiển của
+    Streamlit) được ném tiếp.
+    """
+    result = {"trace": [], "seconds": None}
+    started = time.perf_counter()
+    begin_trace()
+    handle = profiler.start() if profiler else None
+    try:
+        yield result
+    finally:
+        result["seconds"] = time.perf_counter() - started
+        observe(name, result["seconds"])
+        result["trace"] = end_trace()
+        if profiler:
+            profiler.stop(handle)
+
+
+# ==================== ĐỌC ====================
+def snapshot():
+    """{"counters": [(tên, nhãn, giá trị)], "spans": [(tên, nhãn, số lần, tổng, lâu nhất)]}"""
+    with _lock:
+        counters = [(name, dict(labels), value) for (name, labels), value in sorted(_counters.items())]
+        spans = [(name, dict(labels), *stat) for (name, labels), stat in sorted(_spans.items())]
+    return {"counters": counters, "spans": spans, "uptime": time.time() - _started}
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for value in labels.values())
+    return "{" + ",".join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + "}"
+
+
+def render_prometheus():
+    """Số liệu dạng text exposition của Prometheus"""
+    data = snapshot()
+    lines = [
+        f"# TYPE {PREFIX}_uptime_seconds gauge",
+        f"{PREFIX}_uptime_seconds {data['uptime']:.3f}",
+    ]
+    seen = set()
+    for name, labels, value in data["counters"]:
+        metric = f"{PREFIX}_{name}_total"
+        if metric not in seen:
+            lines.append(f"# TYPE {metric} counter")
+            seen.add(metric)
+        lines.append(f"{metric}{_labels(labels)} {value}")
+    if data["spans"]:
+        lines.append(f"# TYPE {PREFIX}_span_seconds summary")
+        for name, labels, count, total, longest in data["spans"]:
+            series = _labels({"span": name, **labels})
+            lines.append(f"{PREFIX}_span_seconds_count{series} {count}")
+            lines.append(f"{PREFIX}_span_seconds_sum{series} {total:.6f}")
+        lines.append(f"# TYPE {PREFIX}_span_seconds_max gauge")
+        for name, labels, _, _, longest in data["spans"]:
+            lines.append(f"{PREFIX}_span_seconds_max{_labels({'span': name, **labels})} {longest:.6f}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_http_server(port, host="0.0.0.0"):
+    """Mở endpoint /metrics trong luồng nền; trả về server"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+# ==================== PROFILER ====================
+class RerunProfiler:
+    """Profile từng lần rerun, chỉ giữ lại file của ``keep`` lần chậm nhất"""
+
+    def __init__(self, keep, out_dir=PROFILE_DIR):
+        self.keep = keep
+        self.out_dir = out_dir
+        self._lock = threading.Lock()
+        self._slowest = []  # heap (giây, đường dẫn)
+        os.makedirs(out_dir, exist_ok=True)
+
+    def start(self):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            return None  # Python 3.12+: đang có profiler khác chạy ở luồng khác
+        return profile, time.perf_counter()
+
+    def stop(self, handle, label="rerun"):
+        if handle is None:
+            return
+        profile, started = handle
+        profile.disable()
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            if len(self._slowest) >= self.keep and elapsed <= self._slowest[0][0]:
+                return
+            path = os.path.join(self.out_dir, f"{label}-{elapsed * 1000:08.1f}ms-{time.time_ns()}.prof")
+            profile.dump_stats(path)
+            # Kèm bản tóm tắt đọc được ngay không cần công cụ
+            summary = io.StringIO()
+            pstats.Stats(profile, stream=summary).sort_stats("cumulative").print_stats(30)
+            with open(path[:-5] + ".txt", "w", encoding="utf-8") as f:
+                f.write(summary.getvalue())
+            heapq.heappush(self._slowest, (elapsed, path))
+            if len(self._slowest) > self.keep:
+                _, dropped = heapq.heappop(self._slowest)
+                for old in (dropped, dropped[:-5] + ".txt"):
+                    with contextlib.suppress(OSError):
+                        os.remove(old)
@@ -0,0 +1,169 @@
+"""Xử lý nhạc nền sau khi upload: mono, giảm tần số mẫu, nén bitrate thấp, chuẩn hóa âm lượng.
+
+Nhạc thiền (ambient) gần như không mất gì khi chuyển sang mono 24 kHz, 32 kbps
+nhưng file nhỏ đi cỡ 4-10 lần nên tải nhanh hơn hẳn trên điện thoại. Độ to
+được đưa về ngang với giọng đọc (đo bằng RMS có ngưỡng lọc khoảng lặng), nên
+thanh âm lượng nhạc có ý nghĩa như nhau với mọi bài. Chỉ dùng một hệ số khuếch
+đại cố định (không nén dải động) và giữ đỉnh dưới ``PEAK_LIMIT_DB``.
+
+Việc xử lý chạy trong luồng nền (``IngestJob``) và báo tiến độ để UI hiển thị.
+"""
+import math
+import os
+import subprocess
+import threading
+import time
+import uuid
+
+import numpy as np
+
+from audio_format import mp3_file_duration
+from ffmpeg_util import find_ffmpeg
+from session_render import decode_audio
+
+MUSIC_RATE = 24000
+MUSIC_BITRATE = "32k"
+DEFAULT_TARGET_DB = -20.0  # độ to mặc định khi chưa có giọng đọc để so
+PEAK_LIMIT_DB = -1.0
+MAX_GAIN_DB = 20.0
+GATE_DB = -50.0            # khung 50 ms nhỏ hơn mức này coi là lặng, không tính
+DECODE_SHARE = 0.5         # phần tiến độ dành cho bước giải mã
+
+
+# ==================== ĐO ĐỘ TO ====================
+def _frame_power(samples, rate):
+    """Năng lượng trung bình của từng khung 50 ms"""
+    frame = rate // 20
+    count = len(samples) // frame
+    if not count:
+        return np.zeros(0)
+    frames = np.asarray(samples[:count * frame], dtype=np.float32).reshape(count, frame)
+    return np.mean(frames * frames, axis=1)
+
+
+def _gated_db(powers):
+    """Độ to (dBFS) tính trên các khung không lặng; None nếu toàn lặng"""
+    gated = powers[powers > 10 ** (GATE_DB / 10)]
+    if not len(gated):
+        return None
+    return 10 * math.log10(float(np.mean(gated)))
+
+
+def voice_loudness(sources, rate=MUSIC_RATE):
+    """Độ to chung của các cue giọng nói (đường dẫn hoặc bytes / memoryview)"""
+    powers = [_frame_power(decode_audio(source, rate), rate) for source in sources]
+    return _gated_db(np.concatenate(powers)) if powers else None
+
+
+# ==================== JOB ====================
+class IngestJob:
+    """Chuyển file nhạc ``src`` thành ``dest`` đã nén và chuẩn hóa, chạy trong luồng nền.
+
+    keep_original: đường dẫn để giữ lại file gốc, None thì xóa file gốc khi xong.
+    on_done: gọi với ``result`` (trong luồng nền) sau khi file đích đã sẵn sàng.
+    """
+
+    def __init__(self, src, dest, target_db=None, keep_original=None, on_done=None):
+        self.id = uuid.uuid4().hex
+        self.src = src
+        self.dest = dest
+        self.target_db = DEFAULT_TARGET_DB if target_db is None else target_db
+        self.keep_original = keep_original
+        self.on_done = on_done
+        self.status = "pending"  # pending -> running -> done / error
+        self.progress = 0.0
+        self.error = None
+        self.result = None
+        self.started = None
+        self._thread = threading.Thread(target=self._run, name=f"music-ingest-{self.id[:8]}", daemon=True)
+
+    def start(self):
+        self.status = "running"
+        self.started = time.time()
+        self._thread.start()
+        return self
+
+    @property
+    def finished(self):
+        return self.status in ("done", "error")
+
+    def _ffmpeg(self, args, duration, base, share):
+        """Chạy ffmpeg, cập nhật tiến độ theo out_time của -progress"""
+        proc = subprocess.Popen(
+            [find_ffmpeg(), "-v", "error", "-nostats", "-progress", "pipe:1", "-y", *args],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        for line in proc.stdout:
+            key, _, value = line.strip().partition("=")
+            if key == "out_time_us" and value.isdigit() and duration:
+                self.progress = base + share * min(int(value) / 1e6 / duration, 1.0)
+        if proc.wait() != 0:
+            raise RuntimeError(f"ffmpeg lỗi: {proc.stderr.read().strip()}")
+
+    def _run(self):
+        pcm_path = f"{self.src}.{self.id}.s16"
+        tmp_path = f"{self.dest}.{self.id}.tmp"
+        try:
+            duration = mp3_file_duration(self.src)
+            if not duration:
+                raise ValueError("File không phải MP3 hợp lệ")
+
+            # 1. Giải mã thành PCM mono để đo độ to (đọc qua memmap, không nạp cả bài)
+            self._ffmpeg(
+                ["-i", self.src, "-f", "s16le", "-ac", "1", "-ar", str(MUSIC_RATE), pcm_path],
+                duration, 0.0, DECODE_SHARE,
+            )
+            pcm = np.memmap(pcm_path, dtype="<i2", mode="r") if os.path.getsize(pcm_path) else np.zeros(0, "<i2")
+            block = MUSIC_RATE * 60
+            powers = []
+            peak = 0
+            for start in range(0, len(pcm), block):
+                chunk = pcm[start:start + block].astype(np.float32) / 32768
+                powers.append(_frame_power(chunk, MUSIC_RATE))
+                peak = max(peak, float(np.max(np.abs(chunk))) if len(chunk) else 0)
+            level = _gated_db(np.concatenate(powers)) if powers else None
+            del pcm
+
+            gain = 0.0
+            if level is not None:
+                gain = max(-MAX_GAIN_DB, min(MAX_GAIN_DB, self.target_db - level))
+            if peak > 0:
+                gain = min(gain, PEAK_LIMIT_DB - 20 * math.log10(peak))
+
+            # 2. Khuếch đại cố định rồi nén MP3 mono bitrate thấp
+            self._ffmpeg(
+                ["-f", "s16le", "-ar", str(MUSIC_RATE), "-ac", "1", "-i", pcm_path,
+                 "-af", f"volume={gain:.2f}dB", "-c:a", "libmp3lame", "-b:a", MUSIC_BITRATE,
+                 "-f", "mp3", tmp_path],
+                duration, DECODE_SHARE, 1 - DECODE_SHARE,
+            )
+            os.replace(tmp_path, self.dest)
+
+            original_size = os.path.getsize(self.src)
+            if self.keep_original:
+                os.makedirs(os.path.dirname(self.keep_original) or ".", exist_ok=True)
+                os.replace(self.src, self.keep_original)
+            else:
+                os.remove(self.src)
+            self.result = {
+                "duration": duration,
+                "original_size": original_size,
+                "size": os.path.getsize(self.dest),
+                "gain_db": round(gain, 1),
+                "elapsed": time.time() - self.started,
+            }
+            if self.on_done:
+                self.on_done(self.result)
+            self.progress = 1.0
+            self.status = "done"
+        except Exception as e:
+            self.error = str(e)
+            self.status = "error"
+            if os.path.exists(self.src):
+                os.remove(self.src)
+        finally:
+            for path in (pcm_path, tmp_path):
+                if os.path.exists(path):
+                    os.remove(path)
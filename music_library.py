@@ -0,0 +1,255 @@
+"""Thư viện nhạc nền: lưu theo nội dung (hash), danh sách riêng từng người và dùng chung.
+
+- Upload được ghi từng khối vào file tạm (vừa ghi vừa tính sha256) rồi đổi tên
+  nguyên tử, nên không có file ghi dở và không giữ thêm một bản trong bộ nhớ.
+- Mỗi bài lưu một lần tại ``<store_dir>/<sha256[:32]>.mp3`` (hash của file
+  upload gốc): cùng một bài upload nhiều lần, nhiều người, chỉ xử lý và lưu một lần.
+- Danh sách bài của từng người (và mục dùng chung ``SHARED_OWNER``) nằm trong
+  SQLite (chế độ WAL, an toàn khi nhiều process cùng đọc ghi).
+- Mỗi người có hạn mức riêng, toàn thư viện có hạn mức chung; vượt thì bỏ các
+  bài lâu không dùng nhất (LRU). File chỉ bị xóa khi không còn ai giữ.
+"""
+import contextlib
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+SHARED_OWNER = "*"
+UPLOAD_CHUNK = 1024 * 1024
+DEFAULT_USER_QUOTA = int(float(os.environ.get("MUSIC_USER_QUOTA_MB", "100")) * 1024 * 1024)
+DEFAULT_MAX_BYTES = int(float(os.environ.get("MUSIC_LIBRARY_MAX_MB", "1000")) * 1024 * 1024)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    sha256 TEXT PRIMARY KEY,
+    file TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    duration REAL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS library (
+    owner TEXT NOT NULL,
+    sha256 TEXT NOT NULL REFERENCES tracks(sha256),
+    name TEXT NOT NULL,
+    added REAL NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (owner, sha256)
+);
+CREATE INDEX IF NOT EXISTS library_sha256 ON library(sha256);
+"""
+
+
+def write_chunked(fileobj, directory, chunk_size=UPLOAD_CHUNK):
+    """Ghi fileobj vào file tạm theo từng khối; trả về (đường dẫn tạm, sha256, kích thước)"""
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = os.path.join(directory, f"upload.{os.getpid()}.{threading.get_ident()}.{time.time_ns()}.tmp")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp_path, "wb") as f:
+            while True:
+                block = fileobj.read(chunk_size)
+                if not block:
+                    break
+                digest.update(block)
+                f.write(block)
+                size += len(block)
+            f.flush()
+            os.fsync(f.fileno())
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return tmp_path, digest.hexdigest(), size
+
+
+class MusicLibrary:
+    """Kho nhạc theo hash + danh sách theo người dùng trong SQLite"""
+
+    def __init__(self, db_path, store_dir, user_quota=DEFAULT_USER_QUOTA, max_bytes=DEFAULT_MAX_BYTES):
+        self.db_path = db_path
+        self.store_dir = store_dir
+        # File tạm ghi cạnh DB: store_dir nằm trong static/ (phục vụ công khai)
+        self.work_dir = os.path.dirname(db_path) or "."
+        self.user_quota = user_quota
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(store_dir, exist_ok=True)
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with db:  # commit khi xong, rollback khi lỗi
+                yield db
+        finally:
+            db.close()
+
+    # ---------- kho file ----------
+    @staticmethod
+    def track_filename(sha256):
+        return f"{sha256[:32]}.mp3"
+
+    def track_path(self, sha256):
+        return os.path.join(self.store_dir, self.track_filename(sha256))
+
+    def has_track(self, sha256):
+        with self._connect() as db:
+            row = db.execute("SELECT file FROM tracks WHERE sha256 = ?", (sha256,)).fetchone()
+        return row is not None and os.path.exists(os.path.join(self.store_dir, row[0]))
+
+    def add_track(self, sha256, path, duration=None, owner=None, name=None):
+        """Đưa file đã xử lý vào kho (đổi tên nguyên tử) và ghi vào bảng tracks.
+
+        Có ``owner`` thì thêm luôn vào danh sách của owner trong cùng transaction:
+        không có lúc nào bài mới nằm trong kho mà chưa ai giữ, nên lượt dọn bài mồ
+        côi của ``remove`` / ``add_to_library`` chạy song song không xóa mất bài.
+        """
+        dest = self.track_path(sha256)
+        now = time.time()
+        orphans = []
+        with self._lock, self._connect() as db:
+            db.execute(
+                "INSERT INTO tracks (sha256, file, size, duration, created, last_used) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(sha256) DO UPDATE SET file = excluded.file, size = excluded.size, "
+                "duration = excluded.duration, last_used = excluded.last_used",
+                (sha256, os.path.basename(dest), os.path.getsize(path), duration, now, now),
+            )
+            if owner is not None:
+                orphans = self._add_to_library(db, owner, sha256, name, now)
+            # Đổi tên khi đã giữ khóa ghi của DB: lỗi thì rollback, không để dòng trỏ tới file không có
+            os.replace(path, dest)
+        self._remove_files(orphans)
+        return dest
+
+    # ---------- danh sách ----------
+    def add_to_library(self, owner, sha256, name):
+        """Thêm bài đã có trong kho vào danh sách của owner rồi áp hạn mức.
+
+        Trả về False (không thêm gì) nếu bài không còn trong kho, ví dụ vừa bị dọn
+        sau khi gọi ``has_track``: khi đó cần đưa file vào lại bằng ``add_track``.
+        """
+        now = time.time()
+        with self._lock, self._connect() as db:
+            if db.execute("SELECT 1 FROM tracks WHERE sha256 = ?", (sha256,)).fetchone() is None:
+                return False
+            orphans = self._add_to_library(db, owner, sha256, name, now)
+        self._remove_files(orphans)
+        return True
+
+    def _add_to_library(self, db, owner, sha256, name, now):
+        """Thêm dòng library và áp hạn mức trong transaction ``db``; trả về các file mồ côi cần xóa"""
+        db.execute(
+            "INSERT INTO library (owner, sha256, name, added, last_used) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(owner, sha256) DO UPDATE SET name = excluded.name, last_used = excluded.last_used",
+            (owner, sha256, name, now, now),
+        )
+        db.execute("UPDATE tracks SET last_used = ? WHERE sha256 = ?", (now, sha256))
+        if owner != SHARED_OWNER:
+            self._evict_owner(db, owner, keep=sha256)
+        self._evict_global(db, keep=sha256)
+        return self._delete_orphans(db)
+
+    def tracks(self, owner):
+        """Bài của owner và bài dùng chung, mới dùng gần nhất trước"""
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT l.owner, l.sha256, l.name, t.size, t.duration, l.last_used "
+                "FROM library l JOIN tracks t ON t.sha256 = l.sha256 "
+                "WHERE l.owner IN (?, ?) ORDER BY l.last_used DESC",
+                (owner, SHARED_OWNER),
+            ).fetchall()
+        keys = ("owner", "sha256", "name", "size", "duration", "last_used")
+        return [dict(zip(keys, row)) for row in rows]
+
+    def touch(self, owner, sha256):
+        """Đánh dấu vừa dùng (cho LRU)"""
+        now = time.time()
+        with self._connect() as db:
+            db.execute("UPDATE library SET last_used = ? WHERE sha256 = ? AND owner IN (?, ?)",
+                       (now, sha256, owner, SHARED_OWNER))
+            db.execute("UPDATE tracks SET last_used = ? WHERE sha256 = ?", (now, sha256))
+
+    def remove(self, owner, sha256):
+        """Bỏ bài khỏi danh sách của owner; xóa file nếu không còn ai giữ"""
+        with self._lock, self._connect() as db:
+            db.execute("DELETE FROM library WHERE owner = ? AND sha256 = ?", (owner, sha256))
+            orphans = self._delete_orphans(db)
+        self._remove_files(orphans)
+
+    def owner_bytes(self, owner):
+        with self._connect() as db:
+            return self._owner_bytes(db, owner)
+
+    # ---------- hạn mức ----------
+    @staticmethod
+    def _owner_bytes(db, owner):
+        row = db.execute(
+            "SELECT COALESCE(SUM(t.size), 0) FROM library l JOIN tracks t ON t.sha256 = l.sha256 WHERE l.owner = ?",
+            (owner,),
+        ).fetchone()
+        return row[0]
+
+    def _evict_owner(self, db, owner, keep):
+        """Bỏ các bài lâu không dùng nhất của owner cho đến khi nằm trong hạn mức"""
+        total = self._owner_bytes(db, owner)
+        rows = db.execute(
+            "SELECT l.sha256, t.size FROM library l JOIN tracks t ON t.sha256 = l.sha256 "
+            "WHERE l.owner = ? AND l.sha256 != ? ORDER BY l.last_used",
+            (owner, keep),
+        ).fetchall()
+        for sha256, size in rows:
+            if total <= self.user_quota:
+                break
+            db.execute("DELETE FROM library WHERE owner = ? AND sha256 = ?", (owner, sha256))
+            total -= size
+
+    def _evict_global(self, db, keep):
+        """Bỏ hẳn các bài lâu không dùng nhất (của mọi người) khi kho vượt hạn mức chung"""
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM tracks").fetchone()[0]
+        rows = db.execute(
+            "SELECT sha256, size FROM tracks WHERE sha256 != ? ORDER BY last_used", (keep,)
+        ).fetchall()
+        for sha256, size in rows:
+            if total <= self.max_bytes:
+                break
+            db.execute("DELETE FROM library WHERE sha256 = ?", (sha256,))
+            total -= size
+
+    @staticmethod
+    def _delete_orphans(db):
+        rows = db.execute(
+            "SELECT sha256, file FROM tracks WHERE sha256 NOT IN (SELECT sha256 FROM library)"
+        ).fetchall()
+        db.executemany("DELETE FROM tracks WHERE sha256 = ?", [(sha256,) for sha256, _ in rows])
+        return [file for _, file in rows]
+
+    def _remove_files(self, files):
+        for file in files:
+            try:
+                os.remove(os.path.join(self.store_dir, file))
+            except OSError:
+                pass
+
+    # ---------- chuyển đổi ----------
+    def import_file(self, path, owner, name):
+        """Đưa một file có sẵn (ví dụ nhạc từ phiên bản cũ) vào thư viện; file gốc chỉ bị xóa khi đã thêm xong"""
+        with open(path, "rb") as f:
+            tmp_path, sha256, _ = write_chunked(f, self.work_dir)
+        try:
+            if self.has_track(sha256) and self.add_to_library(owner, sha256, name):
+                os.remove(tmp_path)
+            else:
+                self.add_track(sha256, tmp_path, owner=owner, name=name)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        os.remove(path)
+        return sha256
@@ -0,0 +1,199 @@
+"""Bài dẫn thiền dài (nhiều đoạn): tách câu, tạo giọng từng câu trong luồng nền và phát dần.
+
+Kịch bản được tách thành câu (``split_sentences``); mỗi câu là một cue tạo qua
+hàng đợi giọng nói (``VoiceJobQueue.submit_narration``) nên câu đã tạo trước đó
+(đọc lại bài, câu trùng giữa các bài) lấy thẳng từ cache. Job chỉ giữ tối đa
+``NARRATION_LOOKAHEAD`` câu đang tạo tính từ câu đầu tiên chưa xong: câu đầu có
+sớm nhất, và một bài dài không chiếm hết luồng TTS của các session khác.
+
+Câu xong (theo đúng thứ tự) được chép ra ``static/narration/`` (tên theo hash
+nội dung) và ghi thêm vào manifest JSON của bài trong ``static/narration_jobs/``.
+Player đọc lại manifest mỗi giây và phát những câu đã có, nên bắt đầu nghe được
+ngay sau câu đầu tiên thay vì chờ tạo xong cả bài (không cần rerun Streamlit).
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+
+from voice_assets import STATIC_DIR
+
+NARRATION_DIR = os.path.join(STATIC_DIR, "narration")          # audio từng câu (service worker cache)
+MANIFEST_DIR = os.path.join(STATIC_DIR, "narration_jobs")      # manifest của từng bài (luôn đọc mới)
+
+MAX_SCRIPT_CHARS = 5000
+MAX_SENTENCE_CHARS = 100   # gTTS tự cắt đoạn dài hơn thành nhiều request; cắt trước để mỗi câu một request
+NARRATION_LOOKAHEAD = 3    # số câu tạo trước, tính từ câu đầu tiên chưa xong
+SENTENCE_PAUSE = 0.8       # giây nghỉ sau mỗi câu (cue đã được cắt lặng hai đầu)
+PARAGRAPH_PAUSE = 2.0      # giây nghỉ hết đoạn
+DEFAULT_MAX_BYTES = int(float(os.environ.get("NARRATION_CACHE_MAX_MB", "100")) * 1024 * 1024)
+
+# Bài mẫu theo ngôn ngữ giọng đọc (dòng trống = hết đoạn)
+NARRATION_SCRIPTS = {
+    "vi": {
+        "Thư giãn toàn thân": (
+            "Hãy ngồi hoặc nằm ở tư thế thoải mái nhất. Nhẹ nhàng nhắm mắt lại. "
+            "Để cơ thể được nghỉ ngơi hoàn toàn.\n\n"
+            "Đưa sự chú ý về hơi thở. Không cần thay đổi gì, chỉ cần quan sát. "
+            "Cảm nhận không khí mát đi vào, và hơi ấm đi ra.\n\n"
+            "Bây giờ, hướng sự chú ý lên đỉnh đầu. Thả lỏng vầng trán, đôi mắt và hai bên thái dương. "
+            "Thả lỏng hàm, để môi hơi hé mở.\n\n"
+            "Cảm nhận đôi vai đang nặng dần, buông xuống. Hai cánh tay thả lỏng, "
+            "cảm giác thư giãn lan dần xuống tới từng đầu ngón tay.\n\n"
+            "Ngực và bụng nhẹ nhàng lên xuống theo hơi thở. Lưng được nâng đỡ. "
+            "Hai chân thả lỏng, từ đùi, xuống đầu gối, tới bàn chân.\n\n"
+            "Toàn thân bạn giờ đây nhẹ nhàng và yên tĩnh. Hãy ở lại với cảm giác này thêm một lúc. "
+            "Khi sẵn sàng, hít một hơi thật sâu, cử động nhẹ các ngón tay, và từ từ mở mắt."
+        ),
+        "Lòng biết ơn": (
+            "Hãy ngồi thẳng lưng, thả lỏng đôi vai. Hít vào thật chậm, rồi thở ra thật dài.\n\n"
+            "Nghĩ về một người đã giúp đỡ bạn. Hình dung gương mặt của họ. "
+            "Thầm gửi tới họ lời cảm ơn chân thành.\n\n"
+            "Nghĩ về một điều nhỏ bé hôm nay khiến bạn mỉm cười. Một tách trà ấm, một cơn gió mát, một lời hỏi thăm. "
+            "Để niềm vui đó lan tỏa trong lồng ngực.\n\n"
+            "Cảm ơn cơ thể đã đưa bạn đi qua một ngày. Cảm ơn hơi thở vẫn luôn ở đây. "
+            "Mang lòng biết ơn này theo bạn vào phần còn lại của ngày."
+        ),
+    },
+    "en": {
+        "Body scan": (
+            "Find a comfortable position, sitting or lying down. Gently close your eyes. "
+            "Let your body rest completely.\n\n"
+            "Bring your attention to your breath. There is nothing to change, simply notice. "
+            "Feel the cool air coming in, and the warm air going out.\n\n"
+            "Now bring your attention to the top of your head. Soften your forehead, your eyes, and your temples. "
+            "Relax your jaw.\n\n"
+            "Feel your shoulders grow heavy and let them drop. Let the relaxation flow down your arms, "
+            "all the way to your fingertips.\n\n"
+            "Your chest and belly rise and fall with each breath. Your legs relax, from your thighs, "
+            "to your knees, to your feet.\n\n"
+            "Your whole body is light and still. Stay with this feeling for a moment. "
+            "When you are ready, take a deep breath, move your fingers gently, and slowly open your eyes."
+        ),
+    },
+}
+
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+")
+_CLAUSE_END = re.compile(r"(?<=[,;:])\s+")
+
+
+def _pack(parts, sep, max_chars):
+    """Gộp các mảnh liền nhau thành đoạn không quá ``max_chars`` ký tự"""
+    chunks = []
+    for part in parts:
+        if chunks and len(chunks[-1]) + len(sep) + len(part) <= max_chars:
+            chunks[-1] += sep + part
+        else:
+            chunks.append(part)
+    return chunks
+
+
+def _split_long(sentence, max_chars):
+    """Câu quá dài: cắt ở dấu phẩy / chấm phẩy, còn dài nữa thì cắt giữa các từ"""
+    if len(sentence) <= max_chars:
+        return [sentence]
+    pieces = []
+    for clause in _pack(_CLAUSE_END.split(sentence), " ", max_chars):
+        pieces.extend(_pack(clause.split(), " ", max_chars) if len(clause) > max_chars else [clause])
+    return pieces
+
+
+def split_sentences(script, max_chars=MAX_SENTENCE_CHARS):
+    """Tách kịch bản thành list {"text", "pause"}; dòng trống ngăn các đoạn (nghỉ dài hơn hết đoạn)"""
+    sentences = []
+    for paragraph in re.split(r"\n\s*\n", script[:MAX_SCRIPT_CHARS]):
+        paragraph = " ".join(paragraph.split())
+        texts = [
+            piece
+            for sentence in _SENTENCE_END.split(paragraph)
+            for piece in _split_long(sentence, max_chars)
+            if re.search(r"\w", piece)
+        ]
+        for i, text in enumerate(texts):
+            sentences.append({"text": text, "pause": PARAGRAPH_PAUSE if i == len(texts) - 1 else SENTENCE_PAUSE})
+    return sentences
+
+
+def narration_key(engine, lang, sentences):
+    """Khóa của bài: cùng engine, ngôn ngữ và các câu thì dùng chung job / manifest"""
+    raw = json.dumps([engine, lang, sentences], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+class NarrationJob:
+    """Giọng đọc một bài: các câu được tạo theo thứ tự, ``chunks`` là các câu đã xong"""
+
+    def __init__(self, key, lang, sentences):
+        self.key = key
+        self.lang = lang
+        self.sentences = sentences
+        self.cue_jobs = []   # CueJob của các câu đã đưa vào hàng đợi (theo thứ tự)
+        self.chunks = []     # {"file", "pause"} hoặc None (câu lỗi, player bỏ qua), theo thứ tự câu
+        self.errors = []
+        self.status = "running"  # running -> done / error
+        self.started = time.time()
+        self.first_chunk_at = None
+        self.finished_at = None
+        self.manifest_file = f"{key}.json"
+        self.manifest_path = os.path.join(MANIFEST_DIR, self.manifest_file)
+
+    @property
+    def finished(self):
+        return self.status in ("done", "error")
+
+    @property
+    def progress(self):
+        return len(self.chunks) / len(self.sentences)
+
+    def manifest(self):
+        return {"total": len(self.sentences), "chunks": self.chunks, "done": self.finished}
+
+
+def publish_chunk(path, sha256, out_dir=NARRATION_DIR):
+    """Chép audio một câu ra ``out_dir`` (tên theo hash nội dung, đã có thì chỉ đánh dấu vừa dùng); trả về tên file"""
+    filename = f"{sha256[:16]}{os.path.splitext(path)[1]}"
+    dest = os.path.join(out_dir, filename)
+    try:
+        os.utime(dest)
+    except OSError:
+        os.makedirs(out_dir, exist_ok=True)
+        tmp_path = f"{dest}.{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.copyfile(path, tmp_path)
+        os.replace(tmp_path, dest)
+    return filename
+
+
+def write_manifest(job):
+    """Ghi manifest của job (nguyên tử: player không bao giờ đọc phải file ghi dở)"""
+    os.makedirs(os.path.dirname(job.manifest_path), exist_ok=True)
+    tmp_path = f"{job.manifest_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(job.manifest(), f)
+    os.replace(tmp_path, job.manifest_path)
+
+
+def prune_narration(max_bytes=DEFAULT_MAX_BYTES, keep=()):
+    """Xóa audio câu và manifest lâu không dùng nhất khi ``static/narration*`` vượt hạn mức"""
+    files = []
+    for out_dir in (NARRATION_DIR, MANIFEST_DIR):
+        if not os.path.isdir(out_dir):
+            continue
+        for name in os.listdir(out_dir):
+            if name.endswith(".tmp"):
+                continue
+            stat = os.stat(os.path.join(out_dir, name))
+            files.append((stat.st_mtime, stat.st_size, out_dir, name))
+    total = sum(size for _, size, _, _ in files)
+    for _, size, out_dir, name in sorted(files):
+        if total <= max_bytes:
+            break
+        if name in keep:
+            continue
+        try:
+            os.remove(os.path.join(out_dir, name))
+        except OSError:
+            pass
+        total -= size
@@ -0,0 +1,802 @@
+// Player thiền: custom component của Streamlit (giao thức postMessage, không cần build).
+// Iframe giữ nguyên giữa các lần rerun; Python chỉ gửi timeline + cài đặt dạng JSON.
+// Đổi âm lượng áp dụng ngay, đổi thời gian áp dụng từ chu kỳ kế tiếp của phiên đang chạy.
+// Sự kiện (hết một chu kỳ, hoàn thành, dừng) được gửi ngược về Python.
+
+// ==================== GIAO TIẾP VỚI STREAMLIT ====================
+const FRAME_HEIGHT = 600;
+
+function sendMessage(type, data) {
+    window.parent.postMessage(Object.assign({ isStreamlitMessage: true, type: type }, data), '*');
+}
+
+let eventSeq = 0;
+let sessionId = null;   // id của phiên đang chạy, gửi kèm mọi sự kiện để Python lưu lịch sử
+let sessionDay = null;  // ngày (giờ địa phương) lúc bắt đầu phiên, dùng để tính chuỗi ngày
+
+function sendEvent(type, data) {
+    eventSeq++;
+    sendMessage('streamlit:setComponentValue', {
+        value: Object.assign({ type: type, id: Date.now() + '-' + eventSeq, session: sessionId, day: sessionDay }, data),
+        dataType: 'json'
+    });
+}
+
+function localDay() {
+    const d = new Date();
+    return d.getFullYear() + '-' + String(d.getMonth() + 1).padStart(2, '0') + '-' + String(d.getDate()).padStart(2, '0');
+}
+
+// ==================== TRẠNG THÁI ====================
+let timeline = null;
+let voiceSprite = null;
+let bgMusicUrl = null;
+let bgMusic = null;
+let settings = { totalCycles: 0, twoPhaseMode: false, voiceVolume: 0.8, musicVolume: 0.3 };
+
+let currentPhase = 'idle';
+let currentCycle = 0;
+let currentBreathingPhase = 1; // 1 hoặc 2
+let sessionStartedAt = 0;
+
+// Lịch trình được lập trước theo đồng hồ của AudioContext (không dùng setInterval
+// để đếm giờ nên không bị trôi và không bị trình duyệt làm chậm khi ở tab nền)
+const LOOKAHEAD = 2.0;   // giây: lên lịch cue trước bấy nhiêu
+const TICK_MS = 50;
+let sessionEvents = null;
+let sessionTimeline = null;  // timeline của phiên đang chạy
+let pendingTimeline = null;  // timeline mới, áp dụng từ chu kỳ kế tiếp
+let upcoming = [];
+let activeSources = [];
+let currentEvent = null;
+let startTime = 0;
+let tickTimer = null;
+let resetTimer = null;
+
+const BREATHING_STATES = ['inhale', 'hold', 'exhale'];
+
+function isInfiniteMode() {
+    return settings.totalCycles === 0;
+}
+
+// ==================== AUDIO ENGINE ====================
+let audioCtx = null;
+let voiceGain = null;
+let musicGain = null;
+let spritePromise = null;
+let spriteBuffer = null;
+let cuePromises = {};     // cue ngoài sprite -> Promise<AudioBuffer> (tải lần đầu cần tới)
+let musicWanted = false;  // đang trong đoạn có nhạc nền (từ "ready" tới "complete")
+const LATE_CUE = 0.5;     // giây: cue tải riêng về trễ hơn mức này thì bỏ
+
+function getAudioContext() {
+    if (!audioCtx) {
+        const Ctx = window.AudioContext || window.webkitAudioContext;
+        audioCtx = new Ctx();
+        voiceGain = audioCtx.createGain();
+        voiceGain.gain.value = settings.voiceVolume;
+        voiceGain.connect(audioCtx.destination);
+        connectMusic();
+    }
+    return audioCtx;
+}
+
+function setBgMusic(url) {
+    if (url === bgMusicUrl) return;
+    bgMusicUrl = url;
+    if (bgMusic) {
+        bgMusic.pause();
+        bgMusic.removeAttribute('src');
+    }
+    bgMusic = null;
+    musicGain = null;
+    if (url) {
+        // Nhạc phát dạng stream qua URL (Range request), không nhúng base64
+        bgMusic = new Audio();
+        // Âm lượng 0 -> chưa tải gì, chỉ tải khi người dùng kéo âm lượng lên
+        bgMusic.preload = settings.musicVolume > 0 ? 'metadata' : 'none';
+        bgMusic.src = url;
+        bgMusic.loop = true;
+        bgMusic.volume = settings.musicVolume;
+        if (audioCtx) connectMusic();
+    }
+}
+
+function connectMusic() {
+    // Nhạc nền đi qua gain riêng: đổi âm lượng không phải phát lại
+    if (!bgMusic) return;
+    try {
+        musicGain = audioCtx.createGain();
+        musicGain.gain.value = settings.musicVolume;
+        audioCtx.createMediaElementSource(bgMusic).connect(musicGain);
+        musicGain.connect(audioCtx.destination);
+        bgMusic.volume = 1;
+    } catch (e) {
+        console.log('Music routed without Web Audio:', e);
+        musicGain = null;
+    }
+}
+
+function setSprite(sprite) {
+    const oldUrl = voiceSprite && voiceSprite.url;
+    const oldBase = voiceSprite && voiceSprite.base;
+    voiceSprite = sprite;
+    if (!sprite || sprite.base !== oldBase) cuePromises = {};
+    if (sprite && sprite.url !== oldUrl) {
+        spritePromise = null;
+        spriteBuffer = null;
+        loadSprite().then(buffer => { spriteBuffer = buffer; }, () => {});
+    }
+}
+
+function loadSprite() {
+    if (!spritePromise) {
+        spritePromise = fetch(voiceSprite.url)
+            .then(r => r.arrayBuffer())
+            .then(data => new Promise((resolve, reject) => {
+                // Dạng callback để chạy được cả trên Safari cũ
+                getAudioContext().decodeAudioData(data, resolve, reject);
+            }));
+        spritePromise.catch(e => console.log('Sprite load failed:', e));
+    }
+    return spritePromise;
+}
+
+function loadCue(type) {
+    // Cue không có trong sprite (cài đặt đổi giữa phiên): tải file riêng, một lần
+    if (!cuePromises[type]) {
+        cuePromises[type] = fetch(voiceSprite.base + type + voiceSprite.ext)
+            .then(r => r.arrayBuffer())
+            .then(data => new Promise((resolve, reject) => {
+                getAudioContext().decodeAudioData(data, resolve, reject);
+            }));
+        cuePromises[type].catch(e => {
+            console.log('Cue load failed:', type, e);
+            delete cuePromises[type];
+        });
+    }
+    return cuePromises[type];
+}
+
+function prefetchCues(tl) {
+    // Tải trước các cue mà timeline mới cần nhưng sprite hiện tại không có
+    if (!voiceSprite || !voiceSprite.base) return;
+    for (const cue of timelineCues(tl)) {
+        if (!voiceSprite.cues[cue]) loadCue(cue).catch(() => {});
+    }
+}
+
+function playBuffer(buffer, when, offset, duration) {
+    const source = audioCtx.createBufferSource();
+    source.buffer = buffer;
+    source.connect(voiceGain);
+    const entry = { source: source, when: Math.max(when, audioCtx.currentTime) };
+    source.onended = () => {
+        activeSources = activeSources.filter(s => s !== entry);
+    };
+    source.start(entry.when, offset, duration);
+    activeSources.push(entry);
+}
+
+function scheduleCue(type, when) {
+    if (!voiceSprite) return;
+    const cue = voiceSprite.cues[type];
+    if (cue) {
+        if (spriteBuffer) playBuffer(spriteBuffer, when, cue.offset, cue.duration);
+        return;
+    }
+    if (!voiceSprite.base) return;
+    const pending = { source: null, when: when };
+    activeSources.push(pending);
+    loadCue(type).then(buffer => {
+        if (!activeSources.includes(pending)) return;  // đã bị hủy trong lúc tải
+        activeSources = activeSources.filter(s => s !== pending);
+        if (audioCtx.currentTime - when > LATE_CUE) return;
+        playBuffer(buffer, when, 0, buffer.duration);
+    }, () => {
+        activeSources = activeSources.filter(s => s !== pending);
+    });
+}
+
+function cancelScheduledCues(fromTime) {
+    activeSources = activeSources.filter(entry => {
+        if (fromTime !== undefined && entry.when < fromTime) return true;
+        if (entry.source) {
+            try { entry.source.stop(); } catch (e) {}
+        }
+        return false;
+    });
+}
+
+function setVolume(gainNode, value) {
+    if (gainNode && audioCtx) {
+        gainNode.gain.cancelScheduledValues(audioCtx.currentTime);
+        gainNode.gain.setTargetAtTime(value, audioCtx.currentTime, 0.05);
+    }
+}
+
+function playBgMusic() {
+    musicWanted = true;
+    if (bgMusic && settings.musicVolume > 0) {
+        if (musicGain) {
+            musicGain.gain.cancelScheduledValues(audioCtx.currentTime);
+            musicGain.gain.setValueAtTime(settings.musicVolume, audioCtx.currentTime);
+        }
+        bgMusic.currentTime = 0;
+        bgMusic.play().catch(e => console.log('BG music play prevented:', e));
+    }
+}
+
+function fadeOutBgMusic(seconds) {
+    musicWanted = false;
+    if (!bgMusic || bgMusic.paused) return;
+    if (musicGain) {
+        const now = audioCtx.currentTime;
+        musicGain.gain.cancelScheduledValues(now);
+        musicGain.gain.setValueAtTime(musicGain.gain.value, now);
+        musicGain.gain.linearRampToValueAtTime(0, now + seconds);
+    } else {
+        let fadeOutInterval = setInterval(() => {
+            if (bgMusic.volume > 0.05) {
+                bgMusic.volume -= 0.05;
+            } else {
+                clearInterval(fadeOutInterval);
+            }
+        }, 200);
+    }
+    setTimeout(stopBgMusic, seconds * 1000);
+}
+
+function stopBgMusic() {
+    musicWanted = false;
+    if (bgMusic) {
+        bgMusic.pause();
+        bgMusic.currentTime = 0;
+    }
+}
+
+function restoreMusicVolume() {
+    if (musicGain) {
+        musicGain.gain.cancelScheduledValues(audioCtx.currentTime);
+        musicGain.gain.setValueAtTime(settings.musicVolume, audioCtx.currentTime);
+    } else if (bgMusic) {
+        bgMusic.volume = settings.musicVolume;
+    }
+}
+
+// ==================== CACHE OFFLINE (SERVICE WORKER) ====================
+// sw.js nằm cùng thư mục nên điều khiển được iframe player: sprite, cue lẻ và nhạc
+// (URL theo hash nội dung) được giữ trong Cache Storage, lần sau không cần mạng.
+// Trình duyệt không hỗ trợ / iframe bị chặn thì player vẫn chạy như cũ.
+let swReady = null;
+const precached = new Set();
+
+function registerServiceWorker() {
+    if (!('serviceWorker' in navigator)) return;
+    try {
+        swReady = navigator.serviceWorker.register('sw.js').then(() => navigator.serviceWorker.ready);
+        swReady.catch(e => {
+            console.log('Service worker unavailable:', e);
+            swReady = null;
+        });
+    } catch (e) {
+        console.log('Service worker unavailable:', e);
+    }
+}
+
+function precache(urls) {
+    // Nhờ service worker tải (một lần) cả file; resolve khi đã gửi yêu cầu
+    const fresh = urls.filter(url => url && !precached.has(url));
+    if (!swReady || !fresh.length) return Promise.resolve();
+    fresh.forEach(url => precached.add(url));
+    return swReady.then(reg => {
+        if (reg.active) reg.active.postMessage({ type: 'precache', urls: fresh });
+    }, () => {});
+}
+
+// ==================== BÀI DẪN THIỀN ====================
+// Python tạo giọng từng câu trong luồng nền và ghi dần các câu đã xong vào một
+// manifest JSON trong static/; player đọc lại manifest mỗi giây (không cần rerun
+// Streamlit) và phát nối tiếp các câu đã có, nên bắt đầu được ngay sau câu đầu
+// tiên. Phát nhanh hơn tốc độ tạo thì chờ câu kế tiếp rồi đọc tiếp.
+const NARRATION_POLL_MS = 1000;
+const NARRATION_BUFFER = 6.0;  // giây: lên lịch các câu trước bấy nhiêu
+const NARRATION_PREFETCH = 2;  // số câu tải trước
+let narration = null;          // {manifest, base, total} từ Python
+let narrationChunks = [];      // từ manifest: {file, pause} hoặc null (câu lỗi -> bỏ qua)
+let narrationDone = false;     // đã tạo xong cả bài
+let narrationPollTimer = null;
+let chunkPromises = {};        // vị trí câu -> Promise<AudioBuffer>
+let narrationIndex = 0;        // câu kế tiếp cần lên lịch
+let narrationNext = 0;         // thời điểm (đồng hồ AudioContext) phát câu kế tiếp
+let narrationStarts = [];      // thời điểm bắt đầu của các câu đã lên lịch
+let narrationLoading = false;
+let narrationRun = 0;          // tăng mỗi lần bắt đầu: câu tải xong của lần phát cũ thì bỏ
+
+function setNarration(value) {
+    if ((value && value.manifest) === (narration && narration.manifest)) return;
+    narration = value;
+    narrationChunks = [];
+    narrationDone = false;
+    chunkPromises = {};
+    pollNarration();
+}
+
+function pollNarration() {
+    if (narrationPollTimer) clearTimeout(narrationPollTimer);
+    narrationPollTimer = null;
+    if (!narration) return;
+    const current = narration;
+    fetch(current.manifest, { cache: 'no-store' })
+        .then(r => (r.ok ? r.json() : null))
+        .then(data => {
+            if (narration !== current || !data) return;
+            narrationChunks = data.chunks;
+            narrationDone = data.done;
+            if (currentPhase === 'idle') showNarrationStatus();
+        })
+        .catch(e => console.log('Narration manifest load failed:', e))
+        .then(() => {
+            if (narration === current && !narrationDone) {
+                narrationPollTimer = setTimeout(pollNarration, NARRATION_POLL_MS);
+            }
+        });
+}
+
+function showNarrationStatus() {
+    const ready = narrationChunks.filter(chunk => chunk).length;
+    const text = narrationDone
+        ? '📜 Bài dẫn đã sẵn sàng (' + narration.total + ' câu)'
+        : '⏳ Đang tạo giọng đọc: ' + narrationChunks.length + '/' + narration.total + ' câu';
+    updateDisplay('', '<div class="cycle-info">' + text + '</div>', '');
+    if (!resetTimer) document.getElementById('startBtn').disabled = !ready;
+}
+
+function loadChunk(index) {
+    if (!chunkPromises[index]) {
+        chunkPromises[index] = fetch(narration.base + narrationChunks[index].file)
+            .then(r => r.arrayBuffer())
+            .then(data => new Promise((resolve, reject) => {
+                getAudioContext().decodeAudioData(data, resolve, reject);
+            }));
+        chunkPromises[index].catch(e => console.log('Narration chunk load failed:', index, e));
+    }
+    return chunkPromises[index];
+}
+
+function startNarration() {
+    document.getElementById('startBtn').disabled = true;
+    if (resetTimer) clearTimeout(resetTimer);
+    resetTimer = null;
+    const ctx = getAudioContext();
+    ctx.resume();
+    currentPhase = 'narration';
+    narrationIndex = 0;
+    narrationNext = ctx.currentTime + 0.1;
+    narrationStarts = [];
+    narrationLoading = false;
+    narrationRun++;
+    if (bgMusic && settings.musicVolume > 0) {
+        precache([bgMusicUrl]).then(playBgMusic);
+    }
+    narrationTick();
+}
+
+function narrationTick() {
+    if (currentPhase !== 'narration') return;
+    const now = audioCtx.currentTime;
+    // Bỏ qua câu lỗi, lên lịch câu kế tiếp khi chỗ đã lên lịch sắp phát hết
+    while (narrationIndex < narrationChunks.length && !narrationChunks[narrationIndex]) narrationIndex++;
+    if (!narrationLoading && narrationIndex < narrationChunks.length && narrationNext - now < NARRATION_BUFFER) {
+        const index = narrationIndex;
+        const run = narrationRun;
+        narrationLoading = true;
+        loadChunk(index).then(buffer => {
+            if (run !== narrationRun) return;
+            narrationLoading = false;
+            if (currentPhase !== 'narration') return;
+            const when = Math.max(narrationNext, audioCtx.currentTime + 0.05);
+            playBuffer(buffer, when, 0, buffer.duration);
+            narrationStarts.push(when);
+            narrationNext = when + buffer.duration + narrationChunks[index].pause;
+            narrationIndex = index + 1;
+        }, () => {
+            if (run !== narrationRun) return;
+            narrationLoading = false;
+            narrationIndex = index + 1;
+        });
+    }
+    for (let i = narrationIndex; i < Math.min(narrationChunks.length, narrationIndex + NARRATION_PREFETCH); i++) {
+        if (narrationChunks[i]) loadChunk(i).catch(() => {});
+    }
+
+    const played = narrationStarts.filter(t => t <= now).length;
+    const waiting = !narrationLoading && narrationIndex >= narrationChunks.length && now >= narrationNext;
+    if (waiting && narrationDone) {
+        completeNarration();
+        return;
+    }
+    updateDisplay(
+        '<div class="big-status prepare">' + (waiting ? '⏳ Đang tạo câu tiếp theo...' : '📜 Bài Dẫn Thiền') + '</div>',
+        '<div class="cycle-info">Câu ' + played + '/' + narration.total + '</div>',
+        '<progress value="' + played + '" max="' + narration.total + '"></progress>'
+    );
+    tickTimer = setTimeout(narrationTick, 200);
+}
+
+function completeNarration() {
+    fadeOutBgMusic(Math.min(3, settings.musicVolume * 4));
+    currentPhase = 'complete';
+    updateDisplay(
+        '<div class="big-status complete">Hoàn Thành! 🙏</div>',
+        '<div class="cycle-info">Bạn đã nghe hết bài dẫn thiền</div>',
+        '<progress value="100" max="100"></progress>'
+    );
+    resetTimer = setTimeout(() => {
+        resetTimer = null;
+        endSession();
+        showNarrationStatus();
+    }, 5000);
+}
+
+// ==================== LỊCH TRÌNH PHIÊN THIỀN ====================
+// Mở rộng timeline thành các sự kiện (t tính bằng giây từ lúc bấm Bắt Đầu),
+// cùng quy tắc với timeline.iter_events. Chế độ vô hạn sinh tới đâu dùng tới đó.
+// resume = {cycle, t}: bỏ phần chuẩn bị, tiếp tục sau chu kỳ `cycle` tại thời điểm t
+// (dùng khi đổi cài đặt giữa phiên).
+function* buildSessionEvents(tl, resume) {
+    let t;
+    if (resume) {
+        t = resume.t;
+    } else {
+        const P = tl.prepare;
+        yield { t: 0, cue: 'prepare', state: 'prepare', until: P };
+        for (const n of tl.countdown) {
+            yield { t: P - n, cue: 'countdown_' + n };
+        }
+        yield { t: P, cue: 'ready', state: 'ready', music: 'start' };
+        t = P + tl.ready_gap;
+    }
+
+    let cycle = 0;
+    for (const seg of tl.segments) {
+        if (seg.transition && (!resume || cycle >= resume.cycle)) {
+            yield { t: t, cue: 'phase2', state: 'phase2', cycle: cycle, phase: seg.phase };
+            t += seg.transition;
+        }
+        for (let n = 0; seg.repeat === null || n < seg.repeat; n++) {
+            cycle++;
+            if (resume && cycle <= resume.cycle) {
+                // Chu kỳ đã thở xong; với giai đoạn vô hạn thì nhảy thẳng tới chu kỳ kế tiếp
+                if (seg.repeat === null) cycle = resume.cycle;
+                continue;
+            }
+            for (const [state, seconds] of seg.pattern) {
+                yield { t: t, cue: state, state: state, until: t + seconds, cycle: cycle, phase: seg.phase };
+                t += seconds;
+            }
+        }
+    }
+    if (resume && cycle < resume.cycle) cycle = resume.cycle;
+    yield { t: t, cue: 'complete', state: 'complete', cycle: cycle, music: 'fade' };
+    yield { t: t + tl.complete_hold, state: 'idle' };
+}
+
+function timelineCues(tl) {
+    // Các cue timeline có thể phát, cùng quy tắc với timeline.timeline_cues
+    const cues = new Set(['prepare', 'ready', 'complete']);
+    for (const n of tl.countdown) cues.add('countdown_' + n);
+    for (const seg of tl.segments) {
+        if (seg.transition) cues.add('phase2');
+        for (const [state] of seg.pattern) cues.add(state);
+    }
+    return cues;
+}
+
+function isCycleBoundary(ev) {
+    return ev.state === 'inhale' || ev.state === 'phase2' || ev.state === 'complete';
+}
+
+function cyclesBefore(ev) {
+    return ev.state === 'inhale' ? ev.cycle - 1 : ev.cycle;
+}
+
+function switchTimeline(boundary) {
+    // Thay phần lịch trình từ `boundary` trở đi bằng timeline mới
+    sessionTimeline = pendingTimeline;
+    pendingTimeline = null;
+    sessionEvents = buildSessionEvents(sessionTimeline, { cycle: cyclesBefore(boundary), t: boundary.t });
+}
+
+function applyPendingTimeline() {
+    // Sự kiện đầu chu kỳ đã được lấy ra (nhưng chưa tới giờ) thì thay ngay từ đó
+    const index = upcoming.findIndex(isCycleBoundary);
+    if (index < 0) return;
+    const boundary = upcoming[index];
+    upcoming = upcoming.slice(0, index);
+    cancelScheduledCues(startTime + boundary.t);
+    switchTimeline(boundary);
+}
+
+function pullEvents(horizon) {
+    while (sessionEvents) {
+        const last = upcoming[upcoming.length - 1];
+        if (last && last.t > horizon) break;
+        const next = sessionEvents.next();
+        if (next.done) {
+            sessionEvents = null;
+            break;
+        }
+        if (pendingTimeline && isCycleBoundary(next.value)) {
+            switchTimeline(next.value);
+            continue;
+        }
+        upcoming.push(next.value);
+        if (next.value.cue) scheduleCue(next.value.cue, startTime + next.value.t);
+    }
+}
+
+function tick() {
+    if (currentPhase === 'idle') return;
+    const now = audioCtx.currentTime - startTime;
+    pullEvents(now + LOOKAHEAD);
+    while (upcoming.length && upcoming[0].t <= now) {
+        applyEvent(upcoming.shift());
+    }
+    updateTimer(now);
+    if (currentPhase !== 'idle') {
+        tickTimer = setTimeout(tick, TICK_MS);
+    }
+}
+
+function updateTimer(now) {
+    if (!currentEvent || currentEvent.until === undefined) return;
+    const remaining = Math.max(0, Math.ceil(currentEvent.until - now - 1e-6));
+    const timerSpan = document.querySelector('#status-display .countdown-timer');
+    if (timerSpan && timerSpan.textContent !== String(remaining)) {
+        timerSpan.textContent = remaining;
+    }
+}
+
+// ==================== HIỂN THỊ ====================
+function updateDisplay(status, cycle, progress) {
+    document.getElementById('status-display').innerHTML = status;
+    document.getElementById('cycle-display').innerHTML = cycle || '';
+    document.getElementById('progress-display').innerHTML = progress || '';
+}
+
+function cycleInfo(cycle, phase) {
+    const phaseBadge = settings.twoPhaseMode ? '<span class="phase-badge">Giai đoạn ' + phase + '</span>' : '';
+    if (isInfiniteMode()) {
+        return '<div class="cycle-info">Chu kỳ: ' + cycle + ' ♾️ ' + phaseBadge + '</div>';
+    }
+    return '<div class="cycle-info">Chu kỳ: ' + cycle + '/' + settings.totalCycles + ' ' + phaseBadge + '</div>';
+}
+
+function progressInfo(cycle) {
+    if (isInfiniteMode()) {
+        return '<div style="text-align:center; font-size:40px;">♾️</div>';
+    }
+    return '<progress value="' + cycle + '" max="' + settings.totalCycles + '"></progress>';
+}
+
+function applyEvent(ev) {
+    if (ev.music === 'start') playBgMusic();
+    if (ev.music === 'fade') fadeOutBgMusic(Math.min(3, settings.musicVolume * 4));
+    if (!ev.state) return;
+
+    // Sang chu kỳ mới -> báo chu kỳ vừa thở xong (khi hoàn thành thì sự kiện 'complete' báo thay,
+    // sang giai đoạn 2 thì sự kiện 'phase' báo kèm số chu kỳ)
+    if (ev.state === 'phase2') {
+        sendEvent('phase', { cycles: currentCycle, phase: ev.phase });
+    } else if (isCycleBoundary(ev) && ev.state !== 'complete' && BREATHING_STATES.includes(currentPhase)) {
+        sendEvent('cycle', { cycle: currentCycle, phase: currentBreathingPhase });
+    }
+
+    currentEvent = ev;
+    currentPhase = ev.state;
+    if (ev.cycle !== undefined) currentCycle = ev.cycle;
+    if (ev.phase !== undefined) currentBreathingPhase = ev.phase;
+
+    switch (ev.state) {
+        case 'prepare':
+            updateDisplay(
+                '<div class="big-status prepare">Chuẩn Bị Tinh Thần 🧘<div class="countdown-timer">' + ev.until + '</div></div>',
+                '<div class="cycle-info">Hãy ngồi thoải mái và thư giãn...</div>',
+                ''
+            );
+            break;
+        case 'ready':
+            updateDisplay(
+                '<div class="big-status prepare">Chuẩn Bị Bắt Đầu... 🌟</div>',
+                '<div class="cycle-info">Đang khởi động nhạc nền...</div>',
+                ''
+            );
+            break;
+        case 'phase2':
+            updateDisplay(
+                '<div class="big-status phase2-transition">🌊 Chuyển Sang Giai Đoạn 2 🌊</div>',
+                '<div class="cycle-info">Thay đổi nhịp thở...</div>',
+                ''
+            );
+            break;
+        case 'inhale':
+            updateDisplay(
+                '<div class="big-status inhale">HÍT VÀO 🌬️<div class="countdown-timer">' + (ev.until - ev.t) + '</div></div>',
+                cycleInfo(ev.cycle, ev.phase),
+                progressInfo(ev.cycle)
+            );
+            break;
+        case 'hold':
+            updateDisplay(
+                '<div class="big-status hold">GIỮ HƠI ⏸️<div class="countdown-timer">' + (ev.until - ev.t) + '</div></div>',
+                cycleInfo(ev.cycle, ev.phase),
+                progressInfo(ev.cycle)
+            );
+            break;
+        case 'exhale':
+            updateDisplay(
+                '<div class="big-status exhale">THỞ RA 💨<div class="countdown-timer">' + (ev.until - ev.t) + '</div></div>',
+                cycleInfo(ev.cycle, ev.phase),
+                progressInfo(ev.cycle)
+            );
+            break;
+        case 'complete':
+            updateDisplay(
+                '<div class="big-status complete">Hoàn Thành! 🙏</div>',
+                '<div class="cycle-info">Bạn đã hoàn thành ' + ev.cycle + ' chu kỳ thiền</div>',
+                '<progress value="100" max="100"></progress>'
+            );
+            sendEvent('complete', { cycles: ev.cycle, duration: ev.t });
+            break;
+        case 'idle':
+            endSession();
+            updateDisplay('', '', '');
+            document.getElementById('startBtn').disabled = false;
+            break;
+    }
+}
+
+// ==================== ĐIỀU KHIỂN ====================
+function startMeditation() {
+    if (narration) return startNarration();
+    if (!timeline) return;
+    console.log('Starting meditation preparation...');
+    document.getElementById('startBtn').disabled = true;
+    if (resetTimer) clearTimeout(resetTimer);
+    resetTimer = null;
+
+    // AudioContext chỉ được phát sau thao tác của người dùng
+    const ctx = getAudioContext();
+    ctx.resume();
+
+    currentPhase = 'prepare';
+    currentCycle = 0;
+    currentBreathingPhase = 1;
+    sessionStartedAt = Date.now();
+    sessionId = sessionStartedAt.toString(36) + Math.random().toString(36).slice(2, 10);
+    sessionDay = localDay();
+    sendEvent('start', {});
+
+    // Bắt đầu tải nhạc trong lúc chuẩn bị để phát ngay khi hết đếm ngược
+    // (qua service worker: tải cả file một lần, lần sau phát thẳng từ cache)
+    if (bgMusic && settings.musicVolume > 0) {
+        const music = bgMusic;
+        precache([bgMusicUrl]).then(() => {
+            if (music !== bgMusic) return;
+            music.preload = 'auto';
+            music.load();
+        });
+    }
+
+    const begin = () => {
+        if (currentPhase === 'idle') return;
+        sessionTimeline = timeline;
+        pendingTimeline = null;
+        sessionEvents = buildSessionEvents(sessionTimeline);
+        upcoming = [];
+        startTime = ctx.currentTime + 0.05;
+        tick();
+    };
+    if (voiceSprite) {
+        loadSprite().then(buffer => { spriteBuffer = buffer; }, () => {}).then(begin);
+    } else {
+        begin();
+    }
+}
+
+function endSession() {
+    if (tickTimer) clearTimeout(tickTimer);
+    tickTimer = null;
+    sessionEvents = null;
+    sessionTimeline = null;
+    pendingTimeline = null;
+    upcoming = [];
+    currentEvent = null;
+    currentPhase = 'idle';
+    currentCycle = 0;
+    currentBreathingPhase = 1;
+    restoreMusicVolume();
+}
+
+function stopMeditation() {
+    if (currentPhase === 'idle') return;
+    const cyclesCompleted = currentCycle;
+    const duration = (Date.now() - sessionStartedAt) / 1000;
+
+    cancelScheduledCues();
+    stopBgMusic();
+    endSession();
+    if (narration) {
+        if (resetTimer) clearTimeout(resetTimer);
+        resetTimer = null;
+        showNarrationStatus();
+        return;
+    }
+    sendEvent('stop', { cycles: cyclesCompleted, duration: Math.round(duration) });
+
+    let stopMessage = '⏸️ Đã dừng';
+    if (cyclesCompleted > 0) {
+        stopMessage += '<br><small style="font-size:16px;">Bạn đã hoàn thành ' + cyclesCompleted + ' chu kỳ</small>';
+    }
+
+    updateDisplay(
+        '<div style="text-align:center; padding:20px; color:#e74c3c; font-size:24px;">' + stopMessage + '</div>',
+        '',
+        ''
+    );
+
+    resetTimer = setTimeout(() => {
+        resetTimer = null;
+        updateDisplay('', '', '');
+        document.getElementById('startBtn').disabled = false;
+    }, 3000);
+}
+
+// ==================== NHẬN CÀI ĐẶT TỪ PYTHON ====================
+let lastTimelineJson = null;
+
+function onRender(args) {
+    const newSettings = args.settings || settings;
+    if (newSettings.voiceVolume !== settings.voiceVolume) setVolume(voiceGain, newSettings.voiceVolume);
+    if (newSettings.musicVolume !== settings.musicVolume && currentPhase !== 'complete') {
+        setVolume(musicGain, newSettings.musicVolume);
+        if (!musicGain && bgMusic) bgMusic.volume = newSettings.musicVolume;
+    }
+    const musicTurnedOn = settings.musicVolume === 0 && newSettings.musicVolume > 0;
+    settings = newSettings;
+    // Nhạc chưa tải vì âm lượng 0 -> tải và phát khi vừa kéo lên giữa phiên
+    if (musicTurnedOn && musicWanted && bgMusic && bgMusic.paused) playBgMusic();
+
+    // Đổi nhạc / giọng giữa phiên thì chờ phiên sau
+    if (currentPhase === 'idle') {
+        setBgMusic(args.music_url || null);
+        setSprite(args.sprite || null);
+        if (voiceSprite) precache([voiceSprite.url]);
+        setNarration(args.narration || null);
+    }
+
+    const timelineJson = JSON.stringify(args.timeline);
+    if (timelineJson !== lastTimelineJson) {
+        lastTimelineJson = timelineJson;
+        timeline = args.timeline;
+        if (currentPhase !== 'idle' && sessionTimeline) {
+            prefetchCues(timeline);
+            pendingTimeline = timeline;
+            applyPendingTimeline();
+        }
+    }
+    if (currentPhase === 'idle' && !resetTimer) {
+        document.getElementById('startBtn').disabled = narration ? !narrationChunks.some(chunk => chunk) : !timeline;
+    }
+}
+
+window.addEventListener('message', event => {
+    if (event.data && event.data.type === 'streamlit:render') {
+        onRender(event.data.args || {});
+    }
+});
+
+registerServiceWorker();
+sendMessage('streamlit:componentReady', { apiVersion: 1 });
+sendMessage('streamlit:setFrameHeight', { height: FRAME_HEIGHT });
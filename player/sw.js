@@ -0,0 +1,108 @@
+// Service worker của player: giữ sprite giọng nói, cue lẻ, câu bài dẫn và nhạc nền trong Cache Storage.
+// Các file này đặt tên theo hash nội dung (nội dung không bao giờ đổi dưới cùng một URL)
+// nên phục vụ thẳng từ cache, không hỏi lại server: phiên thiền lặp lại không tốn mạng.
+// Player gửi {type: 'precache', urls: [...]} để tải trước đúng các file phiên tới cần.
+
+const CACHE_NAME = 'meditation-assets-v1';
+// Thư mục (trong /app/static/) được cache và số file tối đa giữ lại mỗi loại (cũ nhất bị bỏ trước)
+const CACHED_DIRS = { sprites: 8, cues: 40, music: 3, narration: 120 };
+
+function assetKind(url) {
+    const match = new URL(url, self.location.href).pathname.match(/\/app\/static\/([^/]+)\//);
+    return match && CACHED_DIRS[match[1]] ? match[1] : null;
+}
+
+self.addEventListener('install', () => self.skipWaiting());
+self.addEventListener('activate', event => {
+    event.waitUntil(
+        caches.keys()
+            .then(names => Promise.all(
+                names.filter(name => name.startsWith('meditation-assets-') && name !== CACHE_NAME)
+                    .map(name => caches.delete(name))
+            ))
+            .then(() => self.clients.claim())
+    );
+});
+
+// ==================== CACHE ====================
+const inflight = new Map();  // URL -> Promise<Response> đang tải (nhiều request cùng URL chỉ tải một lần)
+
+async function trim(cache, kind) {
+    const keys = (await cache.keys()).filter(request => assetKind(request.url) === kind);
+    for (const request of keys.slice(0, Math.max(0, keys.length - CACHED_DIRS[kind]))) {
+        await cache.delete(request);
+    }
+}
+
+function cachedResponse(url) {
+    // Đăng ký vào inflight ngay (đồng bộ) để request tới sau thấy là đang tải
+    if (!inflight.has(url)) {
+        const loading = (async () => {
+            const cache = await caches.open(CACHE_NAME);
+            const hit = await cache.match(url);
+            if (hit) return hit;
+            const response = await fetch(url, { credentials: 'same-origin' });
+            // Chỉ cache bản đầy đủ (200), không cache lỗi hay một đoạn (206)
+            if (response.status === 200) {
+                await cache.put(url, response.clone());
+                await trim(cache, assetKind(url));
+            }
+            return response;
+        })();
+        inflight.set(url, loading);
+        loading.then(() => inflight.delete(url), () => inflight.delete(url));
+    }
+    return inflight.get(url).then(response => response.clone());
+}
+
+async function rangeResponse(response, rangeHeader) {
+    // <audio> đọc nhạc theo Range -> cắt từ bản đầy đủ trong cache
+    const match = /bytes=(\d*)-(\d*)/.exec(rangeHeader);
+    if (!match || response.status !== 200) return response;
+    const blob = await response.blob();
+    const size = blob.size;
+    let start = match[1] === '' ? size - Number(match[2]) : Number(match[1]);
+    let end = match[1] !== '' && match[2] !== '' ? Number(match[2]) : size - 1;
+    start = Math.max(0, start);
+    end = Math.min(end, size - 1);
+    if (start > end) {
+        return new Response(null, { status: 416, headers: { 'Content-Range': 'bytes */' + size } });
+    }
+    return new Response(blob.slice(start, end + 1), {
+        status: 206,
+        statusText: 'Partial Content',
+        headers: {
+            'Content-Type': response.headers.get('Content-Type') || 'audio/mpeg',
+            'Content-Range': 'bytes ' + start + '-' + end + '/' + size,
+            'Content-Length': String(end - start + 1),
+            'Accept-Ranges': 'bytes',
+        },
+    });
+}
+
+self.addEventListener('fetch', event => {
+    const request = event.request;
+    if (request.method !== 'GET' || !assetKind(request.url)) return;
+    const url = request.url.split('#')[0];
+    const range = request.headers.get('Range');
+    const loading = inflight.has(url);
+    event.respondWith((async () => {
+        try {
+            const hit = await (await caches.open(CACHE_NAME)).match(url);
+            // Đọc một đoạn (metadata) của file chưa cache -> đi thẳng ra mạng, không tải cả file;
+            // cả file chỉ được tải khi player yêu cầu precache (lúc bắt đầu phiên)
+            if (!hit && range && !loading) return fetch(request);
+            const response = hit || await cachedResponse(url);
+            return range ? rangeResponse(response, range) : response;
+        } catch (e) {
+            return fetch(request);
+        }
+    })());
+});
+
+self.addEventListener('message', event => {
+    const data = event.data || {};
+    if (data.type !== 'precache' || !Array.isArray(data.urls)) return;
+    const urls = data.urls.filter(url => url && assetKind(url)).map(url => new URL(url, self.location.href).href);
+    event.waitUntil(Promise.all(urls.map(url => cachedResponse(url).catch(() => null))));
+});
@@ -0,0 +1,301 @@
+"""Lịch sử các phiên thiền: lưu SQLite, ghi theo lô trong luồng nền, thống kê tính sẵn.
+
+- ``record()`` chỉ đưa sự kiện vào hàng đợi rồi trả về ngay; luồng ghi gom
+  nhiều sự kiện thành một transaction (chế độ WAL, nhiều process cùng ghi được).
+- Bảng ``sessions`` giữ một dòng mỗi phiên; ``daily`` và ``totals`` được cập
+  nhật ngay trong transaction ghi, nên chuỗi ngày / tổng số chỉ là đọc một
+  dòng theo khóa chính, không phải quét lịch sử dù có hàng trăm nghìn phiên.
+- Sự kiện có id (do player tạo) nên gửi lặp cũng chỉ được tính một lần.
+"""
+import contextlib
+import datetime
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+BATCH_SIZE = 200
+FLUSH_INTERVAL = 0.5  # giây chờ gom thêm sự kiện trước khi ghi
+
+log = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id TEXT PRIMARY KEY,
+    user TEXT NOT NULL,
+    session TEXT NOT NULL,
+    type TEXT NOT NULL,
+    ts REAL NOT NULL,
+    cycles INTEGER,
+    duration INTEGER,
+    phase INTEGER
+);
+CREATE INDEX IF NOT EXISTS events_session ON events(session);
+CREATE TABLE IF NOT EXISTS sessions (
+    session TEXT PRIMARY KEY,
+    user TEXT NOT NULL,
+    day TEXT NOT NULL,
+    started REAL NOT NULL,
+    ended REAL,
+    status TEXT NOT NULL,
+    cycles INTEGER NOT NULL DEFAULT 0,
+    duration INTEGER NOT NULL DEFAULT 0,
+    phase INTEGER NOT NULL DEFAULT 1,
+    settings TEXT
+);
+CREATE INDEX IF NOT EXISTS sessions_user_started ON sessions(user, started DESC);
+CREATE TABLE IF NOT EXISTS daily (
+    user TEXT NOT NULL,
+    day TEXT NOT NULL,
+    sessions INTEGER NOT NULL,
+    completed INTEGER NOT NULL,
+    cycles INTEGER NOT NULL,
+    seconds INTEGER NOT NULL,
+    PRIMARY KEY (user, day)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS totals (
+    user TEXT PRIMARY KEY,
+    sessions INTEGER NOT NULL,
+    completed INTEGER NOT NULL,
+    cycles INTEGER NOT NULL,
+    seconds INTEGER NOT NULL,
+    first_day TEXT NOT NULL,
+    last_day TEXT NOT NULL,
+    streak INTEGER NOT NULL,
+    longest_streak INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+END_TYPES = ("complete", "stop")
+
+
+def _day(value):
+    return datetime.date.fromisoformat(value)
+
+
+def _valid_day(value):
+    """Ngày YYYY-MM-DD do trình duyệt gửi; sai định dạng thì dùng ngày của server"""
+    try:
+        return _day(value).isoformat()
+    except (TypeError, ValueError):
+        return datetime.date.today().isoformat()
+
+
+def coerce_count(value):
+    """Số nguyên không âm từ dữ liệu trình duyệt gửi (sai kiểu -> None)"""
+    try:
+        return max(0, int(float(value)))
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+class SessionHistory:
+    """Kho lịch sử phiên thiền với một luồng ghi nền cho cả process"""
+
+    def __init__(self, db_path, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.errors = 0
+        self._queue = queue.Queue()
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(SCHEMA)
+        self._writer = threading.Thread(target=self._write_loop, name="session-history", daemon=True)
+        self._writer.start()
+
+    @contextlib.contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            db.execute("PRAGMA synchronous=NORMAL")
+            with db:  # commit khi xong, rollback khi lỗi
+                yield db
+        finally:
+            db.close()
+
+    # ---------- ghi ----------
+    def record(self, user, session, event_type, event_id, day=None, cycles=None, duration=None,
+               phase=None, settings=None):
+        """Đưa một sự kiện vào hàng đợi ghi (không chặn)
+
+        event_type: "start", "phase", "complete" hoặc "stop". day: ngày (YYYY-MM-DD)
+        theo giờ của người dùng, thiếu hoặc sai định dạng thì dùng ngày của server.
+        Các giá trị này đến từ trình duyệt nên được kiểm tra ngay ở đây, không để
+        lỗi dữ liệu làm chết luồng ghi.
+        """
+        self._queue.put({
+            "id": event_id,
+            "user": user,
+            "session": session,
+            "type": event_type,
+            "ts": time.time(),
+            "day": _valid_day(day),
+            "cycles": coerce_count(cycles),
+            "duration": coerce_count(duration),
+            "phase": coerce_count(phase),
+            "settings": json.dumps(settings, ensure_ascii=False) if settings is not None else None,
+        })
+
+    def flush(self, timeout=None):
+        """Chờ các sự kiện đã nhận được ghi xong; trả về False nếu hết timeout"""
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def _write_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and not isinstance(batch[-1], threading.Event):
+                try:
+                    batch.append(self._queue.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            events = [item for item in batch if isinstance(item, dict)]
+            if events:
+                try:
+                    with self._connect() as db:
+                        for event in events:
+                            self._apply(db, event)
+                except Exception:
+                    # Lỗi bất kỳ chỉ bỏ lô này: luồng ghi phải sống để ghi các lô sau và báo flush()
+                    self.errors += len(events)
+                    log.exception("Không ghi được %d sự kiện lịch sử thiền", len(events))
+            for item in batch:
+                if isinstance(item, threading.Event):
+                    item.set()
+
+    def _apply(self, db, event):
+        inserted = db.execute(
+            "INSERT OR IGNORE INTO events (id, user, session, type, ts, cycles, duration, phase) "
+            "VALUES (:id, :user, :session, :type, :ts, :cycles, :duration, :phase)",
+            event,
+        ).rowcount
+        if not inserted:
+            return  # sự kiện gửi lặp
+        if event["type"] == "start":
+            db.execute(
+                "INSERT OR IGNORE INTO sessions (session, user, day, started, status, settings) "
+                "VALUES (:session, :user, :day, :ts, 'running', :settings)",
+                event,
+            )
+        elif event["type"] == "phase":
+            db.execute(
+                "UPDATE sessions SET phase = :phase, cycles = MAX(cycles, COALESCE(:cycles, 0)) "
+                "WHERE session = :session",
+                event,
+            )
+        elif event["type"] in END_TYPES:
+            self._end_session(db, event)
+
+    def _end_session(self, db, event):
+        row = db.execute("SELECT status, day FROM sessions WHERE session = ?", (event["session"],)).fetchone()
+        if row is None:
+            # Không nhận được "start" (ví dụ player cũ): tạo phiên từ sự kiện kết thúc
+            db.execute(
+                "INSERT INTO sessions (session, user, day, started, status) VALUES (:session, :user, :day, :ts, 'running')",
+                event,
+            )
+        elif row[0] != "running":
+            return  # phiên đã kết thúc trước đó
+        cycles = int(event["cycles"] or 0)
+        duration = int(event["duration"] or 0)
+        completed = 1 if event["type"] == "complete" else 0
+        # Phiên tính vào ngày bắt đầu (phiên qua nửa đêm không bị tính sang ngày sau)
+        day = row[1] if row is not None else event["day"]
+        db.execute(
+            "UPDATE sessions SET ended = ?, status = ?, cycles = ?, duration = ? WHERE session = ?",
+            (event["ts"], event["type"], cycles, duration, event["session"]),
+        )
+        db.execute(
+            "INSERT INTO daily (user, day, sessions, completed, cycles, seconds) VALUES (?, ?, 1, ?, ?, ?) "
+            "ON CONFLICT(user, day) DO UPDATE SET sessions = sessions + 1, completed = completed + excluded.completed, "
+            "cycles = cycles + excluded.cycles, seconds = seconds + excluded.seconds",
+            (event["user"], day, completed, cycles, duration),
+        )
+        self._update_totals(db, event["user"], day, completed, cycles, duration)
+
+    @staticmethod
+    def _update_totals(db, user, day, completed, cycles, duration):
+        row = db.execute("SELECT first_day, last_day, streak, longest_streak FROM totals WHERE user = ?",
+                         (user,)).fetchone()
+        if row is None:
+            db.execute(
+                "INSERT INTO totals (user, sessions, completed, cycles, seconds, first_day, last_day, streak, "
+                "longest_streak) VALUES (?, 1, ?, ?, ?, ?, ?, 1, 1)",
+                (user, completed, cycles, duration, day, day),
+            )
+            return
+        first_day, last_day, streak, longest = row
+        if day > last_day:
+            gap = (_day(day) - _day(last_day)).days
+            streak = streak + 1 if gap == 1 else 1
+            last_day = day
+        elif day < last_day:
+            # Sự kiện về trễ cho một ngày đã qua: tính lại chuỗi từ bảng daily
+            streak, longest = SessionHistory._streaks(db, user, last_day)
+        first_day = min(first_day, day)
+        db.execute(
+            "UPDATE totals SET sessions = sessions + 1, completed = completed + ?, cycles = cycles + ?, "
+            "seconds = seconds + ?, first_day = ?, last_day = ?, streak = ?, longest_streak = ? WHERE user = ?",
+            (completed, cycles, duration, first_day, last_day, streak, max(longest, streak), user),
+        )
+
+    @staticmethod
+    def _streaks(db, user, last_day):
+        """(chuỗi kết thúc ở last_day, chuỗi dài nhất) tính từ bảng daily"""
+        streak = longest = 0
+        previous = None
+        for (day,) in db.execute("SELECT day FROM daily WHERE user = ? ORDER BY day", (user,)):
+            current = _day(day)
+            streak = streak + 1 if previous is not None and (current - previous).days == 1 else 1
+            longest = max(longest, streak)
+            previous = current
+        return (streak if previous == _day(last_day) else 0), longest
+
+    # ---------- đọc ----------
+    def stats(self, user, today=None):
+        """Tổng số phiên / chu kỳ / thời gian và chuỗi ngày liên tiếp; None nếu chưa có phiên nào"""
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT sessions, completed, cycles, seconds, first_day, last_day, streak, longest_streak "
+                "FROM totals WHERE user = ?",
+                (user,),
+            ).fetchone()
+        if row is None:
+            return None
+        keys = ("sessions", "completed", "cycles", "seconds", "first_day", "last_day", "streak", "longest_streak")
+        stats = dict(zip(keys, row))
+        # Chuỗi còn tính nếu lần thiền cuối là hôm nay hoặc hôm qua
+        today = today or datetime.date.today()
+        if (today - _day(stats["last_day"])).days > 1:
+            stats["streak"] = 0
+        return stats
+
+    def recent(self, user, limit=10):
+        """Các phiên đã kết thúc gần nhất (dùng index user + started)"""
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT session, day, started, status, cycles, duration, phase, settings FROM sessions "
+                "WHERE user = ? AND status != 'running' ORDER BY started DESC LIMIT ?",
+                (user, limit),
+            ).fetchall()
+        keys = ("session", "day", "started", "status", "cycles", "duration", "phase", "settings")
+        return [dict(zip(keys, row), settings=json.loads(row[-1]) if row[-1] else None) for row in rows]
+
+    def daily(self, user, days=30, today=None):
+        """Số phiên / phút theo ngày trong ``days`` ngày gần nhất (bảng daily, đọc theo khóa chính)"""
+        today = today or datetime.date.today()
+        since = (today - datetime.timedelta(days=days - 1)).isoformat()
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT day, sessions, completed, cycles, seconds FROM daily WHERE user = ? AND day >= ? ORDER BY day",
+                (user, since),
+            ).fetchall()
+        keys = ("day", "sessions", "completed", "cycles", "seconds")
+        return [dict(zip(keys, row)) for row in rows]
@@ -0,0 +1,348 @@
+"""Render cả phiên thiền thành một file audio nén (MP3), không phụ thuộc timer JS.
+
+Trên điện thoại yếu hoặc khi tắt màn hình, trình duyệt hãm timer của player
+nên giọng nói bị lệch hoặc mất. File render sẵn thì chỉ cần phát như một bài
+nhạc. Các cue giọng nói được đặt đúng mốc thời gian của timeline, nhạc nền
+được hạ nhỏ (ducking) khi có giọng và giảm dần khi hoàn thành giống player.
+
+Việc trộn làm theo từng đoạn ``CHUNK_SECONDS`` bằng numpy nên bộ nhớ không
+phụ thuộc độ dài phiên; PCM được đẩy thẳng vào ffmpeg để nén và ghi ra đĩa
+trong lúc trộn. Kết quả được cache theo nội dung (timeline, cue, nhạc, âm
+lượng): cùng cài đặt thì dùng lại file đã render. ``RenderJob`` chạy render
+trong luồng nền để session chỉ đọc tiến độ.
+"""
+import hashlib
+import json
+import os
+import subprocess
+import threading
+import time
+
+import numpy as np
+
+from audio_format import is_wav, read_source, read_wav
+from ffmpeg_util import find_ffmpeg
+from file_lock import FileLock
+from timeline import iter_events, total_duration
+
+RENDER_VERSION = 1
+RENDER_RATE = 24000     # Hz, đủ cho giọng nói và nhạc nền nghe điện thoại
+RENDER_BITRATE = "64k"
+CHUNK_SECONDS = 10
+DUCK_LEVEL = 0.35       # nhạc còn 35% khi có giọng đọc
+DUCK_RAMP = 0.25        # giây hạ / trả âm lượng nhạc
+MAX_FADE = 3            # giây, giống fadeOutBgMusic của player
+MUSIC_PCM_PREFIX = "music-"
+MUSIC_PCM_KEEP = 3      # số bài nhạc đã giải mã giữ lại trong work_dir (mỗi bài vài MB PCM)
+DEFAULT_MAX_BYTES = int(float(os.environ.get("RENDER_CACHE_MAX_MB", "300")) * 1024 * 1024)
+
+
+# ==================== GIẢI MÃ ====================
+def _resample(samples, rate, target):
+    if rate == target or not len(samples):
+        return samples
+    count = int(round(len(samples) * target / rate))
+    return np.interp(
+        np.arange(count) * (rate / target), np.arange(len(samples)), samples
+    ).astype(np.float32)
+
+
+def decode_audio(source, rate=RENDER_RATE):
+    """Đọc cue (đường dẫn hoặc bytes / memoryview) thành mảng float32 mono; WAV đọc trực tiếp, MP3 qua ffmpeg"""
+    data = read_source(source)
+    if is_wav(data):
+        params, pcm = read_wav(data)
+        if params.sampwidth != 2:
+            raise ValueError("Chỉ hỗ trợ WAV 16-bit")
+        samples = np.frombuffer(pcm, dtype="<i2").astype(np.float32) / 32768
+        if params.nchannels > 1:
+            samples = samples.reshape(-1, params.nchannels).mean(axis=1)
+        return _resample(samples, params.framerate, rate)
+    result = subprocess.run(
+        [find_ffmpeg(), "-v", "error", "-i", "pipe:0", "-f", "s16le", "-ac", "1", "-ar", str(rate), "pipe:1"],
+        input=data,
+        capture_output=True,
+        check=True,
+    )
+    return np.frombuffer(result.stdout, dtype="<i2").astype(np.float32) / 32768
+
+
+def _prune_pcm(cache_dir, keep, count=MUSIC_PCM_KEEP):
+    """Chỉ giữ ``count`` file PCM nhạc dùng gần nhất"""
+    files = []
+    for name in os.listdir(cache_dir):
+        if name.startswith(MUSIC_PCM_PREFIX) and name.endswith(".s16"):
+            try:
+                files.append((os.stat(os.path.join(cache_dir, name)).st_mtime, name))
+            except OSError:
+                continue
+    for _, name in sorted(files, reverse=True)[count:]:
+        if name == keep:
+            continue
+        try:
+            os.remove(os.path.join(cache_dir, name))  # memmap đang mở vẫn đọc được
+        except OSError:
+            pass
+
+
+class MusicReader:
+    """Nhạc nền lặp vô hạn như player, đọc theo từng đoạn.
+
+    File nhạc được giải mã một lần thành PCM 16-bit trên đĩa (dùng lại cho mọi
+    lần render cùng file nhạc) rồi đọc qua memmap nên không nạp cả bài vào RAM.
+    """
+
+    def __init__(self, path, cache_dir, rate=RENDER_RATE):
+        stat = os.stat(path)
+        os.makedirs(cache_dir, exist_ok=True)
+        pcm_path = os.path.join(cache_dir, f"{MUSIC_PCM_PREFIX}{stat.st_mtime_ns:x}{stat.st_size:x}-{rate}.s16")
+        if not os.path.exists(pcm_path):
+            tmp_path = f"{pcm_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            subprocess.run(
+                [find_ffmpeg(), "-v", "error", "-y", "-i", path, "-f", "s16le", "-ac", "1", "-ar", str(rate), tmp_path],
+                capture_output=True,
+                check=True,
+            )
+            os.replace(tmp_path, pcm_path)
+        os.utime(pcm_path)
+        _prune_pcm(cache_dir, keep=os.path.basename(pcm_path))
+        self._pcm = np.memmap(pcm_path, dtype="<i2", mode="r") if os.path.getsize(pcm_path) else None
+        self._pos = 0
+
+    def read(self, count):
+        if self._pcm is None:
+            return np.zeros(count, dtype=np.float32)
+        index = (self._pos + np.arange(count)) % len(self._pcm)
+        self._pos += count
+        return self._pcm[index].astype(np.float32) / 32768
+
+
+# ==================== TRỘN ====================
+def cue_schedule(timeline):
+    """(các cue [(giây, cue)], lúc bật nhạc, lúc bắt đầu giảm nhạc, tổng thời lượng)"""
+    duration = total_duration(timeline)
+    if duration is None:
+        raise ValueError("Chế độ vô hạn không thể render thành file")
+    cues = []
+    music_start = fade_start = None
+    for ev in iter_events(timeline):
+        if "cue" in ev:
+            cues.append((ev["t"], ev["cue"]))
+        if ev.get("music") == "start":
+            music_start = ev["t"]
+        elif ev.get("music") == "fade":
+            fade_start = ev["t"]
+    return cues, music_start, fade_start, duration
+
+
+def mix_session(timeline, cue_audio, music=None, voice_volume=0.8, music_volume=0.3,
+                rate=RENDER_RATE, chunk_seconds=CHUNK_SECONDS):
+    """Sinh lần lượt các đoạn PCM float32 của cả phiên.
+
+    cue_audio: {cue: mảng float32 mono}; music: MusicReader hoặc None.
+    """
+    cues, music_start, fade_start, duration = cue_schedule(timeline)
+    placements = sorted((int(round(t * rate)), cue_audio[cue]) for t, cue in cues)
+    starts = np.array([start for start, _ in placements], dtype=np.int64)
+    longest = max((len(samples) for _, samples in placements), default=0)
+    ramp = max(int(DUCK_RAMP * rate), 1)
+
+    total = max(int(duration * rate), max((s + len(a) for s, a in placements), default=0))
+    music_from = int(music_start * rate) if music is not None and music_volume > 0 else total
+    fade_from = int(fade_start * rate)
+    fade_len = int(min(MAX_FADE, music_volume * 4) * rate)
+    music_to = min(total, fade_from + fade_len)
+    chunk = int(chunk_seconds * rate)
+
+    for a in range(0, total, chunk):
+        b = min(a + chunk, total)
+        index = np.arange(a, b)
+        voice = np.zeros(b - a, dtype=np.float32)
+        duck = np.zeros(b - a, dtype=np.float32)
+
+        first = np.searchsorted(starts, a - longest - ramp)
+        last = np.searchsorted(starts, b + ramp)
+        for start, samples in placements[first:last]:
+            end = start + len(samples)
+            lo, hi = max(start, a), min(end, b)
+            if lo < hi:
+                voice[lo - a:hi - a] += samples[lo - start:hi - start]
+            # Hạ nhạc trước khi giọng cất lên và trả lại sau khi dứt, đều trong DUCK_RAMP
+            lo, hi = max(start - ramp, a), min(end + ramp, b)
+            if lo < hi:
+                near = index[lo - a:hi - a]
+                level = np.clip(np.minimum(near - (start - ramp), (end + ramp) - near) / ramp, 0, 1)
+                np.maximum(duck[lo - a:hi - a], level, out=duck[lo - a:hi - a])
+
+        mix = voice * voice_volume
+        lo, hi = max(a, music_from), min(b, music_to)
+        if lo < hi:
+            gain = music_volume * (1 - (1 - DUCK_LEVEL) * duck[lo - a:hi - a])
+            if fade_len:
+                gain *= np.clip(1 - (index[lo - a:hi - a] - fade_from) / fade_len, 0, 1)
+            mix[lo - a:hi - a] += music.read(hi - lo) * gain
+        yield np.clip(mix, -1, 1), b / total
+
+
+def encode_mp3(chunks, out_path, rate=RENDER_RATE, bitrate=RENDER_BITRATE, progress=None):
+    """Nén các đoạn PCM thành MP3 ngay trong lúc trộn (ffmpeg ghi thẳng ra đĩa)"""
+    proc = subprocess.Popen(
+        [find_ffmpeg(), "-v", "error", "-y", "-f", "s16le", "-ar", str(rate), "-ac", "1",
+         "-i", "pipe:0", "-c:a", "libmp3lame", "-b:a", bitrate, "-f", "mp3", out_path],
+        stdin=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    try:
+        for samples, done in chunks:
+            proc.stdin.write((samples * 32767).astype("<i2").tobytes())
+            if progress:
+                progress(done)
+        proc.stdin.close()
+    except BaseException:
+        proc.kill()
+        proc.wait()
+        raise
+    if proc.wait() != 0:
+        raise RuntimeError(f"ffmpeg lỗi: {proc.stderr.read().decode('utf-8', 'replace').strip()}")
+
+
+# ==================== CACHE ====================
+def render_key(timeline, cue_files, music_path, voice_volume, music_volume):
+    """Khóa render: đổi khi timeline, cue, file nhạc hoặc âm lượng thay đổi"""
+    music = None
+    if music_path and os.path.exists(music_path):
+        stat = os.stat(music_path)
+        music = [stat.st_mtime_ns, stat.st_size]
+        if music_volume <= 0:
+            music = None
+    used = {cue for _, cue in cue_schedule(timeline)[0]}
+    raw = json.dumps([
+        RENDER_VERSION,
+        timeline,
+        sorted((cue, sha) for cue, (_, sha) in cue_files.items() if cue in used),
+        music,
+        round(voice_volume, 3),
+        round(music_volume, 3) if music else 0,
+    ])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def render_filename(key):
+    return f"session-{key}.mp3"
+
+
+def cached_render(out_dir, key):
+    """Tên file render sẵn nếu đã có (và đánh dấu vừa dùng), ngược lại None"""
+    path = os.path.join(out_dir, render_filename(key))
+    try:
+        os.utime(path)
+    except OSError:
+        return None
+    return render_filename(key)
+
+
+def _lock_path(lock_dir, key):
+    return os.path.join(lock_dir, f"render-{key}.lock")
+
+
+def _prune(out_dir, max_bytes, keep):
+    """Xóa các file render lâu không dùng nhất khi vượt hạn mức"""
+    files = []
+    for name in os.listdir(out_dir):
+        if name.startswith("session-") and name.endswith(".mp3"):
+            stat = os.stat(os.path.join(out_dir, name))
+            files.append((stat.st_mtime, stat.st_size, name))
+    total = sum(size for _, size, _ in files)
+    for _, size, name in sorted(files):
+        if total <= max_bytes:
+            break
+        if name == keep:
+            continue
+        try:
+            os.remove(os.path.join(out_dir, name))  # file khóa giữ lại: xóa khi đã nhả sẽ hỏng khóa
+        except OSError:
+            pass
+        total -= size
+
+
+def render_session(timeline, cue_files, music_path, out_dir, lock_dir, work_dir, voice_volume=0.8,
+                   music_volume=0.3, progress=None, max_bytes=DEFAULT_MAX_BYTES):
+    """Render phiên thành MP3 trong out_dir; trả về tên file (dùng cache nếu đã có).
+
+    cue_files: {cue: (đường dẫn hoặc bytes / memoryview, sha256)} như ``ensure_sprite``.
+    lock_dir / work_dir: thư mục file khóa / PCM nhạc đã giải mã, nằm ngoài thư mục
+    được phục vụ công khai.
+    """
+    key = render_key(timeline, cue_files, music_path, voice_volume, music_volume)
+    os.makedirs(out_dir, exist_ok=True)
+    # Khóa theo khóa render (mọi luồng, mọi process): cùng cài đặt chỉ render một
+    # lần, bên chờ dùng luôn file vừa render; render khác cài đặt chạy song song
+    with FileLock(_lock_path(lock_dir, key)):
+        filename = cached_render(out_dir, key)
+        if filename:
+            return filename
+
+        used = {cue for _, cue in cue_schedule(timeline)[0]}
+        cue_audio = {cue: decode_audio(cue_files[cue][0]) for cue in used}
+        music = None
+        if music_volume > 0 and music_path and os.path.exists(music_path):
+            music = MusicReader(music_path, work_dir)
+
+        path = os.path.join(out_dir, render_filename(key))
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            chunks = mix_session(timeline, cue_audio, music, voice_volume, music_volume)
+            encode_mp3(chunks, tmp_path, progress=progress)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        _prune(out_dir, max_bytes, keep=render_filename(key))
+        return render_filename(key)
+
+
+class RenderJob:
+    """Render một phiên (``render_session``) trong luồng nền; session chỉ đọc ``progress`` / ``status``.
+
+    on_done: gọi với job (trong luồng nền) sau khi render xong.
+    """
+
+    def __init__(self, key, timeline, cue_files, music_path, out_dir, lock_dir, work_dir, voice_volume=0.8,
+                 music_volume=0.3, on_done=None):
+        self.key = key
+        self.on_done = on_done
+        self.status = "pending"  # pending -> running -> done / error
+        self.progress = 0.0
+        self.filename = None
+        self.error = None
+        self.started = None
+        self.elapsed = None
+        self._args = (timeline, cue_files, music_path, out_dir, lock_dir, work_dir, voice_volume, music_volume)
+        self._thread = threading.Thread(target=self._run, name=f"session-render-{key[:8]}", daemon=True)
+
+    def start(self):
+        self.status = "running"
+        self.started = time.time()
+        self._thread.start()
+        return self
+
+    @property
+    def finished(self):
+        return self.status in ("done", "error")
+
+    def _set_progress(self, done):
+        self.progress = done
+
+    def _run(self):
+        timeline, cue_files, music_path, out_dir, lock_dir, work_dir, voice_volume, music_volume = self._args
+        try:
+            self.filename = render_session(timeline, cue_files, music_path, out_dir, lock_dir, work_dir,
+                                           voice_volume=voice_volume, music_volume=music_volume,
+                                           progress=self._set_progress)
+            self.elapsed = time.time() - self.started
+            if self.on_done:
+                self.on_done(self)
+            self.status = "done"
+        except Exception as e:
+            self.error = str(e)
+            self.status = "error"
@@ -0,0 +1,113 @@
+"""Endpoint gTTS giả lập cục bộ: trả lời batchexecute giống Google Translate, không cần mạng.
+
+Audio trả về là ``FAKE_AUDIO_PREFIX`` + đoạn text nhận được (UTF-8), nên test
+kiểm tra được client gửi đúng đoạn nào. Chạy riêng để trỏ app vào:
+
+    python tests/fake_gtts.py --port 8765
+    GTTS_ENDPOINT=http://127.0.0.1:8765/ TTS_BACKEND=gtts streamlit run app.py
+"""
+import argparse
+import base64
+import json
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FAKE_AUDIO_PREFIX = b"FAKE-MP3:"
+
+
+def parse_rpc(body):
+    """Body ``f.req=...`` của gTTS -> (text, lang)"""
+    rpc = json.loads(urllib.parse.parse_qs(body)["f.req"][0])
+    text, lang = json.loads(rpc[0][0][1])[:2]
+    return text, lang
+
+
+def rpc_response(audio):
+    """Trả lời batchexecute chứa ``audio`` (base64) ở dạng gTTS đọc được"""
+    payload = json.dumps([base64.b64encode(audio).decode("ascii")])
+    line = json.dumps([["wrb.fr", "jQ1olc", payload, None, None, None, "generic"]], separators=(",", ":"))
+    return f")]}}'\n\n{len(line)}\n{line}\n".encode("utf-8")
+
+
+class FakeGTTSServer:
+    """Server chạy trong luồng nền; ``fail_first`` request đầu trả 429 (kèm Retry-After: 0)"""
+
+    def __init__(self, host="127.0.0.1", port=0, fail_first=0):
+        self.requests = []  # (text, lang) theo thứ tự nhận
+        self.fail_first = fail_first
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-gtts", daemon=True)
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8")
+                with server._lock:
+                    failing = server.fail_first > 0
+                    server.fail_first -= failing
+                if failing:
+                    self.send_response(429)
+                    self.send_header("Retry-After", "0")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                try:
+                    text, lang = parse_rpc(body)
+                except (KeyError, IndexError, ValueError):
+                    self.send_error(400)
+                    return
+                with server._lock:
+                    server.requests.append((text, lang))
+                data = rpc_response(FAKE_AUDIO_PREFIX + text.encode("utf-8"))
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    server = FakeGTTSServer(args.host, args.port)
+    print(f"Endpoint gTTS giả lập: {server.url}")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""GTTSClient chạy với endpoint gTTS giả lập cục bộ (không cần mạng)."""
+import os
+import sys
+
+import pytest
+from gtts import gTTS, gTTSError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gtts_client  # noqa: E402
+from fake_gtts import FAKE_AUDIO_PREFIX, FakeGTTSServer  # noqa: E402
+from gtts_client import GTTSClient  # noqa: E402
+
+
+@pytest.fixture
+def server():
+    with FakeGTTSServer() as server:
+        yield server
+
+
+def test_synthesize_against_fake_endpoint(server):
+    client = GTTSClient(endpoint=server.url)
+    try:
+        audio = client.synthesize("Hít vào", lang="vi")
+    finally:
+        client.close()
+    assert audio == FAKE_AUDIO_PREFIX + "Hít vào".encode("utf-8")
+    assert server.requests == [("Hít vào", "vi")]
+
+
+def test_long_text_is_sent_in_parts(server):
+    text = "Hãy ngồi thoải mái, thả lỏng đôi vai và chuẩn bị tinh thần. " * 4
+    client = GTTSClient(endpoint=server.url)
+    try:
+        audio = client.synthesize(text)
+    finally:
+        client.close()
+    assert len(server.requests) > 1
+    assert audio == b"".join(FAKE_AUDIO_PREFIX + part.encode("utf-8") for part, _ in server.requests)
+
+
+def test_retries_rate_limited_requests():
+    with FakeGTTSServer(fail_first=2) as server:
+        client = GTTSClient(endpoint=server.url, backoff=0.01)
+        try:
+            assert client.synthesize("Thở ra") == FAKE_AUDIO_PREFIX + "Thở ra".encode("utf-8")
+        finally:
+            client.close()
+    assert server.fail_first == 0
+
+
+def test_gives_up_after_max_retries():
+    with FakeGTTSServer(fail_first=10) as server:
+        client = GTTSClient(endpoint=server.url, max_retries=1, backoff=0.01)
+        try:
+            with pytest.raises(gTTSError):
+                client.synthesize("Giữ hơi")
+        finally:
+            client.close()
+
+
+class PublicOnlyTTS(gTTS):
+    """gTTS không còn API nội bộ ``_prepare_requests``"""
+    _prepare_requests = None
+
+    def write_to_fp(self, fp):
+        fp.write(b"public:" + self.text.encode("utf-8"))
+
+
+def test_falls_back_to_public_api(monkeypatch):
+    monkeypatch.setattr(gtts_client, "gTTS", PublicOnlyTTS)
+    client = GTTSClient(endpoint="")
+    try:
+        assert client.synthesize("Hít vào") == "public:Hít vào".encode("utf-8")
+        client.endpoint = "http://127.0.0.1:1/"
+        with pytest.raises(gTTSError):
+            client.synthesize("Hít vào")
+    finally:
+        client.close()
@@ -0,0 +1,207 @@
+"""Biên dịch cài đặt thiền thành lịch trình sự kiện (timeline) gọn, mã hóa run-length.
+
+Timeline chỉ ghi mỗi giai đoạn một lần (mẫu chu kỳ + số lần lặp, ``None`` = vô
+hạn) nên 999 chu kỳ hay chế độ vô hạn đều chỉ vài trăm byte. Player trong
+trình duyệt và ``iter_events`` ở đây mở rộng timeline theo cùng một quy tắc,
+thành các sự kiện có mốc thời gian tuyệt đối (giây từ lúc bấm Bắt Đầu):
+
+    {"t": 7, "cue": "inhale", "state": "inhale", "until": 11, "cycle": 1, "phase": 1}
+
+Chạy ``python timeline.py`` để mô phỏng không giao diện một phiên 999 chu kỳ.
+"""
+import itertools
+import time
+
+READY_GAP = 2          # giây từ "Chuẩn bị bắt đầu" tới chu kỳ đầu tiên
+TRANSITION_TIME = 3    # giây thông báo chuyển sang giai đoạn 2
+COMPLETE_HOLD = 3      # giây hiển thị "Hoàn thành" trước khi về trạng thái chờ
+MAX_COUNTDOWN_VOICE = 10
+
+
+def breathing_pattern(inhale, hold, exhale):
+    """Mẫu một chu kỳ; bỏ qua giữ hơi khi hold = 0"""
+    pattern = [["inhale", inhale]]
+    if hold > 0:
+        pattern.append(["hold", hold])
+    pattern.append(["exhale", exhale])
+    return pattern
+
+
+def compile_timeline(prepare_time, phase1, phase2=None, total_cycles=0,
+                     phase1_cycles=0, countdown_voice=True):
+    """Biên dịch cài đặt thành timeline.
+
+    phase1, phase2: (hít vào, giữ hơi, thở ra) tính bằng giây; phase2 = None nếu
+    chỉ có một giai đoạn. total_cycles = 0 nghĩa là vô hạn.
+    """
+    infinite = total_cycles == 0
+    segments = []
+    if phase2 is None or (not infinite and phase1_cycles >= total_cycles):
+        segments.append({
+            "phase": 1,
+            "pattern": breathing_pattern(*phase1),
+            "repeat": None if infinite else total_cycles,
+        })
+    else:
+        segments.append({"phase": 1, "pattern": breathing_pattern(*phase1), "repeat": phase1_cycles})
+        segments.append({
+            "phase": 2,
+            "pattern": breathing_pattern(*phase2),
+            "repeat": None if infinite else total_cycles - phase1_cycles,
+            "transition": TRANSITION_TIME,
+        })
+    # Bỏ các giai đoạn 0 chu kỳ (trừ giai đoạn cuối)
+    segments = [seg for seg in segments[:-1] if seg["repeat"]] + segments[-1:]
+
+    countdown = []
+    if countdown_voice:
+        countdown = list(range(min(prepare_time - 1, MAX_COUNTDOWN_VOICE), 0, -1))
+
+    return {
+        "version": 1,
+        "prepare": prepare_time,
+        "countdown": countdown,
+        "ready_gap": READY_GAP,
+        "segments": segments,
+        "complete_hold": COMPLETE_HOLD,
+        "total_cycles": total_cycles,
+    }
+
+
+def timeline_cues(timeline):
+    """Các cue mà timeline có thể phát (theo thứ tự tên), để player chỉ tải đúng chừng đó"""
+    cues = {"prepare", "ready", "complete"}
+    cues.update(f"countdown_{n}" for n in timeline["countdown"])
+    for seg in timeline["segments"]:
+        if seg.get("transition"):
+            cues.add("phase2")
+        cues.update(state for state, _ in seg["pattern"])
+    return sorted(cues)
+
+
+# ==================== MỞ RỘNG ====================
+def iter_events(timeline):
+    """Sinh lần lượt các sự kiện; với chế độ vô hạn thì sinh mãi (lazy)"""
+    prepare = timeline["prepare"]
+    yield {"t": 0, "cue": "prepare", "state": "prepare", "until": prepare}
+    for n in timeline["countdown"]:
+        yield {"t": prepare - n, "cue": f"countdown_{n}"}
+    yield {"t": prepare, "cue": "ready", "state": "ready", "music": "start"}
+
+    t = prepare + timeline["ready_gap"]
+    cycle = 0
+    for seg in timeline["segments"]:
+        phase = seg["phase"]
+        if seg.get("transition"):
+            yield {"t": t, "cue": "phase2", "state": "phase2", "cycle": cycle, "phase": phase}
+            t += seg["transition"]
+        repeats = itertools.count() if seg["repeat"] is None else range(seg["repeat"])
+        for _ in repeats:
+            cycle += 1
+            for state, seconds in seg["pattern"]:
+                yield {"t": t, "cue": state, "state": state, "until": t + seconds,
+                       "cycle": cycle, "phase": phase}
+                t += seconds
+    yield {"t": t, "cue": "complete", "state": "complete", "cycle": cycle, "music": "fade"}
+    yield {"t": t + timeline["complete_hold"], "state": "idle"}
+
+
+def total_duration(timeline):
+    """Tổng thời lượng phiên (giây), None nếu vô hạn"""
+    t = timeline["prepare"] + timeline["ready_gap"]
+    for seg in timeline["segments"]:
+        if seg["repeat"] is None:
+            return None
+        t += seg.get("transition", 0)
+        t += seg["repeat"] * sum(seconds for _, seconds in seg["pattern"])
+    return t + timeline["complete_hold"]
+
+
+def state_at(timeline, t):
+    """Trạng thái hiển thị tại thời điểm t mà không cần duyệt các chu kỳ trước đó"""
+    prepare = timeline["prepare"]
+    if t < prepare:
+        return {"t": 0, "state": "prepare", "until": prepare}
+    start = prepare + timeline["ready_gap"]
+    if t < start:
+        return {"t": prepare, "state": "ready"}
+
+    cycle = 0
+    for seg in timeline["segments"]:
+        phase = seg["phase"]
+        transition = seg.get("transition", 0)
+        if transition:
+            if t < start + transition:
+                return {"t": start, "state": "phase2", "cycle": cycle, "phase": phase}
+            start += transition
+        cycle_len = sum(seconds for _, seconds in seg["pattern"])
+        seg_len = None if seg["repeat"] is None else seg["repeat"] * cycle_len
+        if seg_len is None or t < start + seg_len:
+            index = int((t - start) // cycle_len)
+            offset = start + index * cycle_len
+            for state, seconds in seg["pattern"]:
+                if t < offset + seconds:
+                    return {"t": offset, "state": state, "until": offset + seconds,
+                            "cycle": cycle + index + 1, "phase": phase}
+                offset += seconds
+        start += seg_len
+        cycle += seg["repeat"]
+
+    if t < start + timeline["complete_hold"]:
+        return {"t": start, "state": "complete", "cycle": cycle}
+    return {"t": start + timeline["complete_hold"], "state": "idle"}
+
+
+# ==================== MÔ PHỎNG ====================
+def simulate(timeline, horizon=None):
+    """Chạy phiên không giao diện và kiểm tra tính nhất quán của lịch trình.
+
+    horizon: dừng sau bấy nhiêu giây (bắt buộc với chế độ vô hạn). Trả về tóm tắt
+    gồm số chu kỳ, thời lượng và số lần phát mỗi cue; báo ValueError nếu sai.
+    """
+    if horizon is None and total_duration(timeline) is None:
+        raise ValueError("Chế độ vô hạn cần horizon")
+
+    cues = {}
+    last_t = 0
+    last_cycle = 0
+    pending_until = None
+    events = 0
+    for ev in iter_events(timeline):
+        if horizon is not None and ev["t"] > horizon:
+            break
+        events += 1
+        if ev["t"] < last_t:
+            raise ValueError(f"Sự kiện lùi thời gian tại t={ev['t']}")
+        if "state" in ev and pending_until is not None and ev["t"] != pending_until:
+            raise ValueError(f"Trạng thái trước kết thúc tại {pending_until}, sự kiện kế tiếp tại {ev['t']}")
+        if ev.get("state") in ("inhale", "hold", "exhale"):
+            if ev["cycle"] < last_cycle or ev["cycle"] > last_cycle + 1:
+                raise ValueError(f"Số chu kỳ nhảy từ {last_cycle} sang {ev['cycle']}")
+            last_cycle = ev["cycle"]
+            pending_until = ev["until"]
+        elif "state" in ev:
+            pending_until = None
+        if "cue" in ev:
+            cues[ev["cue"]] = cues.get(ev["cue"], 0) + 1
+        last_t = ev["t"]
+
+    total = timeline["total_cycles"]
+    complete = horizon is None
+    if complete and last_cycle != total:
+        raise ValueError(f"Hoàn thành {last_cycle} chu kỳ, cài đặt là {total}")
+    if complete and last_t != total_duration(timeline):
+        raise ValueError(f"Thời lượng {last_t} khác với tính toán {total_duration(timeline)}")
+    return {"cycles": last_cycle, "duration": last_t, "events": events, "cues": cues}
+
+
+if __name__ == "__main__":
+    for name, tl, horizon in [
+        ("999 chu kỳ, 2 giai đoạn", compile_timeline(10, (4, 4, 6), (2, 0, 4), 999, 500), None),
+        ("vô hạn, 1 giờ", compile_timeline(10, (4, 4, 6)), 3600),
+    ]:
+        started = time.perf_counter()
+        summary = simulate(tl, horizon)
+        elapsed = (time.perf_counter() - started) * 1000
+        print(f"{name}: {summary['cycles']} chu kỳ, {summary['duration']} giây, "
+              f"{summary['events']} sự kiện - mô phỏng {elapsed:.1f} ms")
@@ -0,0 +1,107 @@
+"""Các engine TTS có thể thay thế cho nhau, chọn bằng biến môi trường ``TTS_BACKEND``.
+
+- ``gtts``   : Google Translate TTS (cần mạng), mặc định
+- ``espeak`` : espeak-ng chạy cục bộ, không cần mạng (``apt install espeak-ng``)
+- ``stub``   : âm thanh tổng hợp xác định theo text, dùng cho chạy thử
+"""
+import array
+import hashlib
+import io
+import math
+import os
+import shutil
+import subprocess
+import wave
+
+
+class TTSBackend:
+    """Giao diện chung: ``synthesize`` trả về bytes audio (MP3 hoặc WAV)"""
+
+    name = ""
+
+    def synthesize(self, text, lang="vi", slow=False):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class GTTSBackend(TTSBackend):
+    name = "gtts"
+
+    def __init__(self, pool_size=8):
+        from gtts_client import GTTSClient
+        self.client = GTTSClient(pool_size=pool_size)
+
+    def synthesize(self, text, lang="vi", slow=False):
+        return self.client.synthesize(text, lang=lang, slow=slow)
+
+    def close(self):
+        self.client.close()
+
+
+class EspeakBackend(TTSBackend):
+    """espeak-ng cục bộ: độ trễ ổn định, không phụ thuộc dịch vụ bên ngoài"""
+
+    name = "espeak"
+
+    def __init__(self, executable=None, speed=160, slow_speed=120, timeout=30):
+        self.executable = executable or shutil.which("espeak-ng") or shutil.which("espeak")
+        if not self.executable:
+            raise RuntimeError("Không tìm thấy espeak-ng. Cài đặt: apt install espeak-ng")
+        self.speed = speed
+        self.slow_speed = slow_speed
+        self.timeout = timeout
+
+    def synthesize(self, text, lang="vi", slow=False):
+        speed = self.slow_speed if slow else self.speed
+        result = subprocess.run(
+            [self.executable, "-v", lang, "-s", str(speed), "--stdout", text],
+            capture_output=True,
+            timeout=self.timeout,
+            check=True,
+        )
+        return result.stdout
+
+
+class StubBackend(TTSBackend):
+    """Sinh WAV xác định từ text (cùng text -> cùng bytes); không cần mạng hay engine"""
+
+    name = "stub"
+
+    def __init__(self, sample_rate=16000):
+        self.sample_rate = sample_rate
+
+    def synthesize(self, text, lang="vi", slow=False):
+        digest = hashlib.sha256(f"{lang}:{text}".encode("utf-8")).digest()
+        frequency = 220 + digest[0] * 2
+        duration = min(0.25 + 0.06 * len(text), 4.0) * (1.5 if slow else 1.0)
+        count = int(self.sample_rate * duration)
+        samples = array.array("h", (
+            int(8000 * math.sin(2 * math.pi * frequency * n / self.sample_rate))
+            for n in range(count)
+        ))
+        buf = io.BytesIO()
+        with wave.open(buf, "wb") as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(self.sample_rate)
+            w.writeframes(samples.tobytes())
+        return buf.getvalue()
+
+
+BACKENDS = {
+    GTTSBackend.name: GTTSBackend,
+    EspeakBackend.name: EspeakBackend,
+    StubBackend.name: StubBackend,
+}
+
+
+def create_backend(name=None, pool_size=8):
+    """Tạo backend theo tên (mặc định lấy từ TTS_BACKEND)"""
+    name = (name or os.environ.get("TTS_BACKEND", "gtts")).strip().lower()
+    if name not in BACKENDS:
+        raise ValueError(f"TTS_BACKEND không hợp lệ: {name!r} (chọn {', '.join(BACKENDS)})")
+    if name == GTTSBackend.name:
+        return GTTSBackend(pool_size=pool_size)
+    return BACKENDS[name]()
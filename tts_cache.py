@@ -0,0 +1,226 @@
+"""Cache audio giọng nói theo nội dung (text, lang, slow, engine).
+
+Mỗi cue được lưu thành một file đặt tên theo hash của khóa, kèm manifest
+(audio/manifest.json) ghi kích thước, thời lượng và checksum. File bị hỏng
+hoặc bị sửa ngoài ý muốn sẽ bị loại khi đọc; dung lượng được giữ dưới hạn
+mức bằng cách xóa các cue lâu không dùng nhất (LRU).
+
+Nhiều process có thể dùng chung một thư mục cache: manifest chỉ được sửa khi
+giữ khóa file (đọc lại bản mới nhất trên đĩa rồi mới ghi), mỗi cue có khóa
+riêng để chỉ một process gọi TTS cho cue đó, và mọi file đều được ghi ra file
+tạm rồi đổi tên nguyên tử nên không ai đọc phải file ghi dở.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+from audio_format import audio_extension, probe_duration
+import metrics
+from file_lock import FileLock
+
+MANIFEST_NAME = "manifest.json"
+LOCK_DIR = ".locks"
+DEFAULT_MAX_BYTES = int(float(os.environ.get("TTS_CACHE_MAX_MB", "200")) * 1024 * 1024)
+# Chỉ ghi lại thời điểm dùng vào manifest khi đã cũ hơn khoảng này (tránh ghi đĩa mỗi lần rerun)
+TOUCH_INTERVAL = 3600
+
+
+# ==================== CACHE ====================
+def cache_key(text, lang="vi", slow=False, engine="gtts"):
+    """Khóa cache: hash của (text, lang, slow, engine)"""
+    raw = json.dumps([text, lang, bool(slow), engine], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class TTSCache:
+    """Cache audio giọng nói có manifest, kiểm tra checksum và giới hạn dung lượng"""
+
+    def __init__(self, cache_dir="audio", max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.manifest_path = os.path.join(cache_dir, MANIFEST_NAME)
+        self.lock_dir = os.path.join(cache_dir, LOCK_DIR)
+        self._lock = threading.RLock()
+        self._verified = {}  # key -> (mtime_ns, size) đã kiểm tra checksum
+        self._signature = None  # (mtime_ns, size) của manifest đã nạp
+        os.makedirs(self.lock_dir, exist_ok=True)
+        self._entries = {}
+        self._refresh()
+
+    # ---------- manifest ----------
+    def _refresh(self):
+        """Nạp lại manifest nếu process khác đã ghi bản mới"""
+        try:
+            stat = os.stat(self.manifest_path)
+        except OSError:
+            return
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if signature == self._signature:
+            return
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return
+        self._entries = dict(manifest.get("entries", {}))
+        self._signature = signature
+
+    def _save_manifest(self):
+        """Ghi manifest; chỉ gọi khi đang giữ khóa manifest (``_manifest_lock``)"""
+        tmp_path = f"{self.manifest_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "entries": self._entries}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.manifest_path)
+        stat = os.stat(self.manifest_path)
+        self._signature = (stat.st_mtime_ns, stat.st_size)
+
+    def _manifest_lock(self):
+        return FileLock(os.path.join(self.lock_dir, "manifest.lock"))
+
+    def _key_lock(self, key):
+        return FileLock(os.path.join(self.lock_dir, f"{key[:32]}.lock"))
+
+    # ---------- đọc ----------
+    def _verify(self, key, entry):
+        path = os.path.join(self.cache_dir, entry["file"])
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        if stat.st_size != entry["size"]:
+            return False
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if self._verified.get(key) == signature:
+            return True
+        try:
+            with metrics.span("tts_cache_verify"), open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return False
+        if hashlib.sha256(data).hexdigest() != entry["sha256"]:
+            return False
+        self._verified[key] = signature
+        return True
+
+    def get(self, text, lang="vi", slow=False, engine="gtts"):
+        """Đường dẫn file đã kiểm tra toàn vẹn, hoặc None nếu chưa có / bị hỏng"""
+        key = cache_key(text, lang, slow, engine)
+        with self._lock:
+            self._refresh()
+            entry = self._entries.get(key)
+            if entry is None:
+                metrics.inc("tts_cache_misses")
+                return None
+            if not self._verify(key, entry):
+                with self._manifest_lock():
+                    self._refresh()
+                    # Process khác có thể vừa ghi lại cue này -> kiểm tra lại trước khi xóa
+                    entry = self._entries.get(key)
+                    if entry is None or not self._verify(key, entry):
+                        metrics.inc("tts_cache_misses")
+                        metrics.inc("tts_cache_corrupt")
+                        self._remove(key)
+                        self._save_manifest()
+                        return None
+            if time.time() - entry.get("last_used", 0) > TOUCH_INTERVAL:
+                with self._manifest_lock():
+                    self._refresh()
+                    if key in self._entries:
+                        self._entries[key]["last_used"] = time.time()
+                        self._save_manifest()
+            metrics.inc("tts_cache_hits")
+            return os.path.join(self.cache_dir, entry["file"])
+
+    def entry(self, text, lang="vi", slow=False, engine="gtts"):
+        """Thông tin manifest của một cue (size, duration, sha256...)"""
+        with self._lock:
+            self._refresh()
+            return self._entries.get(cache_key(text, lang, slow, engine))
+
+    def get_or_create(self, text, create, lang="vi", slow=False, engine="gtts"):
+        """Đường dẫn cue; nếu chưa có thì gọi ``create()`` lấy bytes audio rồi lưu.
+
+        ``create()`` trả về bytes, hoặc (bytes, dict) để ghi thêm thông tin vào
+        manifest. Chỉ một process / luồng tạo mỗi cue: các bên khác chờ khóa của
+        cue rồi dùng luôn kết quả thay vì gọi TTS lần nữa.
+        """
+        filepath = self.get(text, lang, slow, engine)
+        if filepath:
+            return filepath
+        with self._key_lock(cache_key(text, lang, slow, engine)):
+            filepath = self.get(text, lang, slow, engine)
+            if filepath:
+                return filepath
+            created = create()
+            data, info = created if isinstance(created, tuple) else (created, None)
+            return self.put(text, data, lang, slow, engine, info=info)
+
+    # ---------- ghi ----------
+    def put(self, text, data, lang="vi", slow=False, engine="gtts", info=None):
+        """Lưu audio vào cache; trả về đường dẫn. Báo ValueError nếu dữ liệu không hợp lệ
+
+        info: các trường ghi thêm vào manifest (ví dụ thời lượng có tiếng sau khi cắt lặng).
+        """
+        duration = probe_duration(data)
+        if not duration:
+            raise ValueError("Dữ liệu audio không hợp lệ hoặc rỗng")
+
+        key = cache_key(text, lang, slow, engine)
+        filename = key[:32] + audio_extension(data)
+        path = os.path.join(self.cache_dir, filename)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+        now = time.time()
+        with self._lock, self._manifest_lock():
+            self._refresh()
+            self._entries[key] = {
+                "file": filename,
+                "text": text,
+                "lang": lang,
+                "slow": bool(slow),
+                "engine": engine,
+                "size": len(data),
+                "duration": round(duration, 3),
+                "sha256": hashlib.sha256(data).hexdigest(),
+                "created": now,
+                "last_used": now,
+                **(info or {}),
+            }
+            self._verified.pop(key, None)
+            self._evict(keep=key)
+            self._save_manifest()
+        return path
+
+    # ---------- dọn dẹp ----------
+    def total_bytes(self):
+        return sum(entry["size"] for entry in self._entries.values())
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        self._verified.pop(key, None)
+        if entry:
+            try:
+                os.remove(os.path.join(self.cache_dir, entry["file"]))
+            except OSError:
+                pass
+
+    def _evict(self, keep=None):
+        """Xóa các cue lâu không dùng nhất cho đến khi nằm trong hạn mức"""
+        total = self.total_bytes()
+        if total <= self.max_bytes:
+            return
+        by_age = sorted(self._entries.items(), key=lambda item: item[1].get("last_used", 0))
+        for key, entry in by_age:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= entry["size"]
+            self._remove(key)
@@ -0,0 +1,236 @@
+"""Giọng nói của app: nội dung các cue theo ngôn ngữ, tạo vào cache, đóng gói, dựng sprite và marker "đã sẵn sàng".
+
+Dùng chung cho ``app.py`` (nút "Chuẩn Bị Giọng Nói") và ``warmup.py`` (chạy lúc
+build image / khởi động pod), nên cả hai ghi ra đúng cùng các file và cùng marker.
+Mỗi ngôn ngữ có một voice pack (``voice_pack.py``); marker ghi tên gói nên app
+chỉ cần map gói đó, không đọc lại từng file cue.
+"""
+import hashlib
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import metrics
+from audio_format import audio_extension, probe_duration
+from audio_sprite import ensure_sprite, prune_sprites, publish_cues, sprite_key
+from cue_processing import pipeline, process_cue
+from timeline import MAX_COUNTDOWN_VOICE, compile_timeline, timeline_cues
+from voice_pack import open_pack, prune_packs, write_pack
+
+# Streamlit phục vụ thư mục static/ (cạnh app.py) tại /app/static/...
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+AUDIO_DIR = "audio"
+PACK_DIR = os.path.join(AUDIO_DIR, "packs")
+SPRITE_DIR = os.path.join(STATIC_DIR, "sprites")
+CUE_DIR = os.path.join(STATIC_DIR, "cues")
+LOCK_DIR = os.path.join(AUDIO_DIR, ".locks")  # khóa sprite / cue / render, ngoài static/ (cùng chỗ với TTSCache)
+
+COUNTDOWN_TEXTS = {f"countdown_{i}": str(i) for i in range(10, 0, -1)}
+# Mỗi ngôn ngữ một bộ cue (cùng cue id); lang là mã ngôn ngữ của engine TTS
+VOICE_TEXTS = {
+    "vi": {
+        "prepare": "Hãy ngồi thoải mái và chuẩn bị tinh thần",
+        "ready": "Chuẩn bị bắt đầu",
+        "inhale": "Hít vào",
+        "hold": "Giữ hơi",
+        "exhale": "Thở ra",
+        "complete": "Hoàn thành. Chúc mừng bạn",
+        "phase2": "Chuyển sang giai đoạn 2",
+        **COUNTDOWN_TEXTS,
+    },
+    "en": {
+        "prepare": "Sit comfortably and settle your mind",
+        "ready": "Get ready to begin",
+        "inhale": "Breathe in",
+        "hold": "Hold",
+        "exhale": "Breathe out",
+        "complete": "Complete. Well done",
+        "phase2": "Moving to phase two",
+        **COUNTDOWN_TEXTS,
+    },
+}
+LANGUAGES = {"vi": "Tiếng Việt", "en": "English"}
+DEFAULT_LANG = "vi"
+
+def cue_engine(backend):
+    """Tên engine trong khóa cache và marker: engine TTS + cách xử lý cue (cắt lặng, nén)"""
+    return f"{backend.name}-{pipeline()}"
+
+
+def synthesize_to_cache(cache, backend, text, lang='vi', slow=False):
+    """Lấy từ cache hoặc tạo mới (đã cắt lặng, chuẩn hóa, nén); không gọi st.* nên chạy được trong luồng phụ"""
+    def synthesize():
+        metrics.inc("tts_calls", engine=backend.name)
+        with metrics.span("tts_synthesize", engine=backend.name):
+            data = backend.synthesize(text, lang=lang, slow=slow)
+        with metrics.span("cue_process"):
+            return process_cue(data)
+
+    return cache.get_or_create(
+        text,
+        synthesize,
+        lang=lang,
+        slow=slow,
+        engine=cue_engine(backend),
+    )
+
+
+def generate_all(cache, backend, workers, progress=None, lang=DEFAULT_LANG):
+    """Tạo (song song) mọi cue còn thiếu của ngôn ngữ ``lang``; trả về danh sách lỗi "cue: lỗi".
+
+    progress(số đã xong, tổng, tên cue) được gọi ở luồng gọi hàm này.
+    """
+    errors = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(synthesize_to_cache, cache, backend, text, lang): name
+            for name, text in VOICE_TEXTS[lang].items()
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            name = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                errors.append(f"{name}: {e}")
+            if progress:
+                progress(done, len(futures), name)
+    return errors
+
+
+def verify_cues(cache, backend, lang=DEFAULT_LANG):
+    """Kiểm tra từng cue trong cache (hash khớp manifest, đọc được thời lượng); trả về danh sách lỗi"""
+    errors = []
+    for name, text in VOICE_TEXTS[lang].items():
+        path = cache.get(text, lang=lang, engine=cue_engine(backend))  # get() kiểm tra sha256, file hỏng bị bỏ
+        if path is None:
+            errors.append(f"{name}: không có trong cache")
+            continue
+        with open(path, "rb") as f:
+            if not probe_duration(f.read()):
+                errors.append(f"{name}: không đọc được audio")
+    return errors
+
+
+# ==================== VOICE PACK ====================
+def build_pack(cache, backend, lang=DEFAULT_LANG):
+    """Gom các cue của ``lang`` (tạo lại nếu cache đã xóa) thành một voice pack; trả về đường dẫn"""
+    engine = cue_engine(backend)
+    cues = []
+    for name, text in VOICE_TEXTS[lang].items():
+        with open(synthesize_to_cache(cache, backend, text, lang), "rb") as f:
+            data = f.read()
+        entry = cache.entry(text, lang=lang, engine=engine)
+        info = {key: entry[key] for key in ("duration", "speech_duration") if key in entry}
+        cues.append((name, data, info))
+    exts = {audio_extension(data) for _, data, _ in cues}
+    if len(exts) != 1:
+        raise ValueError("Các cue khác định dạng nhau")
+    with metrics.span("pack_build"):
+        return write_pack(PACK_DIR, engine, lang, exts.pop(), cues)
+
+
+def voice_pack(cache, backend, lang=DEFAULT_LANG):
+    """Voice pack đã map của ``lang``: lấy tên gói từ marker, chưa có gói thì đóng gói ngay.
+
+    Gói đóng lại được ghi vào marker (nếu đã có marker) để lần sau không phải đóng gói nữa.
+    """
+    engine = cue_engine(backend)
+    info = read_ready_marker(engine, lang)
+    path = os.path.join(PACK_DIR, info["pack"]) if info and info.get("pack") else None
+    if path is None or not os.path.exists(path):
+        path = build_pack(cache, backend, lang)
+        if info is not None:
+            extra = {key: value for key, value in info.items() if key not in ("engine", "lang", "pack")}
+            write_ready_marker(engine, lang, **extra, pack=os.path.basename(path))
+    return open_pack(path)
+
+
+def common_cue_sets(prepare_times=(10, MAX_COUNTDOWN_VOICE + 1)):
+    """Các bộ cue của những cài đặt hay dùng (đếm ngược, giữ hơi, 2 giai đoạn bật / tắt)"""
+    sets = set()
+    for prepare, hold, two_phase, countdown in itertools.product(prepare_times, (4, 0), (False, True), (True, False)):
+        tl = compile_timeline(prepare, (4, hold, 6), (2, 0, 4) if two_phase else None, 10, 5, countdown)
+        sets.add(tuple(timeline_cues(tl)))
+    return sorted(sets)
+
+
+def build_sprites(sources, cue_sets, pack=None):
+    """Dựng sẵn sprite cho từng bộ cue và đặt từng cue thành file riêng; trả về tên các file sprite"""
+    files = [
+        ensure_sprite({cue: sources[cue] for cue in cues}, SPRITE_DIR, LOCK_DIR, pack)["file"] for cues in cue_sets
+    ]
+    publish_cues(sources, CUE_DIR, LOCK_DIR)
+    return files
+
+
+def prune_stale_sprites():
+    """Xóa sprite / thư mục cue trong static/ không thuộc voice pack mà marker nào đang ghi"""
+    packs = set()
+    for name in os.listdir(AUDIO_DIR) if os.path.isdir(AUDIO_DIR) else []:
+        if not name.startswith("ready-") or name.endswith(".tmp"):
+            continue
+        try:
+            with open(os.path.join(AUDIO_DIR, name), encoding="utf-8") as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if isinstance(info, dict) and info.get("pack"):
+            packs.add(info["pack"])
+    # Thư mục cue của một gói đặt tên theo toàn bộ cue trong gói (publish_cues)
+    cue_dirs = set()
+    for pack in packs:
+        try:
+            cue_dirs.add(sprite_key(open_pack(os.path.join(PACK_DIR, pack)).sources()))
+        except (OSError, ValueError):
+            continue
+    return prune_sprites(SPRITE_DIR, CUE_DIR, LOCK_DIR, packs, cue_dirs)
+
+
+# ==================== MARKER ====================
+_markers = {}  # đường dẫn marker -> ((mtime_ns, size), nội dung)
+
+
+def ready_marker(engine, lang=DEFAULT_LANG):
+    """File đánh dấu đã tạo đủ giọng nói (theo ``cue_engine``, ngôn ngữ và nội dung cue), dùng chung mọi process"""
+    texts = json.dumps(VOICE_TEXTS[lang], sort_keys=True, ensure_ascii=False)
+    digest = hashlib.sha256(texts.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(AUDIO_DIR, f"ready-{engine}-{lang}-{digest}")
+
+
+def write_ready_marker(engine, lang=DEFAULT_LANG, **info):
+    """Ghi marker nguyên tử: mọi session / process khác thấy ngay là đã sẵn sàng.
+
+    Có ``pack`` thì các gói khác của cùng engine + ngôn ngữ (marker không còn ghi) bị xóa.
+    """
+    marker = ready_marker(engine, lang)
+    os.makedirs(os.path.dirname(marker), exist_ok=True)
+    tmp_path = f"{marker}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"created": time.time(), "engine": engine, "lang": lang, "cues": sorted(VOICE_TEXTS[lang]), **info}, f)
+    os.replace(tmp_path, marker)
+    if info.get("pack"):
+        prune_packs(PACK_DIR, engine, lang, keep=info["pack"])
+    return marker
+
+
+def read_ready_marker(engine, lang=DEFAULT_LANG):
+    """Nội dung marker (dict) hoặc None nếu giọng nói chưa sẵn sàng; chỉ đọc lại file khi marker đổi"""
+    marker = ready_marker(engine, lang)
+    try:
+        stat = os.stat(marker)
+    except FileNotFoundError:
+        _markers.pop(marker, None)
+        return None
+    signature = (stat.st_mtime_ns, stat.st_size)
+    cached = _markers.get(marker)
+    if cached and cached[0] == signature:
+        return cached[1]
+    try:
+        with open(marker, encoding="utf-8") as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        info = {}  # marker cũ / ghi tay: vẫn coi là sẵn sàng
+    _markers[marker] = (signature, info)
+    return info
@@ -0,0 +1,237 @@
+"""Hàng đợi tạo giọng nói chạy nền, dùng chung cho cả process.
+
+- ``submit`` một câu: nhiều session xin cùng một cue (cùng text, ngôn ngữ,
+  engine) chỉ tạo một job, nên chỉ gọi TTS một lần.
+- ``submit_language`` xin cả bộ cue của một ngôn ngữ. Các cue thở (hít vào,
+  giữ hơi, thở ra) được đưa vào hàng đợi trước để phiên thiền bắt đầu được sớm.
+  Khi đủ cue, job đóng voice pack và ghi marker ngay trong luồng nền, nên session
+  tải lại trang giữa chừng vẫn thấy tiến độ thay vì tạo lại từ đầu.
+- ``submit_narration`` đọc một bài dẫn dài theo từng câu (``narration.py``):
+  chỉ vài câu được tạo trước, câu xong được ghi dần ra manifest cho player.
+- Session chỉ đọc trạng thái (không chờ): ``LanguageJob.progress``,
+  ``essential_ready``, ``sources()`` của các cue đã xong.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from narration import NARRATION_LOOKAHEAD, NarrationJob, narration_key, prune_narration, publish_chunk, write_manifest
+from tts_cache import cache_key
+from voice_assets import (
+    VOICE_TEXTS,
+    build_pack,
+    cue_engine,
+    prune_stale_sprites,
+    synthesize_to_cache,
+    write_ready_marker,
+)
+
+# Đủ các cue này là bắt đầu thiền được (cue khác player bỏ qua nếu chưa có)
+ESSENTIAL_CUES = ("inhale", "hold", "exhale")
+# Giữ job đã xong trong bộ nhớ bao lâu (giây) để session đang theo dõi kịp đọc kết quả
+KEEP_FINISHED = 600
+
+
+class CueJob:
+    """Tạo một cue vào cache: pending -> running -> done / error"""
+
+    def __init__(self, key, text, lang):
+        self.key = key
+        self.text = text
+        self.lang = lang
+        self.status = "pending"
+        self.path = None
+        self.sha256 = None
+        self.error = None
+        self.finished_at = None
+        self._done = threading.Event()
+
+    @property
+    def finished(self):
+        return self.status in ("done", "error")
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+
+class LanguageJob:
+    """Cả bộ cue của một ngôn ngữ; đủ cue thì đóng gói và ghi marker"""
+
+    def __init__(self, lang, cue_jobs):
+        self.lang = lang
+        self.cue_jobs = cue_jobs  # cue_id -> CueJob (cùng job với session khác nếu trùng cue)
+        self.status = "running"   # running -> done / error
+        self.errors = []
+        self.pack = None
+        self.started = time.time()
+        self.finished_at = None
+
+    @property
+    def finished(self):
+        return self.status in ("done", "error")
+
+    @property
+    def progress(self):
+        return sum(job.finished for job in self.cue_jobs.values()) / len(self.cue_jobs)
+
+    @property
+    def essential_ready(self):
+        return all(self.cue_jobs[cue].status == "done" for cue in ESSENTIAL_CUES if cue in self.cue_jobs)
+
+    def sources(self):
+        """{cue_id: (đường dẫn, sha256)} của các cue đã tạo xong"""
+        return {cue: (job.path, job.sha256) for cue, job in self.cue_jobs.items() if job.status == "done"}
+
+
+class VoiceJobQueue:
+    """Hàng đợi job tạo giọng nói với ``workers`` luồng nền"""
+
+    def __init__(self, cache, backend, workers):
+        self.cache = cache
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._cues = {}       # khóa cache -> CueJob
+        self._languages = {}  # lang -> LanguageJob
+        self._narrations = {}  # khóa bài -> NarrationJob
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="voice-job")
+
+    # ---------- cue ----------
+    def submit(self, text, lang):
+        """CueJob tạo ``text``; đã có job chưa lỗi cho cùng cue thì dùng lại job đó"""
+        key = cache_key(text, lang, False, cue_engine(self.backend))
+        with self._lock:
+            self._prune()
+            job = self._cues.get(key)
+            if job is not None and job.status != "error":
+                metrics.inc("voice_jobs_deduplicated")
+                return job
+            job = self._cues[key] = CueJob(key, text, lang)
+        metrics.inc("voice_jobs_submitted")
+        self._pool.submit(self._run_cue, job)
+        return job
+
+    def _run_cue(self, job):
+        job.status = "running"
+        try:
+            job.path = synthesize_to_cache(self.cache, self.backend, job.text, job.lang)
+            job.sha256 = self.cache.entry(job.text, lang=job.lang, engine=cue_engine(self.backend))["sha256"]
+            job.status = "done"
+        except Exception as e:
+            job.error = str(e)
+            job.status = "error"
+            metrics.inc("voice_jobs_failed")
+        job.finished_at = time.time()
+        job._done.set()
+
+    # ---------- ngôn ngữ ----------
+    def submit_language(self, lang):
+        """LanguageJob của ``lang`` (dùng lại job đang chạy nếu có)"""
+        with self._lock:
+            job = self._languages.get(lang)
+            if job is not None and job.status == "running":
+                return job
+        texts = VOICE_TEXTS[lang]
+        # Cue thở trước: thread pool chạy theo thứ tự đưa vào
+        order = [cue for cue in ESSENTIAL_CUES if cue in texts] + [cue for cue in texts if cue not in ESSENTIAL_CUES]
+        job = LanguageJob(lang, {cue: self.submit(texts[cue], lang) for cue in order})
+        with self._lock:
+            running = self._languages.get(lang)
+            if running is not None and running.status == "running":
+                return running  # session khác vừa gửi cùng lúc
+            self._languages[lang] = job
+        threading.Thread(target=self._finish_language, args=(job,), name=f"voice-pack-{lang}", daemon=True).start()
+        return job
+
+    def language_job(self, lang):
+        """LanguageJob gần nhất của ``lang`` (đang chạy hoặc vừa xong) hoặc None"""
+        with self._lock:
+            return self._languages.get(lang)
+
+    def _finish_language(self, job):
+        for cue_job in job.cue_jobs.values():
+            cue_job.wait()
+        job.errors = [f"{cue}: {cue_job.error}" for cue, cue_job in job.cue_jobs.items() if cue_job.status == "error"]
+        if not job.errors:
+            try:
+                job.pack = build_pack(self.cache, self.backend, job.lang)
+                write_ready_marker(cue_engine(self.backend), job.lang, source="queue", pack=os.path.basename(job.pack))
+                prune_stale_sprites()  # sprite tạm lúc đang tạo cue, sprite của gói cũ
+            except Exception as e:
+                # build_pack tạo lại cue đã bị xóa khỏi cache (lỗi TTS / ffmpeg...): job vẫn phải kết thúc
+                job.errors.append(f"voice pack: {e}")
+        job.status = "error" if job.errors else "done"
+        job.finished_at = time.time()
+        metrics.observe("voice_language_job", job.finished_at - job.started)
+
+    # ---------- bài dẫn ----------
+    def submit_narration(self, sentences, lang, lookahead=NARRATION_LOOKAHEAD):
+        """NarrationJob đọc ``sentences`` (từ split_sentences); bài đang đọc / đã đọc xong thì dùng lại job"""
+        if not sentences:
+            raise ValueError("Bài dẫn không có câu nào")
+        key = narration_key(cue_engine(self.backend), lang, sentences)
+        with self._lock:
+            self._prune()
+            job = self._narrations.get(key)
+            if job is not None and job.status != "error" and (not job.finished or os.path.exists(job.manifest_path)):
+                metrics.inc("narration_jobs_deduplicated")
+                return job
+            job = self._narrations[key] = NarrationJob(key, lang, sentences)
+        try:
+            write_manifest(job)  # player đọc được ngay (chưa có câu nào)
+        except Exception as e:
+            job.errors.append(f"manifest: {e}")
+            job.status = "error"  # không để lần xin sau dùng lại job chưa bao giờ chạy
+            job.finished_at = time.time()
+            raise
+        metrics.inc("narration_jobs_submitted")
+        threading.Thread(
+            target=self._run_narration, args=(job, lookahead), name=f"narration-{key}", daemon=True
+        ).start()
+        return job
+
+    def _run_narration(self, job, lookahead):
+        sentences = job.sentences
+        try:
+            for index, sentence in enumerate(sentences):
+                # Lookahead: luôn có tối đa ``lookahead`` câu đang tạo, tính từ câu đang chờ
+                while len(job.cue_jobs) < min(len(sentences), index + lookahead):
+                    job.cue_jobs.append(self.submit(sentences[len(job.cue_jobs)]["text"], job.lang))
+                cue_job = job.cue_jobs[index]
+                cue_job.wait()
+                chunk = None
+                if cue_job.status == "done":
+                    try:
+                        chunk = {"file": publish_chunk(cue_job.path, cue_job.sha256), "pause": sentence["pause"]}
+                    except Exception as e:
+                        job.errors.append(f"câu {index + 1}: {e}")
+                else:
+                    job.errors.append(f"câu {index + 1}: {cue_job.error}")
+                if chunk and job.first_chunk_at is None:
+                    job.first_chunk_at = time.time()
+                    metrics.observe("narration_first_chunk", job.first_chunk_at - job.started)
+                job.chunks.append(chunk)
+                if index == len(sentences) - 1:
+                    job.status = "done" if any(job.chunks) else "error"
+                    job.finished_at = time.time()
+                write_manifest(job)
+        except Exception as e:
+            # Job phải kết thúc: submit_narration dùng lại job đang chạy cho cùng bài
+            job.errors.append(f"bài dẫn: {e}")
+            job.status = "error"
+            job.finished_at = time.time()
+            try:
+                write_manifest(job)  # player thôi chờ câu tiếp theo
+            except OSError:
+                pass
+            return
+        metrics.observe("narration_job", job.finished_at - job.started)
+        prune_narration(keep={job.manifest_file, *(chunk["file"] for chunk in job.chunks if chunk)})
+
+    def _prune(self):
+        """Bỏ các job đã xong từ lâu (kết quả đã nằm trong cache)"""
+        now = time.time()
+        for jobs in (self._cues, self._narrations):
+            for key in [key for key, job in jobs.items() if job.finished and now - job.finished_at > KEEP_FINISHED]:
+                del jobs[key]
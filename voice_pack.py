@@ -0,0 +1,135 @@
+"""Gói giọng nói (voice pack): mọi cue của một ngôn ngữ / giọng đọc trong một file duy nhất.
+
+Định dạng (little-endian)::
+
+    "VPK1" | uint32 độ dài header | header JSON (UTF-8) | audio các cue nối liền
+
+Header: {"version", "engine", "lang", "ext", "cues": {cue_id: {"offset",
+"length", "duration", "sha256", ...}}}, offset tính từ đầu phần audio. Mỗi cue
+vẫn là một file audio hoàn chỉnh (MP3 / WAV) nên dùng được y như file lẻ.
+
+File được đọc bằng mmap và mở một lần cho cả process: lấy một cue chỉ là cắt
+``memoryview`` trên vùng nhớ đã map (không mở file, không chép bytes), nên
+thêm ngôn ngữ không làm tăng số lần mở / đọc file mỗi lần render. File đặt tên
+theo nội dung và không bao giờ bị ghi đè.
+"""
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+
+MAGIC = b"VPK1"
+PACK_VERSION = 1
+_PREFIX = struct.Struct("<4sI")
+
+_lock = threading.Lock()
+_packs = {}  # đường dẫn -> VoicePack đang mở (dùng chung cả process)
+
+
+def pack_filename(engine, lang, cues):
+    """Tên file theo nội dung: cues là list (cue_id, sha256)"""
+    raw = json.dumps([PACK_VERSION, engine, lang, sorted(cues)])
+    return f"pack-{engine}-{lang}-{hashlib.sha256(raw.encode('utf-8')).hexdigest()[:16]}.vpk"
+
+
+def write_pack(out_dir, engine, lang, ext, cues):
+    """Ghi gói từ cues: list (cue_id, bytes audio, dict thông tin thêm); trả về đường dẫn.
+
+    ext: đuôi file chung của các cue (".mp3" / ".wav").
+
+    Gói đã có (cùng nội dung) thì giữ nguyên. Gói cũ không bị xóa ở đây: marker
+    có thể vẫn ghi tên gói cũ, xem ``prune_packs``.
+    """
+    index = {}
+    offset = 0
+    hashes = []
+    for cue_id, data, info in cues:
+        sha = hashlib.sha256(data).hexdigest()
+        index[cue_id] = {**(info or {}), "offset": offset, "length": len(data), "sha256": sha}
+        hashes.append((cue_id, sha))
+        offset += len(data)
+    filename = pack_filename(engine, lang, hashes)
+    path = os.path.join(out_dir, filename)
+    if os.path.exists(path):
+        return path
+
+    header = json.dumps({
+        "version": PACK_VERSION,
+        "engine": engine,
+        "lang": lang,
+        "ext": ext,
+        "cues": index,
+    }, ensure_ascii=False).encode("utf-8")
+    os.makedirs(out_dir, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_PREFIX.pack(MAGIC, len(header)))
+        f.write(header)
+        for _, data, _ in cues:
+            f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return path
+
+
+def prune_packs(out_dir, engine, lang, keep):
+    """Xóa các gói của cùng engine + ngôn ngữ trừ ``keep`` (process đang map chúng vẫn đọc được tới khi đóng)"""
+    prefix = f"pack-{engine}-{lang}-"
+    for name in os.listdir(out_dir) if os.path.isdir(out_dir) else []:
+        if name.startswith(prefix) and name.endswith(".vpk") and name != keep:
+            try:
+                os.remove(os.path.join(out_dir, name))
+            except OSError:
+                pass
+
+
+class VoicePack:
+    """Gói giọng nói đã map vào bộ nhớ (chỉ đọc)"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, header_len = _PREFIX.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            self._mmap.close()
+            raise ValueError(f"{path} không phải voice pack")
+        header = json.loads(self._mmap[_PREFIX.size:_PREFIX.size + header_len].decode("utf-8"))
+        if header.get("version") != PACK_VERSION:
+            self._mmap.close()
+            raise ValueError(f"{path}: phiên bản voice pack không hỗ trợ")
+        self.engine = header["engine"]
+        self.lang = header["lang"]
+        self.ext = header["ext"]
+        self.index = header["cues"]
+        self._view = memoryview(self._mmap)
+        self._base = _PREFIX.size + header_len
+
+    def cue(self, cue_id):
+        """Audio của cue dạng memoryview trên vùng đã map (không chép)"""
+        entry = self.index[cue_id]
+        start = self._base + entry["offset"]
+        return self._view[start:start + entry["length"]]
+
+    def sources(self):
+        """{cue_id: (memoryview, sha256)} - cùng dạng ``sources`` của ensure_sprite / render_session"""
+        return {cue_id: (self.cue(cue_id), entry["sha256"]) for cue_id, entry in self.index.items()}
+
+    def verify(self):
+        """Danh sách cue có sha256 không khớp header (gói bị hỏng)"""
+        return [cue_id for cue_id, entry in self.index.items()
+                if hashlib.sha256(self.cue(cue_id)).hexdigest() != entry["sha256"]]
+
+
+def open_pack(path):
+    """VoicePack của ``path``, mở một lần cho cả process"""
+    pack = _packs.get(path)
+    if pack is None:
+        with _lock:
+            pack = _packs.get(path)
+            if pack is None:
+                pack = _packs[path] = VoicePack(path)
+    return pack
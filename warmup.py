@@ -0,0 +1,140 @@
+"""Chuẩn bị sẵn giọng nói trước khi app nhận người dùng (lúc build image / khởi động pod).
+
+Với từng ngôn ngữ: tạo và kiểm tra mọi cue giọng nói trong cache, đóng thành
+voice pack, dựng sẵn sprite của các cài đặt hay dùng cùng các cue lẻ trong
+static/, rồi ghi marker "đã sẵn sàng". App thấy marker thì bỏ qua nút "Chuẩn Bị
+Giọng Nói" và phát ngay từ lần mở đầu tiên.
+
+    python warmup.py
+    TTS_BACKEND=espeak python warmup.py --workers 8 --lang vi --json
+
+Chạy lại khi đã sẵn sàng chỉ kiểm tra lại file (không gọi TTS). Mã thoát khác 0
+nếu có cue không tạo / không kiểm tra được (khi đó không ghi marker ngôn ngữ đó).
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import metrics
+from tts_backends import create_backend
+from tts_cache import TTSCache
+from voice_assets import (
+    AUDIO_DIR,
+    LANGUAGES,
+    VOICE_TEXTS,
+    build_pack,
+    build_sprites,
+    common_cue_sets,
+    cue_engine,
+    generate_all,
+    prune_stale_sprites,
+    ready_marker,
+    verify_cues,
+    write_ready_marker,
+)
+from voice_pack import open_pack
+
+
+def _tts_calls():
+    return sum(value for name, _, value in metrics.snapshot()["counters"] if name == "tts_calls")
+
+
+def warmup_language(cache, backend, lang, workers, sprites=True, log=print):
+    """Các bước chuẩn bị của một ngôn ngữ; trả về dict kết quả (``ok`` = đã ghi marker)"""
+    texts = VOICE_TEXTS[lang]
+    result = {"cues": len(texts), "steps": {}}
+    calls = _tts_calls()
+    started = time.perf_counter()
+    log(f"🎙️ [{lang}] Tạo giọng nói ({backend.name}, {len(texts)} cue)...")
+    errors = generate_all(cache, backend, workers, lang=lang)
+    result["steps"]["generate_s"] = round(time.perf_counter() - started, 3)
+    result["tts_calls"] = _tts_calls() - calls
+
+    if not errors:
+        started = time.perf_counter()
+        log(f"🔍 [{lang}] Kiểm tra file giọng nói...")
+        errors = verify_cues(cache, backend, lang)
+        result["steps"]["verify_s"] = round(time.perf_counter() - started, 3)
+        entries = [cache.entry(text, lang=lang, engine=cue_engine(backend)) or {} for text in texts.values()]
+        result["cue_bytes"] = sum(entry.get("size", 0) for entry in entries)
+        result["source_bytes"] = sum(entry.get("source_bytes", entry.get("size", 0)) for entry in entries)
+        result["trimmed_s"] = round(sum(entry.get("trimmed", 0) for entry in entries), 3)
+
+    pack = None
+    if not errors:
+        started = time.perf_counter()
+        log(f"🗃️ [{lang}] Đóng gói voice pack...")
+        try:
+            pack = open_pack(build_pack(cache, backend, lang))
+            errors = [f"{cue}: sai checksum trong voice pack" for cue in pack.verify()]
+            result["pack"] = os.path.basename(pack.path)
+            result["pack_bytes"] = os.path.getsize(pack.path)
+        except (OSError, ValueError) as e:
+            errors = [f"pack: {e}"]
+        result["steps"]["pack_s"] = round(time.perf_counter() - started, 3)
+
+    if not errors and sprites:
+        started = time.perf_counter()
+        cue_sets = common_cue_sets()
+        log(f"📦 [{lang}] Dựng sprite cho {len(cue_sets)} bộ cue...")
+        try:
+            result["sprites"] = build_sprites(pack.sources(), cue_sets, result["pack"])
+        except (OSError, ValueError) as e:
+            errors = [f"sprite: {e}"]
+        result["steps"]["sprites_s"] = round(time.perf_counter() - started, 3)
+
+    result["errors"] = errors
+    result["ok"] = not errors
+    if result["ok"]:
+        result["marker"] = write_ready_marker(
+            cue_engine(backend), lang, source="warmup", pack=result["pack"], sprites=result.get("sprites", []),
+        )
+        prune_stale_sprites()
+    return result
+
+
+def warmup(workers, langs=tuple(LANGUAGES), sprites=True, log=print):
+    """Chuẩn bị mọi ngôn ngữ trong ``langs``; trả về {"engine", "languages": {lang: kết quả}, "ok"}"""
+    backend = create_backend(pool_size=workers)
+    cache = TTSCache(AUDIO_DIR)
+    try:
+        languages = {lang: warmup_language(cache, backend, lang, workers, sprites, log) for lang in langs}
+    finally:
+        backend.close()
+    return {
+        "engine": cue_engine(backend),
+        "languages": languages,
+        "ok": all(result["ok"] for result in languages.values()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("TTS_WORKERS", "6")),
+                        help="số luồng tạo giọng nói song song (mặc định TTS_WORKERS hoặc 6)")
+    parser.add_argument("--lang", action="append", choices=sorted(LANGUAGES),
+                        help="ngôn ngữ cần chuẩn bị, lặp lại được (mặc định tất cả)")
+    parser.add_argument("--skip-sprites", action="store_true", help="không dựng sẵn sprite (app tự dựng khi cần)")
+    parser.add_argument("--json", action="store_true", help="in kết quả dạng JSON")
+    args = parser.parse_args()
+
+    log = (lambda message: print(message, file=sys.stderr)) if args.json else print
+    result = warmup(args.workers, args.lang or tuple(LANGUAGES), sprites=not args.skip_sprites, log=log)
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        return 0 if result["ok"] else 1
+    for lang, language in result["languages"].items():
+        if language["ok"]:
+            print(f"✅ [{lang}] Giọng nói đã sẵn sàng: {language['marker']} ({language['tts_calls']} lần gọi TTS, "
+                  f"gói {language['pack_bytes'] // 1024} KB, {len(language.get('sprites', []))} sprite)")
+        else:
+            for error in language["errors"]:
+                print(f"❌ [{lang}] {error}", file=sys.stderr)
+            print(f"Chưa ghi marker {ready_marker(result['engine'], lang)}", file=sys.stderr)
+    return 0 if result["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())